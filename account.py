@@ -0,0 +1,411 @@
+''' One Nest account: its token, REST Streaming worker, API connection, command queue and data '''
+import time
+from threading import Lock
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+import codec
+import metrics
+from converters import id_2_addr
+from dispatch import diff_snapshots, get_element, alarm_transition, ALARM_KINDS
+from command_queue import CommandQueue
+from streaming import StreamWorker
+from nest_api import ApiConnection, connect, NEST_API_URL, NEST_AUTH_URL
+from node_types import PROJECTION, node_type_for
+from projection import project, merge, restrict, resolve, ROOT_SCOPE
+
+LOGGER = polyinterface.LOGGER
+
+''' Seconds to wait for the first REST Streaming put before discovering over REST '''
+DISCOVERY_TIMEOUT = 60
+
+
+class Account(object):
+    '''
+    Everything that belongs to one Nest token. The controller owns the
+    nodes, the dispatcher and the timers, an account only feeds them. Every
+    account has its own stream and its own command queue, so the Nest rate
+    limits of one home never hold back commands to another. The primary
+    account (name None) keeps the node addresses it always had, the nodes of
+    other accounts get addresses namespaced by the account name.
+    With scopes other than the root there is one stream per scope, each put
+    is merged into the shared snapshot at its path.
+    '''
+    def __init__(self, controller, name=None):
+        self.controller = controller
+        self.name = name
+        self.auth_token = None
+        self.api = ApiConnection()
+        self.api_data = None
+        self.command_queue = CommandQueue(self._sendChange)
+        self.scopes = (ROOT_SCOPE,)
+        ''' scope -> StreamWorker '''
+        self.streams = {}
+        self.data = None
+        self.data_version = 0
+        self.warm_data = False
+        ''' kind -> element_id -> node for every structure and device we have a node for '''
+        self.element_index = {}
+        self.stream_last_update = int(time.time())
+        self.discovery = None
+        self.discovery_pending = False
+        self.discovery_requested = 0
+        self.discovery_lock = Lock()
+        self.rediscovery_needed = False
+        ''' Scopes whose first put has not arrived yet, discovery waits for all of them '''
+        self.scopes_pending = set()
+        ''' Puts from the streams of different scopes are applied one at a time '''
+        self.put_lock = Lock()
+
+    @property
+    def primary(self):
+        return self.name is None
+
+    def address(self, element_id):
+        if self.primary:
+            return id_2_addr(element_id)
+        return id_2_addr('{}/{}'.format(self.name, element_id))
+
+    def label(self, name):
+        ''' Node names of other accounts carry the account name, homes tend to use the same room names '''
+        return name if self.primary else '{} {}'.format(self.name, name)
+
+    def start(self):
+        self.command_queue.start()
+
+    def stop(self):
+        for stream in self.streams.values():
+            stream.stop()
+        self.command_queue.stop()
+        self.api.close()
+
+    def poll(self):
+        ''' longPoll housekeeping for this account '''
+        if self.discovery_pending and int(time.time()) - self.discovery_requested > DISCOVERY_TIMEOUT:
+            LOGGER.warning('{}: no data received from REST Streaming, falling back to REST discovery'.format(self))
+            self.rediscovery_needed = True
+        if self.rediscovery_needed:
+            if self.discover():
+                self.rediscovery_needed = False
+            else:
+                return False
+        self.checkStreaming()
+        if self.auth_token is not None:
+            self.api.keepWarm()
+        return True
+
+    def checkStreaming(self):
+        if self.auth_token is None or self.discovery:
+            return False
+        for scope in self.scopes:
+            stream = self.streams.get(scope)
+            if stream is None:
+                LOGGER.debug('{}: starting REST Streaming thread for {} for the first time.'.format(self, scope))
+                self._startStreaming(scope)
+            elif stream.is_alive():
+                if time.time() - stream.last_event > 1800:
+                    LOGGER.error('{}: no updates from streaming thread {} for >30 minutes, forcing a reconnect'.format(self, stream.name))
+                    stream.last_event = time.time()
+                    stream.reconnect()
+            else:
+                LOGGER.warning('{}: REST Streaming thread {} died, attempting to restart.'.format(self, stream.name))
+                self._startStreaming(scope)
+        return True
+
+    def _startStreaming(self, scope):
+        name = 'NestStream' if self.primary else 'NestStream-{}'.format(self.name)
+        url = NEST_API_URL
+        if scope != ROOT_SCOPE:
+            name += scope
+            url = NEST_API_URL.rstrip('/') + scope
+        self.streams[scope] = StreamWorker(url, lambda: self.auth_token,
+                                           lambda event_type, event_data: self.processEvent(event_type, event_data, scope), name=name)
+        self.streams[scope].start()
+
+    @property
+    def connected(self):
+        return bool(self.streams) and all(stream.connected for stream in self.streams.values())
+
+    def processEvent(self, event_type, event_data, scope=ROOT_SCOPE):
+        ''' Handle one REST Streaming event, returns False when the stream should be closed '''
+        self.stream_last_update = int(time.time())
+        metrics.EVENTS.inc(event_type)
+        if self.controller.recorder is not None:
+            self.controller.recorder.record(event_type, event_data, scope, self.name)
+        if event_type == 'open':  # not always received here
+            LOGGER.debug('The event stream has been opened')
+        elif event_type == 'put':
+            LOGGER.debug('The data has changed (or initial data sent)')
+            received = time.perf_counter()
+            with self.put_lock:
+                with metrics.PARSE_TIME.time():
+                    event_data = codec.loads(event_data)
+                    path = resolve(scope, event_data.get('path', ROOT_SCOPE))
+                    ''' Keep only what the nodes read, unrelated fields no longer trigger updates '''
+                    if path == ROOT_SCOPE:
+                        put_data = project(event_data['data'], PROJECTION)
+                    else:
+                        put_data = merge(self.data, path, event_data['data'], PROJECTION)
+                self.scopes_pending.discard(scope)
+                self.processPut(put_data, received)
+        elif event_type == 'keep-alive':
+            LOGGER.debug('No data updates. Receiving an HTTP header to keep the connection open.')
+        elif event_type == 'auth_revoked':
+            LOGGER.warning('{}: the API authorization has been revoked. {}'.format(self, event_data))
+            self.auth_token = None
+            self.controller.tokenRevoked(self)
+            return False
+        elif event_type == 'error':
+            LOGGER.error('Error occurred, such as connection closed: {}'.format(event_data))
+            return False
+        elif event_type == 'cancel':
+            LOGGER.warning('Cancel event received, reconnecting')
+            return False
+        else:
+            LOGGER.error('REST Streaming: Unhandled event {} {}'.format(event_type, event_data))
+            return False
+        return True
+
+    def processPut(self, new_data, received=None):
+        '''
+        Only update nodes whose structure or device subtree has changed,
+        smoke and CO alarm transitions are published before anything else
+        '''
+        controller = self.controller
+        old_data = self.data
+        ''' From here on new_data shares the elements that did not change with the previous snapshot '''
+        changed, new_data = diff_snapshots(old_data, new_data)
+        self.data = new_data
+        self.data_version += 1
+        self.warm_data = False
+        alarms = []
+        updates = []
+        for kind, element_id in changed:
+            node = self.element_index.get(kind, {}).get(element_id)
+            element = get_element(new_data, kind, element_id)
+            if node is None:
+                if element is not None and not self.discovery_pending:
+                    self._hotAdd(kind, element_id, element)
+            elif element is None:
+                self._retireNode(node)
+            elif kind in ALARM_KINDS and alarm_transition(get_element(old_data, kind, element_id), element):
+                alarms.append(node)
+            else:
+                updates.append(node)
+        for node in alarms:
+            ''' Inline on the reader thread, the workers may be busy with older events '''
+            node.updateAlarms()
+            if received is not None:
+                metrics.ALARM_LATENCY.observe(time.perf_counter() - received, type(node).__name__)
+            LOGGER.warning('{} alarm state changed: smoke {}, co {}'.format(
+                node.name, node.data.get('smoke_alarm_state'), node.data.get('co_alarm_state')))
+            controller.dispatcher.submit(node, priority=True)
+        for node in updates:
+            controller.dispatcher.submit(node)
+        updated = len(alarms) + len(updates)
+        skipped = max(0, sum(len(nodes) for nodes in self.element_index.values()) - updated)
+        controller.update_stats['updated'] += updated
+        controller.update_stats['skipped'] += skipped
+        if self.discovery_pending and not self.scopes_pending:
+            ''' First put carries the whole tree, build the nodes from it '''
+            self._discoverFrom(new_data)
+        LOGGER.debug('{} element(s) changed, {} node(s) updated, {} skipped'.format(len(changed), updated, skipped))
+
+    def _hotAdd(self, kind, element_id, element):
+        ''' A device or structure showed up on the stream after discovery '''
+        name = element.get('name_long', element.get('name'))
+        LOGGER.info('New {} detected on the stream: {} ({})'.format(kind, name, self.address(element_id)))
+        if self._addElement(kind, element_id, element) is not None:
+            self.controller.update_stats['added'] += 1
+
+    def _retireNode(self, node):
+        '''
+        The element is gone from the Nest data. The node is left in the ISY so
+        programs referencing it keep working, it simply stops updating and is
+        adopted again if the element comes back
+        '''
+        LOGGER.warning('{} {} is no longer reported by Nest, node {} retired'.format(node.kind, node.name, node.address))
+        self.element_index.get(node.kind, {}).pop(node.element_id, None)
+        self.controller.command_tracker.forget(node)
+        node.retired = True
+        self.controller.update_stats['retired'] += 1
+
+    def requestDiscovery(self):
+        ''' Nodes are discovered from the first REST Streaming put, REST is only a fallback '''
+        self.discovery_pending = True
+        self.discovery_requested = int(time.time())
+        self.scopes_pending = set(self.scopes) - set(self.streams)
+        self.checkStreaming()
+
+    def discover(self):
+        LOGGER.info('Discovering Nest Products...' if self.primary else 'Discovering Nest Products of {}...'.format(self))
+        if self.auth_token is None:
+            return False
+
+        if self.connected and self.data is not None and not self.warm_data:
+            ''' The live stream keeps self.data current, no need for another REST snapshot '''
+            return self._discoverFrom(self.data)
+
+        if not self.getState():
+            return False
+
+        ''' Copy initial data if REST Streaming is not active yet '''
+        if self.data is None:
+            self.data = self.api_data
+            self.data_version += 1
+        elif self.warm_data:
+            ''' Nodes restored from the snapshot are reconciled with the live state '''
+            self.processPut(self.api_data)
+        return self._discoverFrom(self.api_data)
+
+    def _discoverFrom(self, data):
+        with self.discovery_lock:
+            self.discovery = True
+            result = self._addNodes(data)
+            self.discovery = False
+            if result:
+                self.discovery_pending = False
+                self.controller.update_nodes = False
+        return result
+
+    def _addNodes(self, data):
+        if 'structures' not in data:
+            LOGGER.error('Nest API did not return any structures')
+            return False
+
+        structures = data['structures']
+        LOGGER.info("Found {} structure(s)".format(len(structures)))
+
+        for struct_id, struct in structures.items():
+            LOGGER.info("Id: {}, Name: {}".format(self.address(struct_id), struct['name']))
+            self._addElement('structures', struct_id, struct)
+
+        if 'thermostats' in data['devices']:
+            thermostats = data['devices']['thermostats']
+            LOGGER.info("Found {} thermostat(s)".format(len(thermostats)))
+
+            for tstat_id, tstat in thermostats.items():
+                LOGGER.info("Id: {}, Name: {}".format(self.address(tstat_id), tstat['name_long']))
+                self._addElement('thermostats', tstat_id, tstat)
+
+        if 'smoke_co_alarms' in data['devices']:
+            smokedets = data['devices']['smoke_co_alarms']
+            LOGGER.info("Found {} smoke detector(s)".format(len(smokedets)))
+            for smkdet_id, smkdet in smokedets.items():
+                LOGGER.info("Id: {}, Name: {}".format(self.address(smkdet_id), smkdet['name_long']))
+                self._addElement('smoke_co_alarms', smkdet_id, smkdet)
+
+        if 'cameras' in data['devices']:
+            cams = data['devices']['cameras']
+            LOGGER.info("Found {} camera(s)".format(len(cams)))
+            for cam_id, camera in cams.items():
+                LOGGER.info("Id: {}, Name: {}".format(self.address(cam_id), camera['name_long']))
+                self._addElement('cameras', cam_id, camera)
+
+        return True
+
+    def _addElement(self, kind, element_id, element):
+        ''' Create the node for a structure or device, or adopt the one that already exists '''
+        controller = self.controller
+        address = self.address(element_id)
+        node = controller.nodes.get(address)
+        if node is None:
+            node_type = node_type_for(kind, element)
+            if node_type is None:
+                return None
+            node = self.createNode(node_type, address, self.label(element['name']), element_id, element)
+            controller.addNode(node, update=controller.update_nodes)
+        else:
+            self.element_index.setdefault(kind, {})[element_id] = node
+            if node.retired:
+                LOGGER.info('{} {} is back, node {} resumed'.format(kind, node.name, address))
+                node.retired = False
+                node.update()
+        return node
+
+    def createNode(self, node_type, address, name, element_id, element):
+        node = node_type(self.controller, self.controller.address, address, name, element_id, element)
+        node.account = self
+        self.element_index.setdefault(node.kind, {})[element_id] = node
+        return node
+
+    def getState(self):
+        if not self.auth_token:
+            return False
+        headers = {'authorization': "Bearer {0}".format(self.auth_token)}
+        try:
+            status, body = self.api.request("GET", "/", headers=headers)
+        except Exception as e:
+            LOGGER.error('Nest API Connection error: {}'.format(e))
+            return False
+
+        if status != 200:
+            LOGGER.error('BAD API response status {}: {}'.format(status, body.decode("utf-8")))
+            return False
+
+        self.api_data = restrict(codec.loads(body), self.scopes, PROJECTION)
+        return True
+
+    def sendChange(self, url, payload, callback=None):
+        '''
+        Queue a change for the Nest API and return immediately, the returned
+        Future (and optional callback) receives the outcome of the PUT.
+        False, as before the queue, when there is no token or nothing to send.
+        '''
+        if not self.auth_token:
+            LOGGER.error('sendChange: no auth_token')
+            return False
+        if len(payload) < 1:
+            LOGGER.error('Empty payload!')
+            return False
+        return self.command_queue.put(url, payload, callback)
+
+    def _sendChange(self, url, payload):
+        if not self.auth_token:
+            LOGGER.error('sendChange: no auth_token')
+            return False
+        command = codec.dumps(payload)
+        headers = {'authorization': "Bearer {0}".format(self.auth_token)}
+        LOGGER.debug('Sending {} to {}'.format(command, url))
+        try:
+            with metrics.COMMAND_TIME.time():
+                status, body = self.api.request("PUT", url, command, headers)
+        except Exception as e:
+            LOGGER.error('Nest API Connection error: {}'.format(e))
+            metrics.COMMAND_STATUS.inc('error')
+            return False
+        metrics.COMMAND_STATUS.inc(str(status))
+        if status != 200:
+            LOGGER.error("sendChange: BAD API Response {}: {}".format(status, body.decode("utf-8")))
+            return False
+
+        rsp_data = codec.loads(body)
+        LOGGER.debug('API Response: {}'.format(codec.dumps(rsp_data)))
+        return True
+
+    def delete(self):
+        ''' Revoke the auth token, returns False when Nest could not be reached '''
+        if not self.auth_token:
+            return True
+        LOGGER.warning('{}: Nest API Authentication token will now be revoked'.format(self))
+        auth_conn = connect(NEST_AUTH_URL)
+        try:
+            auth_conn.request("DELETE", "/oauth2/access_tokens/"+self.auth_token)
+        except Exception as e:
+            LOGGER.error('Nest API Connection error: {}'.format(e))
+            auth_conn.close()
+            return False
+        res = auth_conn.getresponse()
+        if res.status == 204:
+            LOGGER.info('{}: revoke successful'.format(self))
+        else:
+            data = res.read().decode("utf-8")
+            LOGGER.info('{}: delete returned: {}'.format(self, data))
+        auth_conn.close()
+        self.auth_token = None
+        return True
+
+    def __str__(self):
+        return 'Nest account' if self.primary else 'Nest account {}'.format(self.name)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+'''
+JSON backend micro-benchmark: decode and encode Nest payloads with every
+backend codec.py can use on this machine.
+
+Payloads are full put events for synthetic homes, or recorded Nest API
+snapshots given with --data (one JSON document per file).
+
+    ./benchmarks/bench_codec.py --sizes 10,100,1000 --output codec.json
+    ./benchmarks/bench_codec.py --data nest_state.json
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import polystub
+sys.modules['polyinterface'] = polystub
+
+import codec
+import nest_sim
+from bench_stream import home_size
+
+
+def best_of(func, arg, number, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func(arg)
+        elapsed = (time.perf_counter() - start) / number
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run_payload(name, payload, number, repeat):
+    data = json.loads(payload)
+    encoded = payload.encode('utf-8')
+    result = {'payload': name, 'payload_kb': len(encoded) / 1024, 'backends': {}}
+    for backend in codec.available():
+        codec.use(backend)
+        result['backends'][backend] = {
+            'loads_us': 1e6 * best_of(codec.loads, encoded, number, repeat),
+            'dumps_us': 1e6 * best_of(codec.dumps, data, number, repeat),
+        }
+    baseline = result['backends']['json']
+    for timings in result['backends'].values():
+        timings['loads_speedup'] = baseline['loads_us'] / timings['loads_us']
+        timings['dumps_speedup'] = baseline['dumps_us'] / timings['dumps_us']
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated device counts')
+    parser.add_argument('--data', nargs='*', help='recorded Nest API JSON snapshots to use instead of synthetic homes')
+    parser.add_argument('--number', type=int, default=20, help='calls per timing run')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    polystub.LOGGER.setLevel('WARNING')
+    payloads = []
+    if args.data:
+        for path in args.data:
+            with open(path) as f:
+                payloads.append((os.path.basename(path), json.dumps({'path': '/', 'data': json.load(f)})))
+    else:
+        for devices in [int(size) for size in args.sizes.split(',')]:
+            data = nest_sim.make_home(seed=args.seed, **home_size(devices))
+            payloads.append(('{} devices'.format(devices), json.dumps({'path': '/', 'data': data})))
+
+    results = []
+    for name, payload in payloads:
+        result = run_payload(name, payload, args.number, args.repeat)
+        results.append(result)
+        sys.stderr.write('{} ({:.0f}KB): {}\n'.format(name, result['payload_kb'], ', '.join(
+            '{} loads {:.0f}us dumps {:.0f}us'.format(backend, timings['loads_us'], timings['dumps_us'])
+            for backend, timings in result['backends'].items())))
+
+    report = {
+        'benchmark': 'codec',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+'''
+Memory benchmark: per device footprint of the node server.
+
+For each home size the controller discovers the home from a REST Streaming
+put on top of polystub, then receives a stream of changes. Reported are
+the bytes retained per device after discovery and after the changes
+(nodes, their state and the Nest snapshot they read), and the bytes of a
+bare node instance per node type.
+
+    ./benchmarks/bench_memory.py --sizes 10,100,1000 --output memory.json
+'''
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import polystub
+sys.modules['polyinterface'] = polystub
+
+import nest_sim
+import nest2
+from bench_stream import home_size, put_event
+
+
+def traced():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def node_sizes(data, count=200):
+    ''' Bytes per bare node instance, by node type '''
+    controller = nest2.Controller(polystub.Interface('Nest2'))
+    controller.account.data = data
+    sizes = {}
+    for kind, node_type in (('structures', nest2.NODE_TYPES['NEST_STR']), ('thermostats', nest2.NODE_TYPES['NEST_TST_F']),
+                            ('smoke_co_alarms', nest2.NODE_TYPES['NEST_SMK']), ('cameras', nest2.NODE_TYPES['NEST_CAM'])):
+        container = data['structures'] if kind == 'structures' else data['devices'].get(kind)
+        if not container:
+            continue
+        element_id, element = next(iter(container.items()))
+        base = traced()
+        nodes = [node_type(controller, 'nestctrl', 'n{}'.format(index), element['name'], element_id, element)
+                 for index in range(count)]
+        sizes[node_type.__name__] = (traced() - base) / count
+        del nodes
+    return sizes
+
+
+def run_size(devices, events, seed):
+    rnd = random.Random(seed)
+    data = nest_sim.make_home(seed=seed, **home_size(devices))
+    total = sum(len(elements) for elements in data['devices'].values()) + len(data['structures'])
+    payload = put_event(data)
+
+    base = traced()
+    poly = polystub.Interface('Nest2')
+    controller = nest2.Controller(poly)
+    controller.account.auth_token = 'c.sim'
+    controller.account.discovery_pending = True
+    controller.dispatcher.start()
+    controller.account.processEvent('put', payload)
+    controller.dispatcher.join()
+    poly.clear()
+    discovered = traced() - base
+
+    for _ in range(events):
+        nest_sim.mutate(data, rnd)
+        controller.account.processEvent('put', put_event(data))
+        controller.dispatcher.join()
+        poly.clear()
+    steady = traced() - base
+    controller.dispatcher.stop()
+
+    return {
+        'devices': devices,
+        'elements': total,
+        'nodes': len(controller.nodes) - 1,
+        'bytes_per_device_discovered': discovered / total,
+        'bytes_per_device_steady': steady / total,
+        'node_bytes_by_type': node_sizes(data),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated device counts')
+    parser.add_argument('--events', type=int, default=200, help='changes streamed after discovery')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    polystub.LOGGER.setLevel('WARNING')
+    tracemalloc.start()
+    results = []
+    for devices in [int(size) for size in args.sizes.split(',')]:
+        result = run_size(devices, args.events, args.seed)
+        results.append(result)
+        sys.stderr.write('{} devices: {:.0f} bytes/device after discovery, {:.0f} after {} changes, nodes {}\n'.format(
+            devices, result['bytes_per_device_discovered'], result['bytes_per_device_steady'], args.events,
+            ', '.join('{} {:.0f}'.format(name, size) for name, size in result['node_bytes_by_type'].items())))
+    tracemalloc.stop()
+
+    report = {
+        'benchmark': 'memory',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+'''
+Field projection benchmark: full Nest API snapshots against the compact
+records built from the fields the node types declare.
+
+For homes of increasing camera count it reports decode time with and
+without projection, memory retained by the snapshot and how many elements
+a stream of mutations marks as changed (each one is a node update).
+
+    ./benchmarks/bench_projection.py --cameras 10,100,500 --events 200 --output projection.json
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import polystub
+sys.modules['polyinterface'] = polystub
+
+import nest_sim
+from dispatch import diff_snapshots
+from projection import project
+from node_types import PROJECTION
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def retained(func):
+    ''' Bytes still allocated by the object func() builds '''
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    result = func()
+    size = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def count_changes(data, events, seed, projected):
+    rnd = random.Random(seed)
+    data = json.loads(json.dumps(data))
+    old = project(data, PROJECTION) if projected else json.loads(json.dumps(data))
+    changes = 0
+    for _ in range(events):
+        nest_sim.mutate(data, rnd)
+        new = json.loads(json.dumps(data))
+        if projected:
+            new = project(new, PROJECTION)
+        changed, new = diff_snapshots(old, new)
+        changes += len(changed)
+        old = new
+    return changes
+
+
+def run_size(cameras, events, seed, repeat):
+    data = nest_sim.make_home(structures=1, thermostats=max(1, cameras // 4), protects=max(1, cameras // 4),
+                              cameras=cameras, seed=seed)
+    payload = json.dumps({'path': '/', 'data': data})
+    full = best_of(lambda: json.loads(payload), repeat)
+    projected = best_of(lambda: project(json.loads(payload)['data'], PROJECTION), repeat)
+    return {
+        'cameras': cameras,
+        'payload_kb': len(payload) / 1024,
+        'decode_ms': {'full': 1000 * full, 'projected': 1000 * projected},
+        'retained_kb': {'full': retained(lambda: json.loads(payload)) / 1024,
+                        'projected': retained(lambda: project(json.loads(payload)['data'], PROJECTION)) / 1024},
+        'changed_elements': {'full': count_changes(data, events, seed, False),
+                             'projected': count_changes(data, events, seed, True)},
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cameras', default='10,100,500', help='comma separated camera counts')
+    parser.add_argument('--events', type=int, default=200, help='mutations used to count changed elements')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    results = []
+    for cameras in [int(size) for size in args.cameras.split(',')]:
+        result = run_size(cameras, args.events, args.seed, args.repeat)
+        results.append(result)
+        sys.stderr.write('{} cameras: decode {:.2f}ms -> {:.2f}ms, retained {:.0f}KB -> {:.0f}KB, changes {} -> {}\n'.format(
+            cameras, result['decode_ms']['full'], result['decode_ms']['projected'],
+            result['retained_kb']['full'], result['retained_kb']['projected'],
+            result['changed_elements']['full'], result['changed_elements']['projected']))
+
+    report = {
+        'benchmark': 'projection',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+'''
+End-to-end benchmark: REST Streaming put event to driver update.
+
+Runs the real Controller and node types on top of polystub, discovers a
+synthetic home served by nest_sim, then feeds put events through
+Account.processEvent and measures what reaches Polyglot.
+
+    ./benchmarks/bench_stream.py --sizes 1,10,100,1000 --events 200 --output bench.json
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import polystub
+sys.modules['polyinterface'] = polystub
+
+import codec
+import nest_sim
+
+SIM_PORT = 18780
+os.environ['NEST_API_URL'] = 'http://127.0.0.1:{}'.format(SIM_PORT)
+import nest2
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def home_size(devices):
+    ''' Split a device count the way a typical install looks '''
+    thermostats = max(1, devices // 2)
+    protects = devices * 3 // 10
+    cameras = devices - thermostats - protects
+    return {'structures': max(1, devices // 20), 'thermostats': thermostats,
+            'protects': protects, 'cameras': max(0, cameras)}
+
+
+def make_controller(sim, data):
+    sim.data = data
+    poly = polystub.Interface('Nest2')
+    controller = nest2.Controller(poly)
+    controller.polyConfig['customData'] = {'access_token': 'c.sim'}
+    controller._getToken()
+    controller.dispatcher.start()
+    if not controller.discover():
+        raise RuntimeError('Discovery against the Nest API stand-in failed')
+    return poly, controller
+
+
+def instrument(controller, cpu_by_type, updates_by_type):
+    ''' Wrap every node update() to collect CPU time per node type '''
+    for node in controller.nodes.values():
+        if node is controller:
+            continue
+
+        def timed_update(node=node, update=node.update):
+            start = time.thread_time()
+            update()
+            cpu_by_type[type(node).__name__] += time.thread_time() - start
+            updates_by_type[type(node).__name__] += 1
+        node.update = timed_update
+
+
+def put_event(data):
+    return json.dumps({'path': '/', 'data': data})
+
+
+def run_size(sim, data, events, seed, alloc_events):
+    rnd = random.Random(seed)
+    poly, controller = make_controller(sim, data)
+    ''' First put carries the full tree, like a fresh stream '''
+    controller.account.processEvent('put', put_event(data))
+    controller.dispatcher.join()
+    cpu_by_type = defaultdict(float)
+    updates_by_type = defaultdict(int)
+    instrument(controller, cpu_by_type, updates_by_type)
+    skipped = controller.update_stats['skipped']
+
+    latencies = []
+    wall = 0.0
+    cpu = 0.0
+    drivers = 0
+    commands = 0
+    for _ in range(events):
+        nest_sim.mutate(data, rnd)
+        payload = put_event(data)
+        poly.clear()
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        controller.account.processEvent('put', payload)
+        ''' Node updates run on the dispatcher, the event is done once it drained '''
+        controller.dispatcher.join()
+        wall += time.perf_counter() - start
+        cpu += time.process_time() - cpu_start
+        for ts, message in poly.messages:
+            if 'status' in message:
+                drivers += 1
+                latencies.append(ts - start)
+            elif 'command' in message:
+                commands += 1
+    skipped = controller.update_stats['skipped'] - skipped
+    cpu_by_type = dict(cpu_by_type)
+    updates_by_type = dict(updates_by_type)
+
+    tracemalloc.start()
+    alloc_peaks = []
+    for _ in range(alloc_events):
+        nest_sim.mutate(data, rnd)
+        payload = put_event(data)
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        controller.account.processEvent('put', payload)
+        controller.dispatcher.join()
+        alloc_peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    controller.dispatcher.stop()
+
+    return {
+        'events': events,
+        'events_per_sec': events / wall if wall else None,
+        'wall_ms_per_event': 1000 * wall / events,
+        'cpu_ms_per_event': 1000 * cpu / events,
+        'latency_ms': {'p50': 1000 * percentile(latencies, 50) if latencies else None,
+                       'p99': 1000 * percentile(latencies, 99) if latencies else None},
+        'driver_updates': drivers,
+        'command_reports': commands,
+        'node_updates': updates_by_type,
+        'node_updates_skipped': skipped,
+        'node_updates_dropped': controller.dispatcher.stats['dropped'],
+        'cpu_ms_per_update_by_node_type': {name: 1000 * cpu_by_type[name] / updates_by_type[name]
+                                           for name in updates_by_type},
+        'alloc_peak_kb_per_event': sum(alloc_peaks) / len(alloc_peaks) / 1024 if alloc_peaks else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,10,100,1000', help='comma separated device counts')
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--alloc-events', type=int, default=20, help='events measured under tracemalloc')
+    parser.add_argument('--data', help='recorded Nest API JSON snapshot to use instead of synthetic homes')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json-backend', default='json', help='codec.py backend: auto, orjson, ujson or json')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    polystub.LOGGER.setLevel('WARNING')
+    json_backend = codec.use(args.json_backend)
+    sim = nest_sim.NestSim({}, keepalive=30)
+    nest_sim.serve(sim, '127.0.0.1', SIM_PORT)
+
+    if args.data:
+        with open(args.data) as f:
+            homes = [('recorded', json.load(f))]
+    else:
+        homes = []
+        for devices in [int(size) for size in args.sizes.split(',')]:
+            homes.append((devices, nest_sim.make_home(seed=args.seed, **home_size(devices))))
+
+    results = []
+    for devices, data in homes:
+        result = {'devices': devices}
+        result.update(run_size(sim, data, args.events, args.seed, args.alloc_events))
+        results.append(result)
+        sys.stderr.write('{} devices: {:.0f} events/s, p50 {:.3f}ms, p99 {:.3f}ms\n'.format(
+            devices, result['events_per_sec'] or 0, result['latency_ms']['p50'] or 0, result['latency_ms']['p99'] or 0))
+
+    report = {
+        'benchmark': 'stream',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'json_backend': json_backend,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
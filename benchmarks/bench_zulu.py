@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+'''
+converters.zulu_2_ts benchmark: the cached positional parser against the
+original strptime implementation.
+
+Times cold (distinct strings) and warm (the handful of strings a home
+repeats) parsing, tests/test_converters.py checks that both agree.
+
+    ./benchmarks/bench_zulu.py --count 100000 --output zulu.json
+'''
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+import platform
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from converters import zulu_2_ts
+
+
+def legacy_zulu_2_ts(zulu_ts):
+    ''' The implementation zulu_2_ts replaced '''
+    assert zulu_ts[-1] == 'Z'
+    zulu_ts = zulu_ts[:-1] + '000'
+    return datetime.datetime.strptime(zulu_ts, '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def random_zulu(rnd):
+    ts = datetime.datetime(2015, 1, 1) + datetime.timedelta(seconds=rnd.randint(0, 10 * 365 * 86400))
+    digits = rnd.randint(0, 3)
+    fraction = ''.join(str(rnd.randint(0, 9)) for _ in range(digits))
+    return ts.strftime('%Y-%m-%dT%H:%M:%S') + '.' + fraction + 'Z'
+
+
+def per_call(func, timestamps):
+    start = time.perf_counter()
+    for zulu_ts in timestamps:
+        func(zulu_ts)
+    return (time.perf_counter() - start) / len(timestamps)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--count', type=int, default=100000, help='timestamps per measurement')
+    parser.add_argument('--distinct', type=int, default=50, help='distinct timestamps in the warm measurement')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    rnd = random.Random(args.seed)
+    cold = [random_zulu(rnd) for _ in range(args.count)]
+    zulu_2_ts.cache_clear()
+    results = {'cold': {'legacy_us': 1e6 * per_call(legacy_zulu_2_ts, cold),
+                        'zulu_2_ts_us': 1e6 * per_call(zulu_2_ts, cold)}}
+    distinct = [random_zulu(rnd) for _ in range(args.distinct)]
+    warm = [rnd.choice(distinct) for _ in range(args.count)]
+    zulu_2_ts.cache_clear()
+    results['warm'] = {'legacy_us': 1e6 * per_call(legacy_zulu_2_ts, warm),
+                       'zulu_2_ts_us': 1e6 * per_call(zulu_2_ts, warm)}
+    for name, timings in results.items():
+        timings['speedup'] = timings['legacy_us'] / timings['zulu_2_ts_us']
+        sys.stderr.write('{}: legacy {:.2f}us, zulu_2_ts {:.2f}us, {:.1f}x\n'.format(
+            name, timings['legacy_us'], timings['zulu_2_ts_us'], timings['speedup']))
+
+    report = {
+        'benchmark': 'zulu',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cache': zulu_2_ts.cache_info()._asdict(),
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+''' JSON decoding and encoding with an optional accelerated backend '''
+import json
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+''' Preference order for the 'auto' backend '''
+BACKENDS = ('orjson', 'ujson', 'json')
+
+backend = 'json'
+
+
+def _json_backend():
+    return json.loads, lambda obj: json.dumps(obj, separators=(',', ':'))
+
+
+def _orjson_backend():
+    import orjson
+    return orjson.loads, lambda obj: orjson.dumps(obj).decode('utf-8')
+
+
+def _ujson_backend():
+    import ujson
+    return ujson.loads, lambda obj: ujson.dumps(obj, ensure_ascii=False, escape_forward_slashes=False)
+
+
+_FACTORIES = {'json': _json_backend, 'orjson': _orjson_backend, 'ujson': _ujson_backend}
+
+loads, dumps = _json_backend()
+
+
+def available():
+    names = []
+    for name in BACKENDS:
+        try:
+            _FACTORIES[name]()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def use(name='auto'):
+    '''
+    Switch the module level loads/dumps to the named backend, 'auto' takes the
+    first one installed. Falls back to the standard library, returns the name used.
+    '''
+    global backend, loads, dumps
+    candidates = BACKENDS if name == 'auto' else (name, 'json')
+    for candidate in candidates:
+        factory = _FACTORIES.get(candidate)
+        if factory is None:
+            LOGGER.error('Unknown JSON backend {}'.format(candidate))
+            continue
+        try:
+            loads, dumps = factory()
+        except ImportError:
+            if name != 'auto':
+                LOGGER.warning('JSON backend {} is not installed, using the standard library'.format(candidate))
+            continue
+        backend = candidate
+        break
+    LOGGER.info('Using {} for JSON'.format(backend))
+    return backend
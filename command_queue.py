@@ -0,0 +1,176 @@
+''' Asynchronous, rate limited queue for Nest API commands '''
+import time
+from collections import deque
+from threading import Thread, Condition
+from concurrent.futures import Future
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+''' Nest throttles writes per device and per account, stay below both '''
+QUEUE_SIZE = 100
+DEVICE_RATE = 1 / 30
+DEVICE_BURST = 5
+GLOBAL_RATE = 1
+GLOBAL_BURST = 20
+''' Changes to a URL within this many seconds of the last PUT to it are collected and sent as one PUT '''
+COALESCE_WINDOW = 0.5
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.timestamp = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.timestamp) * self.rate)
+        self.timestamp = now
+
+    def delay(self, now):
+        ''' Seconds until a token is available '''
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class Command(object):
+    def __init__(self, url, payload, due=None):
+        self.url = url
+        self.payload = payload
+        self.future = Future()
+        self.queued = time.monotonic()
+        self.due = self.queued if due is None else max(self.queued, due)
+        self.merged = 0
+
+    def merges(self, payload):
+        '''
+        Only a change to the same fields is merged, Nest validates setpoints
+        against the mode, so a hvac_mode change sent with setpoints could get
+        a setpoint rejected that would have been accepted on its own
+        '''
+        return self.payload.keys() == payload.keys()
+
+
+class CommandQueue(object):
+    '''
+    Commands are sent by a single worker thread in order, a command is held
+    back while either its device bucket or the global bucket is empty.
+    The first change to a URL goes out right away, changes following a PUT
+    to the same URL within COALESCE_WINDOW wait for the rest of the window.
+    A change to the same fields as the last command waiting for its URL is
+    merged into it, values set later win, and both callers share the same
+    Future. Changes to other fields are queued behind it.
+    '''
+    def __init__(self, send, maxsize=QUEUE_SIZE):
+        self._send = send
+        self.maxsize = maxsize
+        self._queue = deque()
+        self._cond = Condition()
+        self._device_buckets = {}
+        ''' url -> time.monotonic() of the last PUT '''
+        self._last_sent = {}
+        self._global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self._thread = None
+        self._running = False
+        self.stats = {'queued': 0, 'merged': 0, 'sent': 0, 'dropped': 0}
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, name='NestCommands', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            pending = list(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        for command in pending:
+            command.future.set_result(False)
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, url, payload, callback=None):
+        ''' Queue a command, returns a Future that resolves to the sendChange result '''
+        with self._cond:
+            waiting = None
+            for command in self._queue:
+                if command.url == url:
+                    waiting = command
+            if waiting is not None and waiting.merges(payload):
+                command = waiting
+                command.payload.update(payload)
+                command.merged += 1
+                self.stats['merged'] += 1
+                LOGGER.debug('Merged {} into pending command to {}'.format(payload, url))
+            else:
+                last_sent = self._last_sent.get(url)
+                command = Command(url, dict(payload), None if last_sent is None else last_sent + COALESCE_WINDOW)
+                if len(self._queue) >= self.maxsize:
+                    LOGGER.error('Command queue is full, dropping {} to {}'.format(payload, url))
+                    self.stats['dropped'] += 1
+                    command.future.set_result(False)
+                else:
+                    self._queue.append(command)
+                    self.stats['queued'] += 1
+                    self._cond.notify()
+        if callback is not None:
+            command.future.add_done_callback(callback)
+        return command.future
+
+    def _bucket(self, url):
+        if url not in self._device_buckets:
+            self._device_buckets[url] = TokenBucket(DEVICE_RATE, DEVICE_BURST)
+        return self._device_buckets[url]
+
+    def _next(self):
+        ''' First command that is due and whose device is not throttled, or the time to wait for one '''
+        now = time.monotonic()
+        wait = self._global_bucket.delay(now)
+        if wait > 0:
+            return None, wait
+        for command in self._queue:
+            device_wait = max(command.due - now, self._bucket(command.url).delay(now))
+            if device_wait <= 0:
+                self._queue.remove(command)
+                self._global_bucket.consume(now)
+                self._bucket(command.url).consume(now)
+                self._last_sent[command.url] = now
+                return command, 0
+            wait = device_wait if wait == 0 else min(wait, device_wait)
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._running:
+                    return
+                if not self._queue:
+                    self._cond.wait()
+                    continue
+                command, wait = self._next()
+                if command is None:
+                    LOGGER.debug('Holding {} command(s) for {:.1f}s'.format(len(self._queue), wait))
+                    self._cond.wait(wait)
+                    continue
+            try:
+                result = self._send(command.url, command.payload)
+            except Exception as e:
+                LOGGER.error('Command to {} failed: {}'.format(command.url, e))
+                result = False
+            self.stats['sent'] += 1
+            command.future.set_result(result)
@@ -0,0 +1,165 @@
+''' Desired versus reported state for commands sent to the Nest API '''
+import time
+import itertools
+from threading import Lock
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+import metrics
+
+LOGGER = polyinterface.LOGGER
+
+''' Seconds after a successful PUT to wait for the stream to report the change '''
+CONFIRM_TIMEOUT = 60
+
+
+class PendingCommand(object):
+    def __init__(self, node, payload, drivers):
+        self.node = node
+        self.payload = dict(payload)
+        self.drivers = dict(drivers)
+        self.issued = time.perf_counter()
+        self.key = ('command', next(PendingCommand._ids))
+
+    _ids = itertools.count()
+
+
+def matches(desired, reported):
+    ''' Nest may report 21.0 for 21, anything else has to be equal '''
+    if isinstance(desired, (int, float)) and not isinstance(desired, bool) \
+            and isinstance(reported, (int, float)) and not isinstance(reported, bool):
+        return abs(desired - reported) < 0.01
+    return desired == reported
+
+
+class CommandTracker(object):
+    '''
+    A command stays pending from the ISY request until the stream reports
+    every field of its payload. While it is pending the drivers it set are
+    held, stream updates still carrying the old value do not flip them back.
+    A failed PUT or no confirmation within timeout seconds of a successful
+    one rolls the node back to the reported state with a regular update().
+    A later command for the same fields supersedes the earlier one, the
+    queue merges them into one PUT anyway.
+    '''
+    def __init__(self, scheduler=None, timeout=CONFIRM_TIMEOUT):
+        self.scheduler = scheduler
+        self.timeout = timeout
+        self.stats = {'tracked': 0, 'confirmed': 0, 'failed': 0, 'timed_out': 0, 'superseded': 0}
+        self._pending = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return sum(len(commands) for commands in self._pending.values())
+
+    def track(self, node, payload, drivers, future):
+        command = PendingCommand(node, payload, drivers)
+        with self._lock:
+            commands = self._pending.setdefault(node.address, [])
+            for older in list(commands):
+                for field in payload:
+                    older.payload.pop(field, None)
+                if not older.payload:
+                    commands.remove(older)
+                    self._cancelTimer(older)
+                    self.stats['superseded'] += 1
+            commands.append(command)
+            self.stats['tracked'] += 1
+        future.add_done_callback(lambda f: self._onSent(command, f.result()))
+        return command
+
+    def held(self, node):
+        ''' Driver values set by pending commands, {driver: (value, uom)} '''
+        commands = self._pending.get(node.address)
+        if not commands:
+            return {}
+        held = {}
+        with self._lock:
+            for command in commands:
+                held.update(command.drivers)
+        return held
+
+    def requested(self, node):
+        ''' Payload fields of pending commands with the values sent, {field: value} '''
+        commands = self._pending.get(node.address)
+        if not commands:
+            return {}
+        requested = {}
+        with self._lock:
+            for command in commands:
+                requested.update(command.payload)
+        return requested
+
+    def reconcile(self, node):
+        ''' Confirm the pending commands of node that its current data satisfies '''
+        if not self._pending.get(node.address):
+            return
+        with self._lock:
+            commands = self._pending.get(node.address, [])
+            confirmed = [command for command in commands if self._satisfied(command)]
+            for command in confirmed:
+                self._confirm(command)
+
+    def forget(self, node):
+        with self._lock:
+            for command in self._pending.pop(node.address, []):
+                self._cancelTimer(command)
+
+    def _satisfied(self, command):
+        data = command.node.data
+        return all(field in data and matches(value, data[field]) for field, value in command.payload.items())
+
+    def _confirm(self, command):
+        ''' Called with the lock held '''
+        self._remove(command)
+        self.stats['confirmed'] += 1
+        latency = time.perf_counter() - command.issued
+        metrics.COMMAND_CONFIRM_TIME.observe(latency, type(command.node).__name__)
+        LOGGER.debug('{}: {} confirmed by Nest after {:.2f}s'.format(command.node.name, command.payload, latency))
+
+    def _remove(self, command):
+        commands = self._pending.get(command.node.address)
+        if commands is None or command not in commands:
+            return False
+        commands.remove(command)
+        if not commands:
+            del self._pending[command.node.address]
+        self._cancelTimer(command)
+        return True
+
+    def _cancelTimer(self, command):
+        if self.scheduler is not None:
+            self.scheduler.cancel(command.key)
+
+    def _onSent(self, command, result):
+        with self._lock:
+            if command not in self._pending.get(command.node.address, []):
+                return
+            if result:
+                ''' The stream may have delivered the change before the PUT returned '''
+                if self._satisfied(command):
+                    self._confirm(command)
+                elif self.scheduler is not None:
+                    self.scheduler.schedule(command.key, time.time() + self.timeout, lambda: self._expire(command))
+                return
+            self._remove(command)
+            self.stats['failed'] += 1
+        LOGGER.warning('{}: {} was not accepted by Nest, reverting to the reported state'.format(command.node.name, command.payload))
+        self._rollback(command)
+
+    def _expire(self, command):
+        with self._lock:
+            if not self._remove(command):
+                return
+            self.stats['timed_out'] += 1
+        LOGGER.warning('{}: {} not confirmed by Nest within {}s, reverting to the reported state'.format(
+            command.node.name, command.payload, self.timeout))
+        self._rollback(command)
+
+    def _rollback(self, command):
+        ''' The drivers are no longer held, update() publishes what Nest reports '''
+        try:
+            command.node.update()
+        except Exception as e:
+            LOGGER.error('{}: rollback failed: {}'.format(command.node.name, e))
@@ -1,5 +1,6 @@
 import hashlib
 import datetime
+from functools import lru_cache
 
 
 def id_2_addr(address):
@@ -8,10 +9,34 @@ def id_2_addr(address):
     return m.hexdigest()[-14:]
 
 
+''' Distinct timestamps kept parsed, a few per node is plenty '''
+ZULU_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=ZULU_CACHE_SIZE)
 def zulu_2_ts(zulu_ts):
+    '''
+    Parse a Nest timestamp like 2018-02-28T17:43:07.123Z by position, a
+    short fraction such as .1Z means 100 milliseconds
+    '''
     assert zulu_ts[-1] == 'Z'
-    zulu_ts = zulu_ts[:-1] + '000'
-    return datetime.datetime.strptime(zulu_ts, '%Y-%m-%dT%H:%M:%S.%f')
+    if len(zulu_ts) < 20 or zulu_ts[4] != '-' or zulu_ts[7] != '-' or zulu_ts[10] != 'T' \
+            or zulu_ts[13] != ':' or zulu_ts[16] != ':':
+        raise ValueError('Invalid Zulu timestamp {}'.format(zulu_ts))
+    fraction = zulu_ts[20:-1]
+    if len(zulu_ts) > 20 and (zulu_ts[19] != '.' or (fraction and not fraction.isdigit())):
+        raise ValueError('Invalid Zulu timestamp {}'.format(zulu_ts))
+    return datetime.datetime(int(zulu_ts[0:4]), int(zulu_ts[5:7]), int(zulu_ts[8:10]),
+                             int(zulu_ts[11:13]), int(zulu_ts[14:16]), int(zulu_ts[17:19]),
+                             int(fraction[:6].ljust(6, '0')) if fraction else 0)
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def ts_2_epoch(ts):
+    ''' Naive UTC datetime (as returned by zulu_2_ts) to seconds since the epoch '''
+    return (ts - EPOCH).total_seconds()
 
 
 def cosmost2num(cosmo_state):
@@ -32,3 +57,43 @@ def secst2num(sec_state):
         return 3
     else:
         return 1
+
+
+def away2num(away):
+    if away == 'away':
+        return 2
+    else:
+        return 1
+
+
+def mode2num(hvac_mode):
+    if hvac_mode == 'heat-cool':
+        return 3
+    elif hvac_mode == 'heat':
+        return 1
+    elif hvac_mode == 'cool':
+        return 2
+    elif hvac_mode == 'eco':
+        return 13
+    else:
+        return 0
+
+
+def battery2num(battery_health):
+    if battery_health == 'ok':
+        return 13
+    else:
+        return 11
+
+
+UI_COLORS = {'gray': 1, 'green': 2, 'yellow': 3, 'red': 4}
+
+
+def color2num(ui_color_state):
+    ''' None for an unknown color, the driver is left alone '''
+    return UI_COLORS.get(ui_color_state)
+
+
+def ttt2num(time_to_target):
+    ''' Nest reports time to target like ~15, <5 or >120 '''
+    return int(time_to_target.replace('~', '').replace('>', '').replace('<', ''))
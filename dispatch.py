@@ -0,0 +1,174 @@
+''' Nest API snapshot change detection and node update dispatch '''
+from collections import deque
+from threading import Thread, Condition
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+DISPATCH_WORKERS = 4
+
+
+def iter_elements(data):
+    ''' Yield (kind, element_id, element) for every structure and device in a Nest API snapshot '''
+    if not data:
+        return
+    for struct_id, struct in data.get('structures', {}).items():
+        yield 'structures', struct_id, struct
+    for kind, devices in data.get('devices', {}).items():
+        for dev_id, device in devices.items():
+            yield kind, dev_id, device
+
+
+def get_element(data, kind, element_id):
+    if not data:
+        return None
+    if kind == 'structures':
+        return data.get('structures', {}).get(element_id)
+    return data.get('devices', {}).get(kind, {}).get(element_id)
+
+
+ALARM_KINDS = ('structures', 'smoke_co_alarms')
+ALARM_FIELDS = ('smoke_alarm_state', 'co_alarm_state')
+ALARM_STATES = ('warning', 'emergency')
+
+
+def alarm_transition(old_element, new_element):
+    ''' True if a smoke or CO alarm state moved into or out of warning/emergency '''
+    if new_element is None:
+        return False
+    for field in ALARM_FIELDS:
+        new_state = new_element.get(field)
+        old_state = old_element.get(field) if old_element is not None else None
+        if new_state != old_state and (new_state in ALARM_STATES or old_state in ALARM_STATES):
+            return True
+    return False
+
+
+def diff_snapshots(old_data, new_data):
+    '''
+    Compare two snapshots, returns (changed, shared). changed is the set of
+    (kind, element_id) that were added, removed or changed. shared is
+    new_data with its unchanged elements swapped for the equal ones from
+    old_data, so consecutive snapshots share them and nodes that were not
+    updated never hold on to a stale copy. new_data itself is left as it is,
+    shared only copies the structure and device containers.
+    '''
+    old_elements = {(kind, element_id): element for kind, element_id, element in iter_elements(old_data)}
+    changed = set()
+    shared = new_data
+    if new_data:
+        shared = dict(new_data)
+        if 'structures' in new_data:
+            shared['structures'] = dict(new_data['structures'])
+        if 'devices' in new_data:
+            shared['devices'] = {kind: dict(devices) for kind, devices in new_data['devices'].items()}
+    for kind, element_id, element in iter_elements(new_data):
+        old_element = old_elements.pop((kind, element_id), None)
+        if old_element is element:
+            continue
+        if old_element is None or old_element != element:
+            changed.add((kind, element_id))
+        elif kind == 'structures':
+            shared['structures'][element_id] = old_element
+        else:
+            shared['devices'][kind][element_id] = old_element
+    ''' Whatever is left has disappeared from the new snapshot '''
+    changed.update(old_elements)
+    return changed, shared
+
+
+class NodeDispatcher(object):
+    '''
+    Runs node updates on a small pool of worker threads so the stream reader
+    only parses events. Every node has a single latest-wins slot: a node
+    submitted again before its update started is not queued twice, its update
+    reads the newest snapshot anyway. A node is never updated by two workers
+    at once, a submit while it runs schedules exactly one more run.
+    With workers=0 updates run inline in submit(), for profiling.
+    '''
+    def __init__(self, run, workers=DISPATCH_WORKERS, name='NestDispatch'):
+        self.run = run
+        self.workers = workers
+        self.name = name
+        self.stats = {'submitted': 0, 'dropped': 0, 'done': 0}
+        self._ready = deque()
+        self._queued = set()
+        self._running = set()
+        self._rerun = set()
+        self._cond = Condition()
+        self._threads = []
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._queued) + len(self._rerun)
+
+    def start(self):
+        if self._threads:
+            return
+        self._stopping = False
+        for index in range(self.workers):
+            thread = Thread(target=self._worker, name='{}-{}'.format(self.name, index), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, node, priority=False):
+        ''' priority puts the node ahead of everything already waiting '''
+        if self.workers == 0:
+            self.stats['submitted'] += 1
+            self.run(node)
+            self.stats['done'] += 1
+            return
+        with self._cond:
+            self.stats['submitted'] += 1
+            if node in self._queued or node in self._rerun:
+                self.stats['dropped'] += 1
+                if priority and node in self._queued:
+                    self._ready.remove(node)
+                    self._ready.appendleft(node)
+            elif node in self._running:
+                self._rerun.add(node)
+            else:
+                self._queued.add(node)
+                if priority:
+                    self._ready.appendleft(node)
+                else:
+                    self._ready.append(node)
+                self._cond.notify()
+
+    def join(self, timeout=None):
+        ''' Wait until every submitted update has run, returns False on timeout '''
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._ready and not self._running, timeout)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._ready or self._stopping)
+                if self._stopping:
+                    return
+                node = self._ready.popleft()
+                self._queued.discard(node)
+                self._running.add(node)
+            try:
+                self.run(node)
+            except Exception as e:
+                LOGGER.error('{}: update of {} failed: {}'.format(self.name, getattr(node, 'address', node), e))
+            with self._cond:
+                self._running.discard(node)
+                self.stats['done'] += 1
+                if node in self._rerun:
+                    self._rerun.discard(node)
+                    self._queued.add(node)
+                    self._ready.append(node)
+                self._cond.notify_all()
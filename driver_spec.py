@@ -0,0 +1,68 @@
+''' Declarative Nest field to ISY driver mappings, compiled once per node class '''
+
+
+class Driver(object):
+    '''
+    One ISY driver of a node type. path is the Nest field it is read from
+    (dotted for nested objects), convert turns the Nest value into the
+    driver value and default is published when the field is missing.
+    Drivers without a path are computed in code. path and uom may contain
+    {name} placeholders and convert may name a class attribute, these are
+    resolved against the node class so subclasses can reuse a spec.
+    '''
+    def __init__(self, driver, uom, path=None, convert=None, default=None):
+        self.driver = driver
+        self.uom = uom
+        self.path = path
+        self.convert = convert
+        self.default = default
+
+
+class _ClassAttrs(dict):
+    def __init__(self, cls):
+        super().__init__()
+        self.cls = cls
+
+    def __missing__(self, key):
+        return str(getattr(self.cls, key))
+
+
+def compile_spec(cls, spec):
+    '''
+    Returns (drivers, extractors, paths): the Polyglot drivers list, a tuple of
+    (driver, keys, convert, default) for the drivers read from Nest data and
+    the Nest field names they use
+    '''
+    attrs = _ClassAttrs(cls)
+    drivers = []
+    extractors = []
+    paths = []
+    for entry in spec:
+        drivers.append({'driver': entry.driver, 'value': 0, 'uom': str(entry.uom).format_map(attrs)})
+        if entry.path is None:
+            continue
+        path = entry.path.format_map(attrs)
+        convert = entry.convert
+        if isinstance(convert, str):
+            convert = getattr(cls, convert)
+        extractors.append((entry.driver, tuple(path.split('.')), convert, entry.default))
+        paths.append(path)
+    return drivers, tuple(extractors), tuple(paths)
+
+
+def extract(data, extractors, only=None):
+    ''' Yield (driver, value) for every compiled extractor, optionally limited to the drivers in only '''
+    for driver, keys, convert, default in extractors:
+        if only is not None and driver not in only:
+            continue
+        value = data
+        for key in keys:
+            if key not in value:
+                value = default
+                break
+            value = value[key]
+        else:
+            if convert is not None:
+                value = convert(value)
+        if value is not None:
+            yield driver, value
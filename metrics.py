@@ -0,0 +1,196 @@
+''' Runtime counters and histograms, served in Prometheus text format '''
+import time
+from threading import Thread, Lock
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, str(value).replace('"', '\\"')) for name, value in zip(names, values)) + '}'
+
+
+class Counter(object):
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def total(self):
+        return sum(self.values.values())
+
+    def samples(self):
+        with self._lock:
+            if not self.labels and not self.values:
+                return [(self.name, '', 0)]
+            return [(self.name, _labels(self.labels, key), value) for key, value in sorted(self.values.items())]
+
+
+class Gauge(object):
+    ''' Value is read from a function when the metrics are collected '''
+    kind = 'gauge'
+
+    def __init__(self, name, help, func):
+        self.name = name
+        self.help = help
+        self.func = func
+
+    def samples(self):
+        value = self.func()
+        if value is None:
+            return []
+        return [(self.name, '', value)]
+
+
+class Histogram(object):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self._lock = Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            if label_values not in self.series:
+                self.series[label_values] = [[0] * len(self.buckets), 0, 0.0]
+            counts, _, _ = series = self.series[label_values]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            series[1] += 1
+            series[2] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def mean(self, *label_values):
+        series = self.series.get(label_values)
+        if not series or not series[1]:
+            return None
+        return series[2] / series[1]
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, count, total) in sorted(self.series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    samples.append((self.name + '_bucket', _labels(self.labels + ('le',), key + (bound,)), bucket_count))
+                samples.append((self.name + '_bucket', _labels(self.labels + ('le',), key + ('+Inf',)), count))
+                samples.append((self.name + '_count', _labels(self.labels, key), count))
+                samples.append((self.name + '_sum', _labels(self.labels, key), total))
+        return samples
+
+
+class _Timer(object):
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        ''' A metric registered again under the same name replaces the old one '''
+        self.metrics = [m for m in self.metrics if m.name != metric.name]
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, func):
+        return self.register(Gauge(name, help, func))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('{}{} {}'.format(name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+EVENTS = REGISTRY.counter('nest_stream_events_total', 'REST Streaming events received by type', ['type'])
+PARSE_TIME = REGISTRY.histogram('nest_stream_parse_seconds', 'Time to decode a put event')
+NODE_UPDATE_TIME = REGISTRY.histogram('nest_node_update_seconds', 'Time spent in node update()', ['node_type'])
+COMMAND_TIME = REGISTRY.histogram('nest_command_seconds', 'Nest API PUT latency', buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+COMMAND_CONFIRM_TIME = REGISTRY.histogram('nest_command_confirm_seconds', 'ISY command to the change reported on the stream', ['node_type'],
+                                          buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 120, 300))
+COMMAND_STATUS = REGISTRY.counter('nest_command_responses_total', 'Nest API PUT results by HTTP status', ['status'])
+REDIRECTS = REGISTRY.counter('nest_api_redirects_total', 'Nest API 307 redirects followed')
+ALARM_LATENCY = REGISTRY.histogram('nest_alarm_publish_seconds', 'Smoke/CO alarm change received to drivers published', ['node_type'],
+                                   buckets=(0.001, 0.0025, 0.005, 0.0075, 0.01, 0.025, 0.05, 0.1, 0.25, 1))
+RECONNECTS = REGISTRY.counter('nest_stream_reconnects_total', 'REST Streaming reconnects')
+
+
+class _MetricsServer(ThreadingMixIn, HTTPServer):
+    ''' http.server.ThreadingHTTPServer only exists from Python 3.7 on '''
+    daemon_threads = True
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host='127.0.0.1', registry=REGISTRY):
+    ''' Serve /metrics in a background thread, returns the server or None '''
+    try:
+        server = _MetricsServer((host, port), _MetricsHandler)
+    except OSError as e:
+        LOGGER.error('Unable to start metrics endpoint on {}:{}: {}'.format(host, port, e))
+        return None
+    server.registry = registry
+    Thread(target=server.serve_forever, name='Metrics', daemon=True).start()
+    LOGGER.info('Metrics available at http://{}:{}/metrics'.format(host, port))
+    return server
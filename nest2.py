@@ -1,21 +1,22 @@
 #!/usr/bin/env python3
 
+import os
+import sys
+
 CLOUD = False
 
+if os.environ.get('NEST_POLY_STUB'):
+    ''' Run without Polyglot, every module importing polyinterface gets polystub '''
+    import polystub
+    sys.modules['polyinterface'] = polystub
 try:
     import polyinterface
 except ImportError:
     import pgc_interface as polyinterface
     CLOUD = True
-import sys
 import json
 from pathlib import Path
 import http.client
-from threading import Thread
-import urllib3
-import sseclient
-from urllib.parse import urlparse
-import certifi
 import time
 import datetime
 import hmac
@@ -24,12 +25,23 @@ import base64
 import logging
 from copy import deepcopy
 
-from converters import id_2_addr
-from node_types import Thermostat, ThermostatC, Structure, Protect, Camera
+import codec
+import metrics
+import snapshot
+from recorder import SessionRecorder
+from dispatch import get_element, NodeDispatcher
+from account import Account
+from command_tracker import CommandTracker
+from scheduler import Scheduler
+from nest_api import connect, NEST_AUTH_URL
+from node_types import NODE_TYPES, PROJECTION
+from projection import parse_scopes, restrict, ROOT_SCOPE
 
 LOGGER = polyinterface.LOGGER
 
-NEST_API_URL = 'https://developer-api.nest.com'
+''' customParams starting with this add a Nest account, the rest of the key names it '''
+ACCOUNT_PARAM = 'account_'
+ACCESS_TOKEN_PREFIX = 'c.'
 
 
 class Controller(polyinterface.Controller):
@@ -39,19 +51,32 @@ class Controller(polyinterface.Controller):
         self.address = 'nestctrl'
         self.primary = self.address
         self.auth_conn = None
-        self.api_conn = None
-        self.api_data = None
-        self.auth_token = None
-        self.stream_thread = None
-        self.data = None
-        self.discovery = None
         self.cookie = None
         self.cookie_tries = 0
-        self.api_conn_last_used = int(time.time())
-        self.stream_last_update = int(time.time())
         self.update_nodes = False
         self.profile_version = None
-        self.rediscovery_needed = False
+        self.update_stats = {'updated': 0, 'skipped': 0, 'added': 0, 'retired': 0}
+        self.snapshot_version = 0
+        self.snapshot_saved = 0
+        self.dispatcher = NodeDispatcher(self._runUpdate)
+        self.scheduler = Scheduler()
+        self.command_tracker = CommandTracker(self.scheduler)
+        ''' The account linked through Polyglot, the ones from account_<name> customParams follow it '''
+        self.account = Account(self)
+        self.accounts = [self.account]
+        self.stream_scopes = (ROOT_SCOPE,)
+        self.metrics_server = None
+        self.recorder = None
+        metrics.REGISTRY.gauge('nest_stream_last_event_age_seconds', 'Seconds since the last REST Streaming event, oldest of all accounts',
+                               lambda: int(time.time()) - self._lastStreamUpdate())
+        metrics.REGISTRY.gauge('nest_command_queue_depth', 'Commands waiting to be sent', lambda: sum(len(account.command_queue) for account in self.accounts))
+        metrics.REGISTRY.gauge('nest_node_updates_skipped', 'Node updates skipped because nothing changed', lambda: self.update_stats['skipped'])
+        metrics.REGISTRY.gauge('nest_dispatch_queue_depth', 'Node updates waiting for a dispatcher worker', lambda: len(self.dispatcher))
+        metrics.REGISTRY.gauge('nest_dispatch_dropped', 'Node updates superseded by a newer snapshot before they ran', lambda: self.dispatcher.stats['dropped'])
+        metrics.REGISTRY.gauge('nest_timers_pending', 'Time derived driver updates scheduled', lambda: len(self.scheduler))
+        metrics.REGISTRY.gauge('nest_commands_merged', 'Commands merged into a pending PUT', lambda: sum(account.command_queue.stats['merged'] for account in self.accounts))
+        metrics.REGISTRY.gauge('nest_commands_unconfirmed', 'Commands waiting for Nest to report the change', lambda: len(self.command_tracker))
+        metrics.REGISTRY.gauge('nest_accounts', 'Nest accounts with an auth token', lambda: sum(1 for account in self.accounts if account.auth_token))
         self._cloud = CLOUD
 
     def start(self):
@@ -62,12 +87,125 @@ class Controller(polyinterface.Controller):
             LOGGER.info('Cloud environment detected.')
         self.removeNoticesAll()
         self._checkProfile()
+        codec.use(self.polyConfig['customParams'].get('json_backend', 'auto'))
+        self.account.start()
+        self.dispatcher.start()
+        self.scheduler.start()
+        if 'metrics_port' in self.polyConfig['customParams']:
+            self.metrics_server = metrics.serve(int(self.polyConfig['customParams']['metrics_port']))
+        if 'record_stream' in self.polyConfig['customParams']:
+            self._startRecording()
+        if 'stream_scopes' in self.polyConfig['customParams']:
+            self._setScopes(self.polyConfig['customParams']['stream_scopes'])
+        self._warmStart()
+        self._startAccounts()
         if self._getToken():
-            if self.discover():
-                self._checkStreaming()
-                return True
-            else:
-                self.rediscovery_needed = True
+            self.account.requestDiscovery()
+            return True
+        return False
+
+    def _setScopes(self, value):
+        ''' Stream only parts of the Nest data, one REST Streaming connection per path '''
+        try:
+            self.stream_scopes = parse_scopes(value)
+        except ValueError as e:
+            LOGGER.error('stream_scopes: {}, streaming everything'.format(e))
+            self.stream_scopes = (ROOT_SCOPE,)
+        self.account.scopes = self.stream_scopes
+        if self.stream_scopes != (ROOT_SCOPE,):
+            LOGGER.info('Streaming only {}'.format(', '.join(self.stream_scopes)))
+
+    def _startAccounts(self):
+        ''' One more Nest account per account_<name> customParam, the value is its access token or a PIN '''
+        for key, value in sorted(self.polyConfig['customParams'].items()):
+            if not key.startswith(ACCOUNT_PARAM) or len(key) == len(ACCOUNT_PARAM):
+                continue
+            account = Account(self, key[len(ACCOUNT_PARAM):])
+            account.scopes = self.stream_scopes
+            account.auth_token = self._accountToken(account.name, str(value).strip())
+            if account.auth_token is None:
+                LOGGER.error('{}: no usable auth token, account skipped'.format(account))
+                continue
+            LOGGER.info('Adding {}'.format(account))
+            self.accounts.append(account)
+            account.start()
+            account.requestDiscovery()
+
+    def _accountToken(self, name, value):
+        if value.startswith(ACCESS_TOKEN_PREFIX):
+            return value
+        saved = self.polyConfig['customData'].get('accounts', {}).get(name)
+        if saved is not None and saved.get('pin') == value and not self._expired(saved):
+            return saved['access_token']
+        server_data = self._serverData()
+        if server_data is None:
+            return None
+        LOGGER.info('Nest account {}: PIN code obtained, attempting to get a token'.format(name))
+        data = self._requestToken(server_data, value)
+        if data is None:
+            return None
+        cust_data = deepcopy(self.polyConfig['customData'])
+        saved = {'pin': value, 'access_token': data['access_token']}
+        if 'expires' in data:
+            saved['expires'] = data['expires']
+        cust_data.setdefault('accounts', {})[name] = saved
+        self.saveCustomData(cust_data)
+        ''' Later saves start from polyConfig, Polyglot sends the new customData back only later '''
+        self.polyConfig['customData'] = cust_data
+        return data['access_token']
+
+    def tokenRevoked(self, account):
+        if account.primary:
+            cust_data = {}
+            if 'accounts' in self.polyConfig['customData']:
+                cust_data['accounts'] = deepcopy(self.polyConfig['customData']['accounts'])
+        else:
+            cust_data = deepcopy(self.polyConfig['customData'])
+            cust_data.get('accounts', {}).pop(account.name, None)
+        self.saveCustomData(cust_data)
+        self.polyConfig['customData'] = cust_data
+
+    def _warmStart(self):
+        ''' Create nodes from the last saved state so drivers are published before the Nest API answers '''
+        if self._cloud:
+            return False
+        saved = snapshot.load()
+        if saved is None:
+            return False
+        ''' Whatever is outside the stream scopes would never be updated '''
+        self.account.data = restrict(saved['data'], self.account.scopes, PROJECTION)
+        self.account.warm_data = True
+        restored = 0
+        for address, node_info in saved['nodes'].items():
+            node_type = NODE_TYPES.get(node_info['id'])
+            if node_type is None or address in self.nodes:
+                continue
+            device = get_element(self.account.data, node_type.kind, node_info['element_id'])
+            if device is None:
+                continue
+            node = self.account.createNode(node_type, address, node_info['name'], node_info['element_id'], device)
+            self.addNode(node)
+            restored += 1
+        LOGGER.info('Warm start: {} node(s) restored from the state saved at {}'.format(
+            restored, datetime.datetime.fromtimestamp(saved['saved']).strftime("%Y-%m-%dT%H:%M:%S")))
+        return True
+
+    def _saveSnapshot(self, force=False):
+        ''' The snapshot holds the primary account, other accounts start from the stream '''
+        account = self.account
+        if self._cloud or account.data is None or account.warm_data or self.snapshot_version == account.data_version:
+            return False
+        if not force and time.time() - self.snapshot_saved < snapshot.SNAPSHOT_INTERVAL:
+            return False
+        nodes = {}
+        for address, node in self.nodes.items():
+            if node is not self and not node.retired and node.account is account:
+                nodes[address] = {'id': node.id, 'name': node.name, 'element_id': node.element_id, 'set_url': node.set_url}
+        version = account.data_version
+        if snapshot.save(account.data, nodes):
+            self.snapshot_version = version
+            self.snapshot_saved = time.time()
+            return True
         return False
 
     def _checkProfile(self):
@@ -93,28 +231,62 @@ class Controller(polyinterface.Controller):
 
     def stop(self):
         LOGGER.info('Nest NodeServer is stopping')
-        if self.api_conn is not None:
-            self.api_conn.close()
-            self.api_conn = None
+        for account in self.accounts:
+            account.stop()
+        self._saveSnapshot(force=True)
+        self.dispatcher.stop()
+        self.scheduler.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server = None
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def _startRecording(self):
+        ''' Raw REST Streaming events of all accounts go to a rotating gzip log that replay.py can play back '''
+        params = self.polyConfig['customParams']
+        max_mb = float(params.get('record_stream_mb', 10))
+        self.recorder = SessionRecorder(Path(params['record_stream']).expanduser(), max_bytes=int(max_mb * 1024 * 1024))
+        LOGGER.info('Recording REST Streaming events to {}'.format(self.recorder.path))
 
     def longPoll(self):
-        if self.rediscovery_needed:
-            if self.discover():
-                self.rediscovery_needed = False
-            else:
-                return False
-        self._checkStreaming()
-        '''
-        if self.api_conn is not None:
-            if (int(time.time()) - self.api_conn_last_used) > 1800:
-                LOGGER.info("API connection inactive for 30 minutes, closing...")
-                self.api_conn.close()
-                self.api_conn = None
-        '''
-        return True
+        self._updateMetricDrivers()
+        result = all([account.poll() for account in self.accounts])
+        self._saveSnapshot()
+        LOGGER.debug('Stream node updates: {updated} dispatched, {skipped} skipped'.format(**self.update_stats))
+        self._logShadowStats()
+        LOGGER.debug('Dispatcher: {submitted} submitted, {dropped} dropped, {done} done'.format(**self.dispatcher.stats))
+        for account in self.accounts:
+            LOGGER.debug('{}: command queue {queued} queued, {merged} merged, {sent} sent, {dropped} dropped'.format(
+                account, **account.command_queue.stats))
+        LOGGER.debug('Commands: {tracked} tracked, {confirmed} confirmed, {failed} failed, {timed_out} timed out, {superseded} superseded'.format(**self.command_tracker.stats))
+        return result
+
+    def _logShadowStats(self):
+        hits = 0
+        misses = 0
+        for node in self.nodes.values():
+            if node is not self:
+                hits += node.shadow_hits
+                misses += node.shadow_misses
+        if hits + misses > 0:
+            LOGGER.debug('Driver shadow: {} hits, {} misses, {:.1f}% hit rate'.format(hits, misses, 100 * hits / (hits + misses)))
+
+    def _lastStreamUpdate(self):
+        return min(account.stream_last_update for account in self.accounts)
+
+    def _updateMetricDrivers(self):
+        ''' Stream health on the controller node so ISY programs can react to it '''
+        self.setDriver('GV0', int(time.time()) - self._lastStreamUpdate())
+        self.setDriver('GV1', int(metrics.RECONNECTS.total()))
+        latency = metrics.COMMAND_TIME.mean()
+        self.setDriver('GV2', 0 if latency is None else int(latency * 1000))
+        failed = metrics.COMMAND_STATUS.total() - metrics.COMMAND_STATUS.get('200')
+        self.setDriver('GV3', int(failed))
 
     def shortPoll(self):
-        if self.auth_token is not None or self.cookie is None or self._cloud:
+        self._updateMetricDrivers()
+        if self.account.auth_token is not None or self.cookie is None or self._cloud:
             return True
         ''' Only try 60 times, shuld be about 15 minutes '''
         auth_pin = None
@@ -142,267 +314,30 @@ class Controller(polyinterface.Controller):
                 self.cookie = None
                 if self._getToken(auth_pin):
                     self.removeNoticesAll()
-                    self.discover()
-                    self._checkStreaming()
+                    self.account.requestDiscovery()
         else:
             LOGGER.warning('Please restart the node server and try Nest authentication again.')
             self.cookie = None
         return True
 
-    def _checkStreaming(self):
-        if self.auth_token is None or self.discovery:
-            return False
-        if self.stream_thread is None:
-            LOGGER.debug('Starting REST Streaming thread for the first time.')
-            self._startStreaming()
-        else:
-            if self.stream_thread.is_alive():
-                if (int(time.time()) - self.stream_last_update) > 1800:
-                    LOGGER.error('No updates from streaming thread for >30 minutes, streaming hung up? Restarting the node server...')
-                    self.poly.restart()
-                    return False
-                return True
-            else:
-                LOGGER.warning('REST Streaming thread died, attempting to restart.')
-                self._startStreaming()
-        return True
-
-    def _startStreaming(self):
-        self.stream_thread = Thread(target=self._streamingProc, daemon=True)
-        self.stream_thread.start()
-        
-    def _streamingProc(self):
-        headers = {
-            'Authorization': "Bearer {0}".format(self.auth_token),
-            'Accept': 'text/event-stream'
-        }
-        url = NEST_API_URL
-        retries = urllib3.util.retry.Retry(remove_headers_on_redirect=[])
-        http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
-        try:
-            response = http.request('GET', url, headers=headers, preload_content=False, retries=retries)
-        except Exception as e:
-            LOGGER.error('REST Streaming Request Failed: {}'.format(e))
-            http.clear()
-            return False
-        client = sseclient.SSEClient(response)
-        for event in client.events():  # returns a generator
-            event_type = event.event
-            self.stream_last_update = int(time.time())
-            if event_type == 'open':  # not always received here
-                LOGGER.debug('The event stream has been opened')
-            elif event_type == 'put':
-                LOGGER.debug('The data has changed (or initial data sent)')
-                event_data = json.loads(event.data)
-                self.data = event_data['data']
-                for node in self.nodes:
-                    self.nodes[node].update()
-            elif event_type == 'keep-alive':
-                LOGGER.debug('No data updates. Receiving an HTTP header to keep the connection open.')
-            elif event_type == 'auth_revoked':
-                LOGGER.warning('The API authorization has been revoked. {}'.format(event.data))
-                self.auth_token = None
-                cust_data = {}
-                self.saveCustomData(cust_data)
-                client.close()
-                return False
-            elif event_type == 'error':
-                LOGGER.error('Error occurred, such as connection closed: {}'.format(event.data))
-                client.close()
-                return False
-            elif event_type == 'cancel':
-                LOGGER.warning('Cancel event received, restarting the thread')
-                client.close()
-                return False
-            else:
-                LOGGER.error('REST Streaming: Unhandled event {} {}'.format(event_type, event.data))
-                client.close()
-                return False
-        LOGGER.warning('Streaming Process exited')
+    def _runUpdate(self, node):
+        with metrics.NODE_UPDATE_TIME.time(type(node).__name__):
+            node.update()
 
     def update(self):
         pass
 
     def discover(self, command=None):
-        LOGGER.info('Discovering Nest Products...')
-        if self.auth_token is None:
-            return False
-
-        if not self.getState():
-            return False
-
-        self.discovery = True
-        ''' Copy initial data if REST Streaming is not active yet '''
-        if self.data is None:
-            self.data = self.api_data
-            
-        if 'structures' not in self.api_data:
-            LOGGER.error('Nest API did not return any structures')
-            self.discovery = False
-            return False
-
-        structures = self.api_data['structures']
-        LOGGER.info("Found {} structure(s)".format(len(structures)))
-
-        for struct_id, struct in structures.items():
-            address = id_2_addr(struct_id)
-            LOGGER.info("Id: {}, Name: {}".format(address, struct['name']))
-            if address not in self.nodes:
-                self.addNode(Structure(self, self.address, address, struct['name'], struct_id, struct))
-
-        if 'thermostats' in self.api_data['devices']:
-            thermostats = self.api_data['devices']['thermostats']
-            LOGGER.info("Found {} thermostat(s)".format(len(thermostats)))
-
-            for tstat_id, tstat in thermostats.items():
-                address = id_2_addr(tstat_id)
-                LOGGER.info("Id: {}, Name: {}".format(address, tstat['name_long']))
-                if address not in self.nodes:
-                    if tstat['temperature_scale'] == 'F':
-                        self.addNode(Thermostat(self, self.address, address, tstat['name'], tstat_id, tstat), update=self.update_nodes)
-                    else:
-                        self.addNode(ThermostatC(self, self.address, address, tstat['name'], tstat_id, tstat), update=self.update_nodes)
-
-        if 'smoke_co_alarms' in self.api_data['devices']:
-            smokedets = self.api_data['devices']['smoke_co_alarms']
-            LOGGER.info("Found {} smoke detector(s)".format(len(smokedets)))
-            for smkdet_id, smkdet in smokedets.items():
-                address = id_2_addr(smkdet_id)
-                LOGGER.info("Id: {}, Name: {}".format(address, smkdet['name_long']))
-                if address not in self.nodes:
-                    self.addNode(Protect(self, self.address, address, smkdet['name'], smkdet_id, smkdet), update=self.update_nodes)
-
-        if 'cameras' in self.api_data['devices']:
-            cams = self.api_data['devices']['cameras']
-            LOGGER.info("Found {} camera(s)".format(len(cams)))
-            for cam_id, camera in cams.items():
-                address = id_2_addr(cam_id)
-                LOGGER.info("Id: {}, Name: {}".format(address, camera['name_long']))
-                if address not in self.nodes:
-                    self.addNode(Camera(self, self.address, address, camera['name'], cam_id, camera), update=self.update_nodes)
-
-        self.discovery = False
-        self.update_nodes = False
-        return True
-
-    def getState(self):
-        if not self.auth_token:
-            return False
-        self.api_conn_last_used = int(time.time())
-        headers = {'authorization': "Bearer {0}".format(self.auth_token)}
-
-        if self.api_conn is None:
-            LOGGER.debug('getState: Attempting to open a connection to the Nest API endpoint')
-            self.api_conn = http.client.HTTPSConnection("developer-api.nest.com")
-
-        ''' re-use an existing connection '''
-        try:
-            self.api_conn.request("GET", "/", headers=headers)
-        except Exception as e:
-            LOGGER.error('Nest API Connection error: {}'.format(e))
-            self.api_conn.close()
-            self.api_conn = None
-            return False
-        try:
-            response = self.api_conn.getresponse()
-        except Exception as e:
-            LOGGER.error('Nest API Connection Response error: {}'.format(e))
-            self.api_conn.close()
-            self.api_conn = None
-            return False
-
-        if response.status == 307:
-            redirectLocation = urlparse(response.getheader("location"))
-            LOGGER.debug("Redirected to: {}".format(redirectLocation.geturl()))
-            self.api_conn = http.client.HTTPSConnection(redirectLocation.netloc)
-            try:
-                self.api_conn.request("GET", "/", headers=headers)
-            except Exception as e:
-                LOGGER.error('Nest API Connection error after redirect: {}'.format(e))
-                self.api_conn.close()
-                self.api_conn = None
-                return False
-            response = self.api_conn.getresponse()
-            LOGGER.debug('Response status: {}'.format(response.status))
-            if response.status != 200:
-                LOGGER.error('Redirect with non 200 response')
-
-        if response.status != 200:
-            LOGGER.error('BAD API response status {}: {}'.format(response.status, response.read().decode("utf-8")))
-            self.api_conn.close()
-            self.api_conn = None
-            return False
-
-        self.api_data = json.loads(response.read().decode("utf-8"))
-        return True
-    
-    def sendChange(self, url, payload):
-        if not self.auth_token:
-            LOGGER.error('sendChange: no auth_token')
-            return False
-        if len(payload) < 1:
-            LOGGER.error('Empty payload!')
-            return False
-        self.api_conn_last_used = int(time.time())
-        if self.api_conn is None:
-            LOGGER.info('sendChange: Attempting to open a connection to the Nest API endpoint')
-            self.api_conn = http.client.HTTPSConnection("developer-api.nest.com")
-        command = json.dumps(payload, separators=(',', ': '))
-        headers = {'authorization': "Bearer {0}".format(self.auth_token)}
-        LOGGER.debug('Sending {} to {}'.format(command, url))
-        try:
-            self.api_conn.request("PUT", url, command, headers)
-        except Exception as e:
-            LOGGER.error('Nest API Connection error: {}'.format(e))
-            self.api_conn.close()
-            self.api_conn = None
-            return False
-        response = self.api_conn.getresponse()
-
-        if response.status == 307:
-            redirectLocation = urlparse(response.getheader("location"))
-            LOGGER.debug("Redirected to: {}".format(redirectLocation.geturl()))
-            LOGGER.debug('Sending {} to {}'.format(command, url))
-            self.api_conn = http.client.HTTPSConnection(redirectLocation.netloc)
-            try:
-                self.api_conn.request("PUT", url, command, headers)
-            except Exception as e:
-                LOGGER.error('Nest API Connection error after redirect: {}'.format(e))
-                self.api_conn.close()
-                self.api_conn = None
-                return False
-            response = self.api_conn.getresponse()
-            LOGGER.debug('Response status: {}'.format(response.status))
-        if response.status != 200:
-            LOGGER.error("sendChange: BAD API Response {}: {}".format(response.status, response.read().decode("utf-8")))
-            return False
-
-        rsp_data = json.loads(response.read().decode("utf-8"))
-        LOGGER.debug('API Response: {}'.format(json.dumps(rsp_data)))
-        return True
+        return all([account.discover() for account in self.accounts])
 
     def delete(self):
-        if not self.auth_token:
+        if not any(account.auth_token for account in self.accounts):
             return True
         cache_file = Path(str(Path.home()) + '/.nest_poly')
         if cache_file.is_file():
             cache_file.unlink()
-        LOGGER.warning('Nest API Authentication token will now be revoked')
-        auth_conn = http.client.HTTPSConnection("api.home.nest.com")
-        try:
-            auth_conn.request("DELETE", "/oauth2/access_tokens/"+self.auth_token)
-        except Exception as e:
-            LOGGER.error('Nest API Connection error: {}'.format(e))
-            auth_conn.close()
-            return False
-        res = auth_conn.getresponse()
-        if res.status == 204:
-            LOGGER.info('Revoke successful')
-        else:
-            data = res.read().decode("utf-8")
-            LOGGER.info('Delete returned: {}'.format(data))
-        auth_conn.close()
-        self.auth_token = None
+        snapshot.remove()
+        return all([account.delete() for account in self.accounts])
 
     def _getToken(self, pin=None):
         ts_now = datetime.datetime.now()
@@ -418,11 +353,11 @@ class Controller(polyinterface.Controller):
                         LOGGER.info('Database token has expired')
                     else:
                         LOGGER.info('Database token valid until: {}'.format(self.polyConfig['customData']['expires']))
-                        self.auth_token = self.polyConfig['customData']['access_token']
+                        self.account.auth_token = self.polyConfig['customData']['access_token']
                         return True
                 else:
                     LOGGER.info('Token expiration time is not found in the DB, attemting to use it anyway')
-                    self.auth_token = self.polyConfig['customData']['access_token']
+                    self.account.auth_token = self.polyConfig['customData']['access_token']
                     return True
             else:
                 LOGGER.info('customData exists, but auth_token does not')
@@ -439,11 +374,15 @@ class Controller(polyinterface.Controller):
             if 'access_token' in cache_data and 'expires' in cache_data:
                 ts_exp = datetime.datetime.strptime(cache_data['expires'], '%Y-%m-%dT%H:%M:%S')
                 if ts_now < ts_exp:
-                    self.auth_token = cache_data['access_token']
+                    self.account.auth_token = cache_data['access_token']
                     LOGGER.info('Cached token valid until: {}'.format(cache_data['expires']))
-                    ''' Save file content to DB '''
-                    cache_data['prof_ver'] = self.profile_version
-                    self.saveCustomData(cache_data)
+                    ''' Save the cached token to DB, next to the tokens of the other accounts '''
+                    cust_data = deepcopy(self.polyConfig.get('customData', {}))
+                    cust_data['access_token'] = cache_data['access_token']
+                    cust_data['expires'] = cache_data['expires']
+                    cust_data['prof_ver'] = self.profile_version
+                    self.saveCustomData(cust_data)
+                    self.polyConfig['customData'] = cust_data
                     ''' cache_file.unlink() '''
                     return True
                 else:
@@ -454,18 +393,47 @@ class Controller(polyinterface.Controller):
             LOGGER.debug('Cached token is not found')
 
         ''' Could not find a saved token, see if we can retrieve one '''
+        server_data = self._serverData()
+        if server_data is None:
+            return False
+
+        if 'pin' in self.polyConfig['customParams']:
+            auth_pin = self.polyConfig['customParams']['pin']
+        elif pin is not None:
+            auth_pin = pin
+
+        if auth_pin is not None:
+            LOGGER.info('PIN code obtained, attempting to get a token')
+            data = self._requestToken(server_data, auth_pin)
+            if data is not None:
+                LOGGER.info('Received authentication token, saving...')
+                cust_data = deepcopy(self.polyConfig['customData'])
+                self.account.auth_token = data['access_token']
+                cust_data['access_token'] = data['access_token']
+                if 'expires' in data:
+                    cust_data['expires'] = data['expires']
+                cust_data['prof_ver'] = self.profile_version
+                self.saveCustomData(cust_data)
+                self.polyConfig['customData'] = cust_data
+                return True
+        else:
+            self._pinPrompt(server_data['api_client'], server_data['api_key'])
+        return False
+
+    def _serverData(self):
+        ''' Nest API client credentials, None if they are not available '''
         if self._cloud:
             server_data = {}
             if 'clientId' in self.poly.init['oauth']:
                server_data['api_client'] =  self.poly.init['oauth']['clientId']
             else:
                 LOGGER.error('Unable to find Client ID in the init data')
-                return False
+                return None
             if 'clientSecret' in self.poly.init['oauth']:
                server_data['api_key'] =  self.poly.init['oauth']['clientSecret']
             else:
                 LOGGER.error('Unable to find Client Secret in the init data')
-                return False
+                return None
         else:
             if 'api_client' in self.polyConfig['customParams'] and 'api_key' in self.polyConfig['customParams']:
                 server_data = {}
@@ -476,44 +444,37 @@ class Controller(polyinterface.Controller):
                 with open('server.json') as sf:
                     server_data = json.load(sf)
                     sf.close()
-
-        if 'pin' in self.polyConfig['customParams']:
-            auth_pin = self.polyConfig['customParams']['pin']
-        elif pin is not None:
-            auth_pin = pin
-
-        if auth_pin is not None:
-            LOGGER.info('PIN code obtained, attempting to get a token')
-            auth_conn = http.client.HTTPSConnection("api.home.nest.com")
-            payload = "code="+auth_pin+"&client_id=" + \
-                      server_data['api_client']+"&client_secret="+server_data['api_key'] + \
-                      "&grant_type=authorization_code"
-            headers = {'content-type': "application/x-www-form-urlencoded"}
-            try:
-                auth_conn.request("POST", "/oauth2/access_token", payload, headers)
-            except Exception as e:
-                LOGGER.error('Nest API Connection error: {}'.format(e))
-                auth_conn.close()
-                return False
-            res = auth_conn.getresponse()
-            data = json.loads(res.read().decode("utf-8"))
+        return server_data
+
+    def _requestToken(self, server_data, auth_pin):
+        ''' Exchange a PIN for a token, returns {'access_token', 'expires'} or None '''
+        auth_conn = connect(NEST_AUTH_URL)
+        payload = "code="+auth_pin+"&client_id=" + \
+                  server_data['api_client']+"&client_secret="+server_data['api_key'] + \
+                  "&grant_type=authorization_code"
+        headers = {'content-type': "application/x-www-form-urlencoded"}
+        try:
+            auth_conn.request("POST", "/oauth2/access_token", payload, headers)
+        except Exception as e:
+            LOGGER.error('Nest API Connection error: {}'.format(e))
             auth_conn.close()
-            if 'access_token' in data:
-                LOGGER.info('Received authentication token, saving...')
-                cust_data = deepcopy(self.polyConfig['customData'])
-                self.auth_token = data['access_token']
-                cust_data['access_token'] = data['access_token']
-                if 'expires_in' in data:
-                    ts = time.time() + data['expires_in']
-                    cust_data['expires'] = datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H:%M:%S")
-                cust_data['prof_ver'] = self.profile_version
-                self.saveCustomData(cust_data)
-                return True
-            else:
-                LOGGER.error('Failed to get auth_token: {}'.format(json.dumps(data)))
-        else:
-            self._pinPrompt(server_data['api_client'], server_data['api_key'])
-        return False
+            return None
+        res = auth_conn.getresponse()
+        data = json.loads(res.read().decode("utf-8"))
+        auth_conn.close()
+        if 'access_token' not in data:
+            LOGGER.error('Failed to get auth_token: {}'.format(json.dumps(data)))
+            return None
+        token = {'access_token': data['access_token']}
+        if 'expires_in' in data:
+            ts = time.time() + data['expires_in']
+            token['expires'] = datetime.datetime.fromtimestamp(ts).strftime("%Y-%m-%dT%H:%M:%S")
+        return token
+
+    def _expired(self, token):
+        if 'expires' not in token:
+            return False
+        return datetime.datetime.now() > datetime.datetime.strptime(token['expires'], '%Y-%m-%dT%H:%M:%S')
 
     def _pinPrompt(self, client_id, client_key):
         if self._cloud:
@@ -531,11 +492,14 @@ class Controller(polyinterface.Controller):
         if 'code' in oauth:
             if self._getToken(oauth['code']):
                 self.removeNoticesAll()
-                self.discover()
-                self._checkStreaming()
+                self.account.requestDiscovery()
 
 
-    drivers = [{'driver': 'ST', 'value': 1, 'uom': 2}]
+    drivers = [{'driver': 'ST', 'value': 1, 'uom': 2},
+               {'driver': 'GV0', 'value': 0, 'uom': 58},
+               {'driver': 'GV1', 'value': 0, 'uom': 56},
+               {'driver': 'GV2', 'value': 0, 'uom': 42},
+               {'driver': 'GV3', 'value': 0, 'uom': 56}]
     commands = {'DISCOVER': discover}
     id = 'NEST_CTR'
 
@@ -0,0 +1,161 @@
+''' Persistent Nest API connection with redirect caching and TLS session reuse '''
+import os
+import ssl
+import time
+import socket
+import http.client
+from threading import Thread, Lock
+from urllib.parse import urlparse
+import metrics
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+''' Both can be pointed at a local stand-in such as nest_sim.py '''
+NEST_API_URL = os.environ.get('NEST_API_URL', 'https://developer-api.nest.com')
+NEST_AUTH_URL = os.environ.get('NEST_AUTH_URL', 'https://api.home.nest.com')
+''' How long to keep sending requests straight to the host we were redirected to '''
+REDIRECT_TTL = 3600
+''' Idle connections are replaced in the background before Nest drops them '''
+IDLE_TIMEOUT = 300
+TIMEOUT = 30
+''' Requests that can be sent again after a timeout, Nest may have applied a PUT it did not answer '''
+IDEMPOTENT = ('GET', 'HEAD')
+''' The server dropped the connection before reading the request, a kept-alive connection that went stale '''
+RESET_ERRORS = (ConnectionResetError, ConnectionAbortedError, BrokenPipeError)
+
+
+def connect(url):
+    ''' New http.client connection for a base URL such as NEST_AUTH_URL '''
+    base_url = urlparse(url)
+    if base_url.scheme == 'http':
+        return http.client.HTTPConnection(base_url.netloc, timeout=TIMEOUT)
+    return http.client.HTTPSConnection(base_url.netloc, timeout=TIMEOUT)
+
+
+class _SessionHTTPSConnection(http.client.HTTPSConnection):
+    ''' HTTPSConnection that resumes a previous TLS session when one is available '''
+    def __init__(self, host, context, session=None, timeout=TIMEOUT):
+        super().__init__(host, timeout=timeout, context=context)
+        self.tls_session = session
+
+    def connect(self):
+        sock = socket.create_connection((self.host, self.port), self.timeout, self.source_address)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host, session=self.tls_session)
+        self.tls_session = self.sock.session
+
+
+class ApiConnection(object):
+    def __init__(self, url=NEST_API_URL):
+        api_url = urlparse(url)
+        self.scheme = api_url.scheme
+        self.default_host = api_url.netloc
+        self.redirect_host = None
+        self.redirect_expires = 0
+        self.redirects = 0
+        self.last_used = time.monotonic()
+        self._conn = None
+        self._conn_host = None
+        self._context = ssl.create_default_context()
+        self._tls_sessions = {}
+        self._lock = Lock()
+
+    @property
+    def host(self):
+        if self.redirect_host is not None and time.monotonic() < self.redirect_expires:
+            return self.redirect_host
+        return self.default_host
+
+    def _connection(self):
+        host = self.host
+        if self._conn is not None and self._conn_host != host:
+            self._close()
+        if self._conn is None:
+            LOGGER.debug('Opening a connection to {}'.format(host))
+            if self.scheme == 'http':
+                self._conn = http.client.HTTPConnection(host, timeout=TIMEOUT)
+            else:
+                self._conn = _SessionHTTPSConnection(host, self._context, self._tls_sessions.get(host))
+            self._conn_host = host
+        return self._conn
+
+    def _close(self):
+        if self._conn is not None:
+            session = getattr(self._conn, 'tls_session', None)
+            if session is not None:
+                self._tls_sessions[self._conn_host] = session
+            self._conn.close()
+            self._conn = None
+            self._conn_host = None
+
+    def request(self, method, path, body=None, headers=None):
+        '''
+        Returns (status, body bytes), follows and remembers 307 redirects.
+        A failed connect, or a connection reset by the server as it is the case
+        for a kept-alive connection that went stale, is retried once. Any other
+        failure is only retried for IDEMPOTENT methods, a PUT that timed out
+        may have been applied and is not sent twice.
+        '''
+        with self._lock:
+            self.last_used = time.monotonic()
+            retried = False
+            redirected = False
+            while True:
+                conn = self._connection()
+                sent = False
+                try:
+                    if conn.sock is None:
+                        conn.connect()
+                    sent = True
+                    conn.request(method, path, body, headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                except (http.client.HTTPException, OSError) as e:
+                    failed_host = self._conn_host
+                    self._close()
+                    if failed_host == self.redirect_host:
+                        self.redirect_host = None
+                    if retried or (sent and not isinstance(e, RESET_ERRORS) and method not in IDEMPOTENT):
+                        raise
+                    LOGGER.debug('Connection to {} failed: {}, retrying'.format(failed_host, e))
+                    retried = True
+                    continue
+                if response.status == 307 and not redirected:
+                    location = urlparse(response.getheader('location'))
+                    LOGGER.debug('Redirected to: {}'.format(location.geturl()))
+                    self.redirects += 1
+                    metrics.REDIRECTS.inc()
+                    self.redirect_host = location.netloc
+                    self.redirect_expires = time.monotonic() + REDIRECT_TTL
+                    redirected = True
+                    continue
+                if response.will_close:
+                    self._close()
+                return response.status, data
+
+    def keepWarm(self):
+        ''' Replace an idle or missing connection in the background so commands find it open '''
+        if self._lock.locked():
+            return
+        if self._conn is not None and self._conn.sock is not None and time.monotonic() - self.last_used < IDLE_TIMEOUT:
+            return
+        Thread(target=self._reconnect, daemon=True).start()
+
+    def _reconnect(self):
+        with self._lock:
+            self._close()
+            conn = self._connection()
+            try:
+                conn.connect()
+            except OSError as e:
+                LOGGER.debug('Background connect to {} failed: {}'.format(self._conn_host, e))
+                self._close()
+                return
+            self.last_used = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            self._close()
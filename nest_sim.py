@@ -0,0 +1,409 @@
+#!/usr/bin/env python3
+'''
+Local stand-in for the Nest API (developer-api.nest.com and api.home.nest.com)
+for offline load and regression testing, point the node server at it with
+
+    NEST_API_URL=http://127.0.0.1:8080 NEST_AUTH_URL=http://127.0.0.1:8080
+
+Serves the REST snapshot and the REST Streaming (SSE) event stream for any
+path, applies PUT requests to its state, can redirect all requests to a
+second port like Nest does, and can block writes that exceed a rate limit.
+Test hooks:
+    POST /_sim/event?type=cancel|error|auth_revoked  send an event to all streams
+    POST /_sim/set  {"path": "/devices/...", "data": {...}}  change state
+'''
+import sys
+import json
+import time
+import random
+import argparse
+import datetime
+from copy import deepcopy
+from threading import Thread, Condition
+from collections import deque, defaultdict
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+BLOCKED = {'error': 'blocked', 'type': 'https://developer.nest.com/documentation/cloud/error-messages#blocked',
+           'message': 'blocked', 'instance': 'nest-sim'}
+
+
+def _zulu(ts):
+    return datetime.datetime.utcfromtimestamp(ts).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+def _id(rnd, length=32):
+    return ''.join(rnd.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_') for _ in range(length))
+
+
+def make_thermostat(rnd, dev_id, struct_id, index, scale):
+    ambient_f = rnd.randint(62, 78)
+    ambient_c = round((ambient_f - 32) / 1.8 * 2) / 2
+    tstat = {
+        'device_id': dev_id, 'structure_id': struct_id, 'where_id': _id(rnd, 43), 'locale': 'en-US',
+        'software_version': '5.9.3-5', 'name': 'Thermostat {}'.format(index),
+        'name_long': 'Thermostat {} Thermostat'.format(index), 'label': '', 'temperature_scale': scale,
+        'is_online': True, 'last_connection': _zulu(time.time()), 'can_cool': True, 'can_heat': True,
+        'is_using_emergency_heat': False, 'has_fan': True, 'fan_timer_active': False,
+        'fan_timer_timeout': '1970-01-01T00:00:00.000Z', 'fan_timer_duration': 15, 'has_leaf': True,
+        'hvac_mode': rnd.choice(['heat', 'cool', 'heat-cool']), 'hvac_state': 'off', 'is_locked': False,
+        'humidity': rnd.randint(30, 60), 'time_to_target': '~0', 'time_to_target_training': 'ready',
+        'sunlight_correction_enabled': True, 'sunlight_correction_active': False,
+        'previous_hvac_mode': '', 'where_name': 'Room {}'.format(index),
+    }
+    for suffix, ambient, low, high, eco_low, eco_high, lock_min, lock_max in (
+            ('_f', ambient_f, 66, 76, 62, 80, 66, 78),
+            ('_c', ambient_c, 19.0, 24.5, 16.5, 26.5, 19.0, 25.5)):
+        tstat['ambient_temperature' + suffix] = ambient
+        tstat['target_temperature' + suffix] = low
+        tstat['target_temperature_low' + suffix] = low
+        tstat['target_temperature_high' + suffix] = high
+        tstat['eco_temperature_low' + suffix] = eco_low
+        tstat['eco_temperature_high' + suffix] = eco_high
+        tstat['away_temperature_low' + suffix] = eco_low
+        tstat['away_temperature_high' + suffix] = eco_high
+        tstat['locked_temp_min' + suffix] = lock_min
+        tstat['locked_temp_max' + suffix] = lock_max
+    return tstat
+
+
+def make_protect(rnd, dev_id, struct_id, index):
+    return {
+        'device_id': dev_id, 'structure_id': struct_id, 'where_id': _id(rnd, 43), 'locale': 'en-US',
+        'software_version': '3.1.4rc3', 'name': 'Protect {}'.format(index),
+        'name_long': 'Protect {} Nest Protect'.format(index), 'is_online': True,
+        'last_connection': _zulu(time.time()), 'battery_health': 'ok', 'co_alarm_state': 'ok',
+        'smoke_alarm_state': 'ok', 'is_manual_test_active': False,
+        'last_manual_test_time': _zulu(time.time() - rnd.randint(1, 200) * 86400),
+        'ui_color_state': 'green', 'where_name': 'Room {}'.format(index),
+    }
+
+
+def make_camera(rnd, dev_id, struct_id, index):
+    start = time.time() - rnd.randint(60, 86400)
+    cam_url = 'https://home.nest.com/cameras/' + dev_id
+    return {
+        'device_id': dev_id, 'structure_id': struct_id, 'where_id': _id(rnd, 43),
+        'software_version': '205-600052', 'name': 'Camera {}'.format(index),
+        'name_long': 'Camera {} Camera'.format(index), 'is_online': True, 'is_streaming': True,
+        'is_audio_input_enabled': True, 'last_is_online_change': _zulu(start), 'is_video_history_enabled': True,
+        'web_url': cam_url + '?auth=' + _id(rnd, 64), 'app_url': 'nestmobile://cameras/' + dev_id + '?auth=' + _id(rnd, 64),
+        'is_public_share_enabled': False, 'public_share_url': '',
+        'snapshot_url': 'https://developer.nest.com/simulator/api/v1/nest/devices/camera/snapshot/' + _id(rnd, 64),
+        'activity_zones': [{'name': 'Zone {}'.format(z), 'id': z} for z in range(rnd.randint(1, 4))],
+        'last_event': {
+            'has_sound': False, 'has_motion': True, 'has_person': False,
+            'start_time': _zulu(start), 'end_time': _zulu(start + 30),
+            'urls_expire_time': _zulu(start + 86400),
+            'web_url': cam_url + '/cuepoints/' + _id(rnd, 16), 'app_url': 'nestmobile://cameras/' + dev_id + '/cuepoints',
+            'image_url': 'https://developer.nest.com/simulator/api/v1/nest/devices/camera/snapshot/' + _id(rnd, 64),
+            'animated_image_url': 'https://developer.nest.com/simulator/api/v1/nest/devices/camera/snapshot/' + _id(rnd, 64),
+            'activity_zone_ids': [0],
+        },
+    }
+
+
+def make_home(structures=1, thermostats=2, protects=2, cameras=1, scale='F', seed=1):
+    ''' Synthetic Nest API tree, devices are spread evenly over the structures '''
+    rnd = random.Random(seed)
+    data = {'devices': {}, 'structures': {}, 'metadata': {'access_token': 'c.sim', 'client_version': 1}}
+    struct_ids = []
+    for index in range(structures):
+        struct_id = _id(rnd, 86)
+        struct_ids.append(struct_id)
+        now = time.time()
+        data['structures'][struct_id] = {
+            'structure_id': struct_id, 'name': 'Home {}'.format(index + 1), 'country_code': 'US',
+            'time_zone': 'America/Los_Angeles', 'away': 'home', 'thermostats': [], 'smoke_co_alarms': [],
+            'cameras': [], 'rhr_enrollment': True, 'peak_period_start_time': _zulu(now + 3600),
+            'peak_period_end_time': _zulu(now + 7200), 'co_alarm_state': 'ok', 'smoke_alarm_state': 'ok',
+            'wwn_security_state': 'ok', 'wheres': {},
+        }
+    for dev_type, count, factory in (('thermostats', thermostats, make_thermostat),
+                                      ('smoke_co_alarms', protects, make_protect),
+                                      ('cameras', cameras, make_camera)):
+        if count < 1:
+            continue
+        devices = data['devices'][dev_type] = {}
+        for index in range(count):
+            dev_id = _id(rnd)
+            struct_id = struct_ids[index % len(struct_ids)]
+            if dev_type == 'thermostats':
+                devices[dev_id] = factory(rnd, dev_id, struct_id, index + 1, scale)
+            else:
+                devices[dev_id] = factory(rnd, dev_id, struct_id, index + 1)
+            data['structures'][struct_id][dev_type].append(dev_id)
+    return data
+
+
+def mutate(data, rnd):
+    ''' Apply one random device change of the kind Nest streams, returns its path '''
+    devices = data['devices']
+    dev_type = rnd.choice(list(devices))
+    dev_id = rnd.choice(list(devices[dev_type]))
+    device = devices[dev_type][dev_id]
+    if dev_type == 'thermostats':
+        device['humidity'] = rnd.randint(30, 60)
+        device['ambient_temperature_f'] = rnd.randint(62, 78)
+        device['ambient_temperature_c'] = round((device['ambient_temperature_f'] - 32) / 1.8 * 2) / 2
+    elif dev_type == 'cameras':
+        now = time.time()
+        device['last_event'] = dict(device['last_event'], start_time=_zulu(now), end_time=_zulu(now + rnd.randint(5, 60)),
+                                    has_person=rnd.random() < 0.3)
+        device['snapshot_url'] = device['snapshot_url'][:-8] + _id(rnd, 8)
+    else:
+        device['last_connection'] = _zulu(time.time())
+    return '/devices/{}/{}'.format(dev_type, dev_id)
+
+
+def get_path(data, path):
+    node = data
+    for key in [p for p in path.split('/') if p]:
+        if not isinstance(node, dict) or key not in node:
+            return None
+        node = node[key]
+    return node
+
+
+class NestSim(object):
+    def __init__(self, data, keepalive=30, rate_limit=0):
+        self.data = data
+        self.keepalive = keepalive
+        self.rate_limit = rate_limit
+        self.version = 0
+        self.cond = Condition()
+        self.control_events = []
+        self.writes = defaultdict(deque)
+        self.stats = defaultdict(int)
+        ''' Access tokens revoked with DELETE /oauth2/access_tokens/<token> '''
+        self.revoked = []
+
+    def changed(self):
+        with self.cond:
+            self.version += 1
+            self.cond.notify_all()
+
+    def control(self, event_type):
+        with self.cond:
+            self.control_events.append(event_type)
+            self.version += 1
+            self.cond.notify_all()
+
+    def apply(self, path, changes):
+        with self.cond:
+            target = get_path(self.data, path)
+            if not isinstance(target, dict):
+                return False
+            target.update(changes)
+        self.changed()
+        return True
+
+    def allow_write(self, path):
+        if not self.rate_limit:
+            return True
+        now = time.time()
+        writes = self.writes[path]
+        while writes and now - writes[0] > 60:
+            writes.popleft()
+        if len(writes) >= self.rate_limit:
+            return False
+        writes.append(now)
+        return True
+
+    def churn(self, rate, seed=2):
+        ''' Random device changes at rate events per second '''
+        rnd = random.Random(seed)
+        while True:
+            time.sleep(1 / rate)
+            with self.cond:
+                mutate(self.data, rnd)
+            self.changed()
+
+
+class SimHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _redirect(self):
+        if self.server.redirect_to is None:
+            return False
+        self.send_response(307)
+        self.send_header('Location', self.server.redirect_to + self.path)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return True
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length).decode('utf-8') if length else ''
+
+    def do_GET(self):
+        sim = self.server.sim
+        if self._redirect():
+            return
+        path = urlparse(self.path).path
+        if 'text/event-stream' in self.headers.get('Accept', ''):
+            self._stream(path)
+            return
+        sim.stats['get'] += 1
+        with sim.cond:
+            body = deepcopy(get_path(sim.data, path))
+        self._send_json(200, body)
+
+    def do_PUT(self):
+        sim = self.server.sim
+        if self._redirect():
+            return
+        path = urlparse(self.path).path
+        try:
+            changes = json.loads(self._read_body())
+        except ValueError:
+            self._send_json(400, {'error': 'Invalid content sent'})
+            return
+        if not sim.allow_write(path):
+            sim.stats['blocked'] += 1
+            self._send_json(429, BLOCKED)
+            return
+        if not sim.apply(path, changes):
+            self._send_json(404, {'error': 'Not found'})
+            return
+        sim.stats['put'] += 1
+        self._send_json(200, changes)
+
+    def do_POST(self):
+        sim = self.server.sim
+        url = urlparse(self.path)
+        if url.path == '/oauth2/access_token':
+            self._read_body()
+            self._send_json(200, {'access_token': 'c.sim', 'expires_in': 315360000})
+        elif url.path == '/_sim/event':
+            sim.control(parse_qs(url.query).get('type', ['cancel'])[0])
+            self._send_json(200, {})
+        elif url.path == '/_sim/set':
+            change = json.loads(self._read_body())
+            self._send_json(200 if sim.apply(change['path'], change['data']) else 404, {})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_DELETE(self):
+        path = urlparse(self.path).path
+        if path.startswith('/oauth2/access_tokens/'):
+            self.server.sim.revoked.append(path[len('/oauth2/access_tokens/'):])
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def _event(self, event_type, data):
+        ''' One HTTP chunk per event, like Nest, so clients see every event as soon as it is sent '''
+        event = 'event: {}\ndata: {}\n\n'.format(event_type, data).encode('utf-8')
+        self.wfile.write('{:x}\r\n'.format(len(event)).encode('ascii') + event + b'\r\n')
+        self.wfile.flush()
+
+    def _stream(self, path):
+        sim = self.server.sim
+        sim.stats['streams'] += 1
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        version = -1
+        control_seen = len(sim.control_events)
+        last_sent = None
+        try:
+            while True:
+                with sim.cond:
+                    if sim.version == version:
+                        sim.cond.wait(sim.keepalive)
+                    if sim.version == version:
+                        data = None
+                    else:
+                        version = sim.version
+                        control = sim.control_events[control_seen:]
+                        control_seen = len(sim.control_events)
+                        data = json.dumps({'path': path, 'data': get_path(sim.data, path)})
+                if data is None:
+                    self._event('keep-alive', 'null')
+                    continue
+                for event_type in control:
+                    self._event(event_type, 'null')
+                    self.wfile.write(b'0\r\n\r\n')
+                    return
+                if data != last_sent:
+                    sim.stats['events'] += 1
+                    self._event('put', data)
+                    last_sent = data
+        except (BrokenPipeError, ConnectionResetError):
+            return
+
+
+class SimServer(ThreadingMixIn, HTTPServer):
+    ''' http.server.ThreadingHTTPServer only exists from Python 3.7 on '''
+    daemon_threads = True
+
+
+def serve(sim, host, port, redirect_to=None, verbose=False):
+    server = SimServer((host, port), SimHandler)
+    server.sim = sim
+    server.redirect_to = redirect_to
+    server.verbose = verbose
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local Nest API stand-in')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--structures', type=int, default=1)
+    parser.add_argument('--thermostats', type=int, default=2)
+    parser.add_argument('--protects', type=int, default=2)
+    parser.add_argument('--cameras', type=int, default=1)
+    parser.add_argument('--scale', choices=['F', 'C'], default='F')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--data', help='serve a recorded Nest API JSON snapshot instead of a synthetic home')
+    parser.add_argument('--redirect', action='store_true', help='307 every request to --port + 1 like Nest does')
+    parser.add_argument('--rate-limit', type=int, default=0, help='max PUTs per path per minute, 0 is unlimited')
+    parser.add_argument('--keepalive', type=float, default=30)
+    parser.add_argument('--churn', type=float, default=0, help='random device changes per second')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    if args.data:
+        with open(args.data) as f:
+            data = json.load(f)
+    else:
+        data = make_home(args.structures, args.thermostats, args.protects, args.cameras, args.scale, args.seed)
+    sim = NestSim(data, args.keepalive, args.rate_limit)
+    if args.redirect:
+        serve(sim, args.host, args.port + 1, verbose=args.verbose)
+        serve(sim, args.host, args.port, 'http://{}:{}'.format(args.host, args.port + 1), args.verbose)
+    else:
+        serve(sim, args.host, args.port, verbose=args.verbose)
+    if args.churn > 0:
+        Thread(target=sim.churn, args=(args.churn,), daemon=True).start()
+    print('Nest API stand-in listening on http://{}:{}'.format(args.host, args.port))
+    try:
+        while True:
+            time.sleep(60)
+            print('Stats: {}'.format(dict(sim.stats)))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
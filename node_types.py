@@ -1,16 +1,200 @@
+import math
 import datetime
+from threading import RLock
 try:
     import polyinterface
 except ImportError:
     import pgc_interface as polyinterface
-from converters import zulu_2_ts, cosmost2num, secst2num
+from converters import zulu_2_ts, ts_2_epoch, cosmost2num, secst2num, away2num, mode2num, battery2num, color2num, ttt2num, \
+    UI_COLORS
+from dispatch import get_element
+from driver_spec import Driver, compile_spec, extract
+import projection
 
 LOGGER = polyinterface.LOGGER
 
 NEST_MODES = {0: "off", 1: "heat", 2: "cool", 3: "heat-cool", 13: "eco"}
 NEST_AWAY = {1: 'home', 2: 'away'}
+''' Thermostat temperature fields, Nest has an _f and a _c version of each '''
+TEMP_FIELDS = ('ambient_temperature', 'target_temperature', 'target_temperature_high', 'target_temperature_low',
+               'eco_temperature_high', 'eco_temperature_low', 'locked_temp_max', 'locked_temp_min')
+
+
+class NestNode(polyinterface.Node):
+    '''
+    Keeps a shadow of the last published driver values, unchanged values
+    are never sent and the changes made during update() are flushed together
+    '''
+    ''' Nest API fields the node reads, everything else is dropped from the snapshot '''
+    fields = ('name', 'name_long')
+    ''' Driver specs, compiled into drivers, the field extractors and fields for every subclass '''
+    driver_spec = ()
+    alarm_drivers = ()
+    _extractors = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._compile()
+
+    @classmethod
+    def _compile(cls):
+        cls.drivers, cls._extractors, paths = compile_spec(cls, cls.driver_spec)
+        cls.fields = tuple(dict.fromkeys(cls.fields + paths))
+
+    def __init__(self, controller, primary, address, name):
+        super().__init__(controller, primary, address, name)
+        self._shadow = {}
+        self._pending = None
+        self._optimistic = {}
+        ''' Alarm drivers published by the stream reader while an update held the lock '''
+        self._alarms = None
+        self.shadow_hits = 0
+        self.shadow_misses = 0
+        self.retired = False
+        self._update_lock = RLock()
+        ''' The Nest account the node belongs to, the account creating it replaces the primary one '''
+        self.account = controller.account
 
-class Structure(polyinterface.Node):
+    def update(self):
+        ''' A retired node no longer has an element in the Nest data '''
+        if self.retired:
+            return
+        ''' query() from Polyglot may race a dispatcher worker '''
+        with self._update_lock:
+            self._pending = {}
+            try:
+                self._update()
+                tracker = getattr(self.controller, 'command_tracker', None)
+                if tracker is not None:
+                    tracker.reconcile(self)
+            finally:
+                self._flushDrivers()
+
+    def _update(self):
+        pass
+
+    def runCmd(self, command):
+        ''' Commands run under the update lock so the drivers they set are not mixed into an update '''
+        with self._update_lock:
+            super().runCmd(command)
+
+    def sendCommand(self, payload):
+        '''
+        Send a change to the Nest API. The drivers set by the command since
+        are held at the requested values until the stream confirms the change,
+        they are rolled back if the PUT fails or the change never shows up.
+        '''
+        drivers, self._optimistic = self._optimistic, {}
+        future = self.account.sendChange(self.set_url, payload)
+        if future is False:
+            self.update()
+            return False
+        tracker = getattr(self.controller, 'command_tracker', None)
+        if tracker is not None:
+            tracker.track(self, payload, drivers, future)
+        return future
+
+    def _requested(self):
+        ''' Fields of commands Nest has not confirmed yet, with the values sent '''
+        tracker = getattr(self.controller, 'command_tracker', None)
+        return tracker.requested(self) if tracker is not None else {}
+
+    def updateAlarms(self):
+        '''
+        Publish only the smoke and CO alarm drivers, ahead of the full update.
+        Runs on the stream reader, which never waits for an update() of the
+        node in progress on a dispatcher worker: the alarm drivers are then
+        published right away and handed to that update, whose flush must not
+        put the older values back
+        '''
+        if self.retired:
+            return
+        element = get_element(self.account.data, self.kind, self.element_id)
+        if element is None:
+            return
+        if not self._update_lock.acquire(blocking=False):
+            alarms = dict(extract(element, self._extractors, self.alarm_drivers))
+            self._alarms = alarms
+            for driver, value in alarms.items():
+                polyinterface.Node.setDriver(self, driver, value)
+            return
+        try:
+            self.data = element
+            self._pending = {}
+            try:
+                self._updateAlarms()
+            finally:
+                self._flushDrivers()
+        finally:
+            self._update_lock.release()
+
+    def _updateAlarms(self):
+        self._applySpec(self.alarm_drivers)
+
+    def _applySpec(self, only=None):
+        for driver, value in extract(self.data, self._extractors, only):
+            self.setDriver(driver, value)
+
+    def _setTimer(self, driver, when, func=None):
+        '''
+        Recompute a time derived driver with func at when (seconds since the
+        epoch), replacing the previous timer for that driver. None cancels it.
+        '''
+        scheduler = getattr(self.controller, 'scheduler', None)
+        if scheduler is None:
+            return
+        if when is None:
+            scheduler.cancel((self.address, driver))
+        else:
+            scheduler.schedule((self.address, driver), when, lambda: self._onTimer(func))
+
+    def _onTimer(self, func):
+        if self.retired:
+            return
+        with self._update_lock:
+            self._pending = {}
+            try:
+                func()
+            finally:
+                self._flushDrivers()
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        if not report or force:
+            super().setDriver(driver, value, report, force, uom)
+            return
+        shadow_value = (str(value), uom)
+        if self._shadow.get(driver) == shadow_value:
+            self.shadow_hits += 1
+            return
+        self.shadow_misses += 1
+        self._shadow[driver] = shadow_value
+        if self._pending is not None:
+            self._pending[driver] = (value, uom)
+        else:
+            ''' Outside of an update only commands set drivers '''
+            self._optimistic[driver] = (value, uom)
+            super().setDriver(driver, value, uom=uom)
+
+    def _flushDrivers(self):
+        pending = self._pending
+        self._pending = None
+        alarms, self._alarms = self._alarms, None
+        if alarms:
+            ''' Published by updateAlarms() while this update ran, from a newer snapshot '''
+            for driver, value in alarms.items():
+                pending.pop(driver, None)
+                self._shadow[driver] = (str(value), None)
+        tracker = getattr(self.controller, 'command_tracker', None)
+        held = tracker.held(self) if tracker is not None else {}
+        for driver, (value, uom) in pending.items():
+            if driver in held:
+                ''' ISY keeps showing the requested value until Nest confirms or rejects it '''
+                self._shadow[driver] = (str(held[driver][0]), held[driver][1])
+                continue
+            super().setDriver(driver, value, uom=uom)
+
+
+class Structure(NestNode):
     def __init__(self, controller, primary, address, name, element_id, device):
         super().__init__(controller, primary, address, name)
         self.name = name
@@ -27,35 +211,11 @@ class Structure(polyinterface.Node):
         self.update()
         self.reportDrivers()
 
-    def update(self):
-        self.data = self.controller.data['structures'][self.element_id]
-
-        if self.data['away'] == 'away':
-            self.away = True
-            self.setDriver('ST', 2)
-        else:
-            self.away = False
-            self.setDriver('ST', 1)
-
-        if self._checkRushHour():
-            self.setDriver('GV0', 1)
-        else:
-            self.setDriver('GV0', 0)
-
-        if 'smoke_alarm_state' in self.data:
-            self.setDriver('GV1', cosmost2num(self.data['smoke_alarm_state']))
-        else:
-            self.setDriver('GV1', 1)
-
-        if 'co_alarm_state' in self.data:
-            self.setDriver('GV2', cosmost2num(self.data['co_alarm_state']))
-        else:
-            self.setDriver('GV2', 1)
-
-        if 'wwn_security_state' in self.data:
-            self.setDriver('GV3', secst2num(self.data['wwn_security_state']))
-        else:
-            self.setDriver('GV3', 1)
+    def _update(self):
+        self.data = self.account.data['structures'][self.element_id]
+        self.away = self.data['away'] == 'away'
+        self._applySpec()
+        self._updateRushHour()
 
     def setAway(self, command):
         away = int(command.get('value'))
@@ -67,7 +227,28 @@ class Structure(polyinterface.Node):
             return False
         nest_command = { 'away': NEST_AWAY[away] }
         self.setDriver('ST', away)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
+
+    def _updateRushHour(self):
+        if self._checkRushHour():
+            self.setDriver('GV0', 1)
+        else:
+            self.setDriver('GV0', 0)
+        self._setTimer('GV0', self._nextRushHourChange(), self._updateRushHour)
+
+    def _nextRushHourChange(self):
+        ''' When the rush hour window opens or closes next, None if it does not '''
+        if not self.data.get('rhr_enrollment') or 'peak_period_start_time' not in self.data \
+                or 'peak_period_end_time' not in self.data:
+            return None
+        ts_start = zulu_2_ts(self.data['peak_period_start_time'])
+        ts_end = zulu_2_ts(self.data['peak_period_end_time'])
+        ts_now = datetime.datetime.utcnow()
+        if ts_now < ts_start:
+            return ts_2_epoch(ts_start)
+        if ts_now <= ts_end:
+            return ts_2_epoch(ts_end) + 0.001
+        return None
 
     def _checkRushHour(self):
         if 'rhr_enrollment' in self.data:
@@ -80,20 +261,22 @@ class Structure(polyinterface.Node):
                         return True
         return False
 
-    drivers = [ { 'driver': 'ST', 'value': 0, 'uom': '25' },
-                { 'driver': 'GV0', 'value': 0, 'uom': '2' },
-                { 'driver': 'GV1', 'value': 0, 'uom': '25' },
-                { 'driver': 'GV2', 'value': 0, 'uom': '25' },
-                { 'driver': 'GV3', 'value': 0, 'uom': '25' }
-              ]
+    driver_spec = ( Driver('ST', '25', 'away', away2num),
+                    Driver('GV0', '2'),
+                    Driver('GV1', '25', 'smoke_alarm_state', cosmost2num, default=1),
+                    Driver('GV2', '25', 'co_alarm_state', cosmost2num, default=1),
+                    Driver('GV3', '25', 'wwn_security_state', secst2num, default=1) )
+    alarm_drivers = ('GV1', 'GV2')
 
     commands = { 'SET_AWAY': setAway,
                  'QUERY': query }
 
     id = 'NEST_STR'
+    kind = 'structures'
+    fields = NestNode.fields + ('rhr_enrollment', 'peak_period_start_time', 'peak_period_end_time')
 
 
-class Thermostat(polyinterface.Node):
+class Thermostat(NestNode):
     def __init__(self, controller, primary, address, name, element_id, device):
         super().__init__(controller, primary, address, name)
         self.name = name
@@ -101,7 +284,6 @@ class Thermostat(polyinterface.Node):
         self.element_id = element_id
         self.element_prefix = '/devices/thermostats/'
         self.set_url = self.element_prefix + self.element_id
-        self.temp_suffix = '_f'
         self.ambient_temp = None
         self.heat_sp = None
         self.cool_sp = None
@@ -122,74 +304,45 @@ class Thermostat(polyinterface.Node):
     def start(self):
         self.update()
 
-    def update(self):
-        self.data = self.controller.data['devices']['thermostats'][self.element_id]
-        self.ambient_temp = self._str2temp(self.data['ambient_temperature'+self.temp_suffix])
-        self.setDriver('ST', self.ambient_temp)
+    def _update(self):
+        self.data = self.account.data['devices']['thermostats'][self.element_id]
+        self._applySpec()
+        temp_keys = self.temp_keys
+        self.ambient_temp = self._str2temp(self.data[temp_keys['ambient_temperature']])
         self.mode = self.data['hvac_mode']
-        self.sp = self._str2temp(self.data['target_temperature'+self.temp_suffix])
+        self.sp = self._str2temp(self.data[temp_keys['target_temperature']])
         if self.mode != 'eco':
-            self.heat_sp = self._str2temp(self.data['target_temperature_low'+self.temp_suffix])
-            self.cool_sp = self._str2temp(self.data['target_temperature_high'+self.temp_suffix])
+            self.heat_sp = self._str2temp(self.data[temp_keys['target_temperature_low']])
+            self.cool_sp = self._str2temp(self.data[temp_keys['target_temperature_high']])
         else:
-            self.heat_sp = self._str2temp(self.data['eco_temperature_low'+self.temp_suffix])
-            self.cool_sp = self._str2temp(self.data['eco_temperature_high'+self.temp_suffix])
-
-        self.lock_max = self._str2temp(self.data['locked_temp_max'+self.temp_suffix])
-        self.lock_min = self._str2temp(self.data['locked_temp_min'+self.temp_suffix])
-        if self.data['is_locked']:
-            self.locked = True
-            self.setDriver('SECMD', 1)
-        else:
-            self.locked = False
-            self.setDriver('SECMD', 0)
-
-        if self.data['is_using_emergency_heat']:
-            self.emerg_heat = True
-        else:
-            self.emerg_heat = False
-
-        self.setDriver('CLIHUM', int(self.data['humidity']))
-        self.setDriver('GV2', int(self.data['time_to_target'].replace('~','').replace('>','').replace('<','')))
-
+            self.heat_sp = self._str2temp(self.data[temp_keys['eco_temperature_low']])
+            self.cool_sp = self._str2temp(self.data[temp_keys['eco_temperature_high']])
+        ''' Setpoints Nest has not confirmed yet keep the requested value, the next BRT/DIM builds on it '''
+        requested = self._requested()
+        if requested:
+            self.sp = requested.get(temp_keys['target_temperature'], self.sp)
+            if self.mode != 'eco':
+                self.heat_sp = requested.get(temp_keys['target_temperature_low'], self.heat_sp)
+                self.cool_sp = requested.get(temp_keys['target_temperature_high'], self.cool_sp)
+        self.lock_max = self._str2temp(self.data[temp_keys['locked_temp_max']])
+        self.lock_min = self._str2temp(self.data[temp_keys['locked_temp_min']])
+        self.locked = bool(self.data['is_locked'])
+        self.emerg_heat = bool(self.data['is_using_emergency_heat'])
         self.fan_timer = int(self.data['fan_timer_duration'])
-        self.setDriver('GV1', self.fan_timer)
+        self.fan_mode = 1 if self.data['fan_timer_active'] else 0
+        self.online = bool(self.data['is_online'])
 
-        if self.mode == 'heat-cool':
-            self.setDriver('CLIMD', 3)
-            self.setDriver('CLISPH', self.heat_sp)
-            self.setDriver('CLISPC', self.cool_sp)
-        elif self.mode == 'heat':
+        ''' Single setpoint modes show the target on the matching driver '''
+        if self.mode == 'heat':
             self.setDriver('CLISPH', self.sp)
             self.setDriver('CLISPC', self.cool_sp)
-            self.setDriver('CLIMD', 1)
         elif self.mode == 'cool':
-            self.setDriver('CLIMD', 2)
             self.setDriver('CLISPH', self.heat_sp)
             self.setDriver('CLISPC', self.sp)
-        elif self.mode == 'eco':
-            self.setDriver('CLIMD', 13)
-            self.setDriver('CLISPH', self.heat_sp)
-            self.setDriver('CLISPC', self.cool_sp)
         else:
-            self.setDriver('CLIMD', 0)
             self.setDriver('CLISPH', self.heat_sp)
             self.setDriver('CLISPC', self.cool_sp)
 
-        if self.data['fan_timer_active']:
-            self.fan_mode = 1
-            self.setDriver('CLIFS', 1)
-        else:
-            self.fan_mode = 0
-            self.setDriver('CLIFS', 0)
-
-        if self.data['is_online']:
-            self.setDriver('GV0', 1)
-            self.online = True
-        else:
-            self.setDriver('GV0', 0)
-            self.online = False
-
         if self.data['hvac_state'] == 'cooling':
             if self.state == 0:
                 self.reportCmd('DON')
@@ -234,7 +387,7 @@ class Thermostat(polyinterface.Node):
         else:
             LOGGER.error('CLISPH: Failed to set {} Heat Setpoint: unknown thermostat mode'.format(self.name))
             return False
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def setCool(self, command):
         if not self._checkOnline():
@@ -258,7 +411,7 @@ class Thermostat(polyinterface.Node):
         else:
             LOGGER.error('CLISPC: Failed to set {} Cool Setpoint: unknown thermostat mode'.format(self.name))
             return False
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def setRange(self, command):
         query = command.get('query')
@@ -288,7 +441,7 @@ class Thermostat(polyinterface.Node):
             self.cool_sp = new_sp_cool
             nest_command['target_temperature_high'+self.temp_suffix] = self.cool_sp
             self.setDriver('CLISPC', self.cool_sp)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def setMode(self, command):
         if not self._checkOnline():
@@ -309,7 +462,7 @@ class Thermostat(polyinterface.Node):
         LOGGER.debug('Changing {} mode to: {}'.format(self.name, new_mode_str))
         nest_command = { 'hvac_mode': new_mode_str }
         self.setDriver('CLIMD', new_mode)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def setFan(self, command):
         if not self._checkOnline():
@@ -326,7 +479,7 @@ class Thermostat(polyinterface.Node):
         else:
             nest_command = { 'fan_timer_active': False }
         self.setDriver('CLIFS', new_fan)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def setFanTimer(self, command):
         if not self._checkOnline():
@@ -343,7 +496,7 @@ class Thermostat(polyinterface.Node):
             return False
         nest_command = { 'fan_timer_duration': new_timer }
         self.setDriver('GV1', new_timer)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def setIncDec(self, command):
         if not self._checkOnline():
@@ -374,6 +527,7 @@ class Thermostat(polyinterface.Node):
             current_sp = self.sp
         else:
             LOGGER.error('Increasing or Decreasing setpoint is not available while in {} mode'.format(self.mode))
+            return False
         if cmd == 'BRT':
             if heating:
                 new_sp = current_sp + self._sp_inc
@@ -396,9 +550,17 @@ class Thermostat(polyinterface.Node):
             return False
         if not self._checkLock(new_sp):
             return False
+        ''' Track the new setpoint locally so repeated BRT/DIM accumulate, the queue merges them into one PUT '''
+        if self.mode == 'heat-cool':
+            if heating:
+                self.heat_sp = new_sp
+            else:
+                self.cool_sp = new_sp
+        else:
+            self.sp = new_sp
         nest_command = {nest_keyword: new_sp}
         self.setDriver(driver, new_sp)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def _checkLock(self, new_sp):
         if self.locked:
@@ -493,17 +655,21 @@ class Thermostat(polyinterface.Node):
             result = self._sp_min
         return result
 
-    drivers = [ { 'driver': 'CLIMD', 'value': 0, 'uom': '67' },
-                { 'driver': 'CLISPC', 'value': 0, 'uom': '17' },
-                { 'driver': 'CLISPH', 'value': 0, 'uom': '17' },
-                { 'driver': 'ST', 'value': 0, 'uom': '17' },
-                { 'driver': 'CLIFS', 'value': 0, 'uom': '68' },
-                { 'driver': 'CLIHUM', 'value': 0, 'uom': '22' },
-                { 'driver': 'CLIHCS', 'value': 0, 'uom': '66' },
-                { 'driver': 'SECMD', 'value': 0, 'uom': '84' },
-                { 'driver': 'GV1', 'value': 0, 'uom': '45' },
-                { 'driver': 'GV2', 'value': 0, 'uom': '45' },
-                { 'driver': 'GV0', 'value': 0, 'uom': '2' }]
+    temp_suffix = '_f'
+    temp_uom = '17'
+    temp_type = int
+
+    driver_spec = ( Driver('CLIMD', '67', 'hvac_mode', mode2num),
+                    Driver('CLISPC', '{temp_uom}'),
+                    Driver('CLISPH', '{temp_uom}'),
+                    Driver('ST', '{temp_uom}', 'ambient_temperature{temp_suffix}', 'temp_type'),
+                    Driver('CLIFS', '68', 'fan_timer_active', int),
+                    Driver('CLIHUM', '22', 'humidity', int),
+                    Driver('CLIHCS', '66'),
+                    Driver('SECMD', '84', 'is_locked', int),
+                    Driver('GV1', '45', 'fan_timer_duration', int),
+                    Driver('GV2', '45', 'time_to_target', ttt2num),
+                    Driver('GV0', '2', 'is_online', int) )
 
     commands = { 'CLIMD': setMode,
                  'CLIFS': setFan,
@@ -516,27 +682,26 @@ class Thermostat(polyinterface.Node):
                  'QUERY': query }
 
     id = 'NEST_TST_F'
+    kind = 'thermostats'
+    fields = NestNode.fields + ('temperature_scale', 'hvac_state', 'is_using_emergency_heat', 'can_heat', 'can_cool',
+                                'has_fan') + tuple(field + suffix for field in TEMP_FIELDS for suffix in ('_f', '_c'))
+
+    @classmethod
+    def _compile(cls):
+        super()._compile()
+        cls.temp_keys = {field: field + cls.temp_suffix for field in TEMP_FIELDS}
 
 
 class ThermostatC(Thermostat):
     def __init__(self, controller, primary, address, name, element_id, device):
         super().__init__(controller, primary, address, name, element_id, device)
-        self.temp_suffix = '_c'
         self._sp_max = 32
         self._sp_min = 9
         self._sp_inc = 0.5
 
-    drivers = [ { 'driver': 'CLIMD', 'value': 0, 'uom': '67' },
-                { 'driver': 'CLISPC', 'value': 0, 'uom': '4' },
-                { 'driver': 'CLISPH', 'value': 0, 'uom': '4' },
-                { 'driver': 'ST', 'value': 0, 'uom': '4' },
-                { 'driver': 'CLIFS', 'value': 0, 'uom': '68' },
-                { 'driver': 'CLIHUM', 'value': 0, 'uom': '22' },
-                { 'driver': 'CLIHCS', 'value': 0, 'uom': '66' },
-                { 'driver': 'SECMD', 'value': 0, 'uom': '84' },
-                { 'driver': 'GV1', 'value': 0, 'uom': '45' },
-                { 'driver': 'GV2', 'value': 0, 'uom': '45' },
-                { 'driver': 'GV0', 'value': 0, 'uom': '2' }]
+    temp_suffix = '_c'
+    temp_uom = '4'
+    temp_type = float
 
     commands = { 'CLIMD': Thermostat.setMode,
                  'CLIFS': Thermostat.setFan,
@@ -551,7 +716,7 @@ class ThermostatC(Thermostat):
     id = 'NEST_TST_C'
 
 
-class Protect(polyinterface.Node):
+class Protect(NestNode):
     def __init__(self, controller, primary, address, name, element_id, device):
         super().__init__(controller, primary, address, name)
         self.name = name
@@ -567,54 +732,41 @@ class Protect(polyinterface.Node):
         self.update()
         self.reportDrivers()
 
-    def update(self):
-        self.data = self.controller.data['devices']['smoke_co_alarms'][self.element_id]
-        self.setDriver('GV1', cosmost2num(self.data['smoke_alarm_state']))
-        self.setDriver('GV2', cosmost2num(self.data['co_alarm_state']))
-
-        if self.data['battery_health'] == 'ok':
-            self.setDriver('GV0', 13)
-        else:
-            self.setDriver('GV0', 11)
-
-        if self.data['ui_color_state'] == 'gray':
-            self.setDriver('ST', 1)
-        elif self.data['ui_color_state'] == 'green':
-            self.setDriver('ST', 2)
-        elif self.data['ui_color_state'] == 'yellow':
-            self.setDriver('ST', 3)
-        elif self.data['ui_color_state'] == 'red':
-            self.setDriver('ST', 4)
-        else:
+    def _update(self):
+        self.data = self.account.data['devices']['smoke_co_alarms'][self.element_id]
+        self._applySpec()
+        if self.data['ui_color_state'] not in UI_COLORS:
             LOGGER.error('{} unknown UI Color state!'.format(self.name))
+        self._updateTestAge()
 
-        if self.data['is_manual_test_active']:
-            self.setDriver('GV3', 1)
-        else:
-            self.setDriver('GV3', 0)
-
+    def _updateTestAge(self):
+        ''' GV4 is days since the last manual test, it next changes on the following anniversary of the test time '''
         if 'last_manual_test_time' in self.data:
             ts_mtest = zulu_2_ts(self.data['last_manual_test_time'])
             ts_now = datetime.datetime.utcnow()
             ts_delta = ts_now - ts_mtest
             self.setDriver('GV4', ts_delta.days)
+            self._setTimer('GV4', ts_2_epoch(ts_mtest + datetime.timedelta(days=ts_delta.days + 1)), self._updateTestAge)
         else:
             self.setDriver('GV4', -1)
+            self._setTimer('GV4', None)
 
-    drivers = [ { 'driver': 'ST', 'value': 0, 'uom': '25' },
-                { 'driver': 'GV0', 'value': 0, 'uom': '93' },
-                { 'driver': 'GV1', 'value': 0, 'uom': '25' },
-                { 'driver': 'GV2', 'value': 0, 'uom': '25' },
-                { 'driver': 'GV3', 'value': 0, 'uom': '2' },
-                { 'driver': 'GV4', 'value': 0, 'uom': '10' }
-              ]
+    driver_spec = ( Driver('ST', '25', 'ui_color_state', color2num),
+                    Driver('GV0', '93', 'battery_health', battery2num),
+                    Driver('GV1', '25', 'smoke_alarm_state', cosmost2num),
+                    Driver('GV2', '25', 'co_alarm_state', cosmost2num),
+                    Driver('GV3', '2', 'is_manual_test_active', int),
+                    Driver('GV4', '10') )
+    alarm_drivers = ('GV1', 'GV2')
 
     commands = { 'QUERY': query }
 
     id = 'NEST_SMK'
+    kind = 'smoke_co_alarms'
+    fields = NestNode.fields + ('last_manual_test_time',)
 
 
-class Camera(polyinterface.Node):
+class Camera(NestNode):
     def __init__(self, controller, primary, address, name, element_id, device):
         super().__init__(controller, primary, address, name)
         self.name = name
@@ -630,24 +782,24 @@ class Camera(polyinterface.Node):
         self.update()
         self.reportDrivers()
 
-    def update(self):
-        self.data = self.controller.data['devices']['cameras'][self.element_id]
-        if self.data['is_streaming']:
-            self.setDriver('ST', 1)
-        else:
-            self.setDriver('ST', 0)
-
-        if self.data['is_online']:
-            self.setDriver('GV0', 1)
-        else:
-            self.setDriver('GV0', 0)
+    def _update(self):
+        self.data = self.account.data['devices']['cameras'][self.element_id]
+        self._applySpec()
+        self._updateLastEvent()
 
+    def _updateLastEvent(self):
+        '''
+        GV4 (minutes since the last event) and the 2 minute event window change
+        with time, they are recomputed whenever the rounded minute moves on
+        '''
         if 'last_event' in self.data:
             ts_start = zulu_2_ts(self.data['last_event']['start_time'])
             ts_now = datetime.datetime.utcnow()
             ts_delta = ts_now - ts_start
             minutes = round(ts_delta.total_seconds()/60)
             self.setDriver('GV4', minutes)
+            next_minute = (math.floor(ts_delta.total_seconds()/60 + 0.5) + 0.5) * 60
+            self._setTimer('GV4', ts_2_epoch(ts_start) + next_minute, self._updateLastEvent)
 
             if 'end_time' in self.data['last_event']:
                 ts_end = zulu_2_ts(self.data['last_event']['end_time'])
@@ -663,6 +815,7 @@ class Camera(polyinterface.Node):
         else:
             self.setDriver('GV4', 0)
             self._clearEventDetails()
+            self._setTimer('GV4', None)
 
     def startStream(self, command):
         if self.data['is_streaming']:
@@ -670,7 +823,7 @@ class Camera(polyinterface.Node):
             return False
         nest_command = {'is_streaming': True}
         self.setDriver('ST', 1)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def stopStream(self, command):
         if not self.data['is_streaming']:
@@ -678,7 +831,7 @@ class Camera(polyinterface.Node):
             return False
         nest_command = {'is_streaming': False}
         self.setDriver('ST', 0)
-        self.controller.sendChange(self.set_url, nest_command)
+        self.sendCommand(nest_command)
 
     def _clearEventDetails(self):
         self.setDriver('GV1', 0)
@@ -699,16 +852,29 @@ class Camera(polyinterface.Node):
         else:
             self.setDriver('GV3', 0)
 
-    drivers = [ { 'driver': 'ST', 'value': 0, 'uom': '2' },
-                { 'driver': 'GV0', 'value': 0, 'uom': '2' },
-                { 'driver': 'GV1', 'value': 0, 'uom': '2' },
-                { 'driver': 'GV2', 'value': 0, 'uom': '2' },
-                { 'driver': 'GV3', 'value': 0, 'uom': '2' },
-                { 'driver': 'GV4', 'value': 0, 'uom': '45' }
-              ]
+    driver_spec = ( Driver('ST', '2', 'is_streaming', int),
+                    Driver('GV0', '2', 'is_online', int),
+                    Driver('GV1', '2'),
+                    Driver('GV2', '2'),
+                    Driver('GV3', '2'),
+                    Driver('GV4', '45') )
 
     commands = { 'QUERY': query,
                  'DON': startStream,
                  'DOF': stopStream }
 
     id = 'NEST_CAM'
+    kind = 'cameras'
+    fields = NestNode.fields + ('last_event.start_time', 'last_event.end_time', 'last_event.has_sound',
+                                'last_event.has_motion', 'last_event.has_person')
+
+
+NODE_TYPES = {node_type.id: node_type for node_type in (Structure, Thermostat, ThermostatC, Protect, Camera)}
+PROJECTION = projection.build(NODE_TYPES.values())
+
+
+def node_type_for(kind, element):
+    ''' Node class for a structure or device of the given kind, None if unsupported '''
+    if kind == 'thermostats':
+        return Thermostat if element['temperature_scale'] == 'F' else ThermostatC
+    return {Structure.kind: Structure, Protect.kind: Protect, Camera.kind: Camera}.get(kind)
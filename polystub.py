@@ -0,0 +1,219 @@
+'''
+Minimal in-process stand-in for polyinterface, used by the benchmarks,
+replay.py and offline runs. Nothing talks to Polyglot: every message that
+would be sent is kept in Interface.messages and every call into the
+interface in Interface.calls, both with a time.perf_counter() timestamp.
+
+Run the node server on it with
+
+    NEST_POLY_STUB=1 NEST_POLY_PARAMS='{"debug": "1"}' NEST_POLY_DATA=~/.nest_stub.json ./nest2.py
+
+NEST_POLY_PARAMS holds the customParams as JSON, customData is loaded from
+and saved to the NEST_POLY_DATA file when it is set.
+'''
+import os
+import json
+import time
+import logging
+from copy import deepcopy
+
+LOGGER = logging.getLogger('polystub')
+
+
+class Interface(object):
+    def __init__(self, name=None):
+        self.name = name
+        self.config = {'customParams': json.loads(os.environ.get('NEST_POLY_PARAMS', '{}')),
+                       'customData': {}, 'notices': {}, 'nodes': [], 'shortPoll': 10, 'longPoll': 30}
+        self.init = {'oauth': {}, 'worker': None}
+        self.messages = []
+        self.calls = []
+        self.data_file = os.environ.get('NEST_POLY_DATA')
+        if self.data_file:
+            self.data_file = os.path.expanduser(self.data_file)
+            if os.path.isfile(self.data_file):
+                with open(self.data_file) as f:
+                    self.config['customData'] = json.load(f)
+
+    def record(self, call, **details):
+        self.calls.append((time.perf_counter(), call, details))
+
+    def send(self, message):
+        self.messages.append((time.perf_counter(), message))
+
+    def start(self):
+        ''' Log to stderr at DEBUG like polyinterface does, the node server raises it to INFO without debug '''
+        self.record('start')
+        if not logging.getLogger().handlers and not LOGGER.handlers:
+            logging.basicConfig(format='%(asctime)s %(threadName)-12s %(levelname)-8s %(message)s')
+        if LOGGER.level == logging.NOTSET:
+            LOGGER.setLevel(logging.DEBUG)
+
+    def addNode(self, node):
+        self.record('addNode', address=node.address, name=node.name, node_def_id=node.id)
+        self.send({'addnode': {'address': node.address, 'name': node.name, 'node_def_id': node.id}})
+
+    def delNode(self, address):
+        self.record('delNode', address=address)
+        self.send({'removenode': {'address': address}})
+
+    def saveCustomData(self, data):
+        self.record('saveCustomData', data=deepcopy(data))
+        self.config['customData'] = deepcopy(data)
+        if self.data_file:
+            with open(self.data_file, 'w') as f:
+                json.dump(data, f)
+        self.send({'customdata': data})
+
+    def addNotice(self, data, key=None):
+        key = key or str(len(self.config['notices']))
+        self.record('addNotice', key=key, data=data)
+        self.config['notices'][key] = data
+        self.send({'addnotice': {'key': key, 'value': data}})
+
+    def removeNotice(self, key):
+        self.record('removeNotice', key=key)
+        self.config['notices'].pop(key, None)
+        self.send({'removenotice': {'key': key}})
+
+    def removeNoticesAll(self):
+        self.record('removeNoticesAll')
+        self.config['notices'] = {}
+        self.send({'removenoticesall': {}})
+
+    def restart(self):
+        self.record('restart')
+        self.send({'restart': {}})
+
+    def clear(self):
+        self.messages = []
+        self.calls = []
+
+
+class Node(object):
+    def __init__(self, controller, primary, address, name):
+        self.controller = controller
+        self.parent = controller
+        self.primary = primary
+        self.address = address
+        self.name = name
+        self.polyConfig = None
+        self.drivers = deepcopy(self.drivers)
+        self._drivers = deepcopy(self.drivers)
+
+    def setDriver(self, driver, value, report=True, force=False, uom=None):
+        self.controller.poly.record('setDriver', address=self.address, driver=driver, value=value, uom=uom)
+        for d in self.drivers:
+            if d['driver'] == driver:
+                d['value'] = value
+                if uom is not None:
+                    d['uom'] = uom
+                if report:
+                    self.reportDriver(d, report, force)
+                break
+
+    def reportDriver(self, driver, report, force):
+        for d in self._drivers:
+            if d['driver'] == driver['driver'] and (str(d['value']) != str(driver['value']) or d['uom'] != driver['uom'] or force):
+                d['value'] = deepcopy(driver['value'])
+                d['uom'] = driver['uom']
+                self.controller.poly.send({'status': {'address': self.address, 'driver': driver['driver'],
+                                                      'value': str(driver['value']), 'uom': driver['uom']}})
+                break
+
+    def reportCmd(self, command, value=None, uom=None):
+        self.controller.poly.record('reportCmd', address=self.address, command=command, value=value, uom=uom)
+        message = {'command': {'address': self.address, 'command': command}}
+        if value is not None and uom is not None:
+            message['command']['value'] = str(value)
+            message['command']['uom'] = uom
+        self.controller.poly.send(message)
+
+    def reportDrivers(self):
+        self._drivers = deepcopy(self.drivers)
+        for driver in self.drivers:
+            self.controller.poly.send({'status': {'address': self.address, 'driver': driver['driver'],
+                                                  'value': driver['value'], 'uom': driver['uom']}})
+
+    def query(self):
+        self.reportDrivers()
+
+    def runCmd(self, command):
+        self.controller.poly.record('runCmd', address=self.address, command=command)
+        if command['cmd'] in self.commands:
+            self.commands[command['cmd']](self, command)
+
+    def start(self):
+        pass
+
+    id = ''
+    commands = {}
+    drivers = []
+
+
+class Controller(Node):
+    def __init__(self, poly, name='Controller'):
+        self.controller = self
+        self.parent = self
+        self.poly = poly
+        self.name = name
+        self.address = 'controller'
+        self.primary = self.address
+        self.drivers = deepcopy(self.drivers)
+        self._drivers = deepcopy(self.drivers)
+        self.polyConfig = poly.config
+        self.nodes = {self.address: self}
+
+    def addNode(self, node, update=False):
+        ''' Polyglot confirms right away, so the node is started immediately '''
+        self.nodes[node.address] = node
+        self.poly.addNode(node)
+        node.start()
+        return node
+
+    def delNode(self, address):
+        self.nodes.pop(address, None)
+        self.poly.delNode(address)
+
+    def saveCustomData(self, data):
+        self.poly.saveCustomData(data)
+
+    def addNotice(self, data, key=None):
+        self.poly.addNotice(data, key)
+
+    def removeNotice(self, key):
+        self.poly.removeNotice(key)
+
+    def removeNoticesAll(self):
+        self.poly.removeNoticesAll()
+
+    def runForever(self):
+        ''' start(), then shortPoll/longPoll on the configured intervals until interrupted '''
+        self.start()
+        next_short = time.time() + self.polyConfig['shortPoll']
+        next_long = time.time() + self.polyConfig['longPoll']
+        try:
+            while True:
+                time.sleep(max(0, min(next_short, next_long) - time.time()))
+                now = time.time()
+                if now >= next_short:
+                    next_short = now + self.polyConfig['shortPoll']
+                    self.shortPoll()
+                if now >= next_long:
+                    next_long = now + self.polyConfig['longPoll']
+                    self.longPoll()
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+
+    def shortPoll(self):
+        pass
+
+    def longPoll(self):
+        pass
+
+    def stop(self):
+        pass
+
+    id = 'controller'
+    drivers = [{'driver': 'ST', 'value': 0, 'uom': 2}]
@@ -0,0 +1,148 @@
+''' Reduce Nest API snapshots to the fields the node types read '''
+
+
+def build(node_types):
+    '''
+    Merge the fields declared by every node type into {kind: {field: subfields}},
+    a dotted name like 'last_event.start_time' keeps only part of a nested object
+    '''
+    projection = {}
+    for node_type in node_types:
+        spec = projection.setdefault(node_type.kind, {})
+        for field in node_type.fields:
+            key, _, subfield = field.partition('.')
+            if subfield:
+                if spec.get(key, ()) is not None:
+                    spec.setdefault(key, set()).add(subfield)
+            else:
+                spec[key] = None
+    return projection
+
+
+def project_element(element, spec):
+    record = {key: element[key] for key in spec if key in element}
+    for key, subfields in spec.items():
+        if subfields is not None and isinstance(record.get(key), dict):
+            value = record[key]
+            record[key] = {subkey: value[subkey] for subkey in subfields if subkey in value}
+    return record
+
+
+def project(data, projection):
+    '''
+    Compact copy of a snapshot with only the structures and devices we have node
+    types for, and only the fields they read. Projecting twice is harmless.
+    '''
+    if not data:
+        return data
+    structure_spec = projection.get('structures', {})
+    result = {'structures': {struct_id: project_element(struct, structure_spec)
+                             for struct_id, struct in data.get('structures', {}).items()},
+              'devices': {}}
+    for kind, devices in data.get('devices', {}).items():
+        spec = projection.get(kind)
+        if spec is None:
+            continue
+        result['devices'][kind] = {dev_id: project_element(device, spec) for dev_id, device in devices.items()}
+    return result
+
+
+''' REST Streaming subscription paths, the root carries the whole account '''
+ROOT_SCOPE = '/'
+SCOPE_KINDS = ('structures', 'devices')
+
+
+def split_path(path):
+    return [key for key in path.split('/') if key]
+
+
+def _element_depth(keys):
+    ''' Number of path keys down to a single structure or device '''
+    return 2 if keys[0] == 'structures' else 3
+
+
+def parse_scopes(value):
+    '''
+    Comma separated subscription paths like "/structures, /devices/thermostats",
+    anything outside structures and devices or below a single element is
+    rejected. Returns a tuple of normalized paths, the root scope when empty.
+    '''
+    scopes = []
+    for scope in str(value or '').split(','):
+        scope = scope.strip()
+        if not scope:
+            continue
+        keys = split_path(scope)
+        if not keys:
+            return (ROOT_SCOPE,)
+        if keys[0] not in SCOPE_KINDS or len(keys) > _element_depth(keys):
+            raise ValueError('unsupported stream scope {}'.format(scope))
+        path = '/' + '/'.join(keys)
+        if path not in scopes:
+            scopes.append(path)
+    return tuple(scopes) or (ROOT_SCOPE,)
+
+
+def resolve(scope, path):
+    ''' Absolute path of a put received on the stream for scope, Nest may send it relative to the scope '''
+    if scope == ROOT_SCOPE or path == scope or path.startswith(scope + '/'):
+        return path
+    return scope.rstrip('/') + '/' + path.lstrip('/') if path.strip('/') else scope
+
+
+def get_path(data, path):
+    for key in split_path(path):
+        if not isinstance(data, dict) or key not in data:
+            return None
+        data = data[key]
+    return data
+
+
+def _put(tree, keys, value):
+    ''' Copy of tree with value at keys, only the dicts along the path are copied '''
+    tree = dict(tree) if tree else {}
+    if len(keys) > 1:
+        tree[keys[0]] = _put(tree.get(keys[0]), keys[1:], value)
+    elif value is None:
+        tree.pop(keys[0], None)
+    else:
+        tree[keys[0]] = value
+    return tree
+
+
+def merge(data, path, value, projection):
+    '''
+    Snapshot with the put received for path applied to it, projected the same
+    way as a full snapshot. Everything outside path is shared with data, so
+    unchanged structures and devices keep their identity.
+    '''
+    keys = split_path(path)
+    if not keys:
+        return project(value, projection)
+    if keys[0] not in SCOPE_KINDS:
+        return data
+    depth = _element_depth(keys)
+    if len(keys) > depth:
+        ''' A change below a single element, apply it to a copy of the element '''
+        element = _put(get_path(data, '/'.join(keys[:depth])), keys[depth:], value)
+        keys, value = keys[:depth], element
+    if value is not None:
+        wrapped = value
+        for key in reversed(keys):
+            wrapped = {key: wrapped}
+        value = get_path(project(wrapped, projection), '/'.join(keys))
+    base = data if data else {'structures': {}, 'devices': {}}
+    if value is None and len(keys) < depth:
+        ''' structures, devices and device kinds stay as empty containers '''
+        value = {}
+    return _put(base, keys, value)
+
+
+def restrict(data, scopes, projection):
+    ''' Project a full snapshot down to the subscription scopes '''
+    if ROOT_SCOPE in scopes:
+        return project(data, projection)
+    result = {'structures': {}, 'devices': {}}
+    for scope in scopes:
+        result = merge(result, scope, get_path(data, scope), projection)
+    return result
@@ -0,0 +1,118 @@
+''' Append-only, rotating gzip log of raw REST Streaming events for later replay '''
+import os
+import gzip
+import json
+import time
+from pathlib import Path
+from threading import Lock
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+MAX_BYTES = 10 * 1024 * 1024
+BACKUPS = 5
+''' Compressed data is flushed to disk at most this often '''
+FLUSH_INTERVAL = 5
+
+
+class SessionRecorder(object):
+    '''
+    Every event is one JSON line {"t": epoch, "event": type, "data": raw data},
+    events of a stream scoped to a path also carry it as "scope", events of
+an account other than the primary one its name as "account".
+    The file is only ever appended to and flushed every FLUSH_INTERVAL seconds,
+    a file cut short by a crash is readable up to the last flush. When the file
+    grows past max_bytes it is rotated to path.1 .. path.<backups>, the oldest
+    one is dropped.
+    '''
+    def __init__(self, path, max_bytes=MAX_BYTES, backups=BACKUPS):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.events = 0
+        self.failed = False
+        self._file = None
+        self._flushed = 0
+        self._lock = Lock()
+
+    def record(self, event_type, event_data, scope=None, account=None):
+        record = {'t': time.time(), 'event': event_type, 'data': event_data}
+        if scope not in (None, '/'):
+            record['scope'] = scope
+        if account is not None:
+            record['account'] = account
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self.failed:
+                return
+            try:
+                if self._file is None:
+                    self._open()
+                self._file.write(line.encode('utf-8'))
+                self.events += 1
+                if time.time() - self._flushed >= FLUSH_INTERVAL:
+                    self._file.flush()
+                    self._flushed = time.time()
+                    if self.path.stat().st_size >= self.max_bytes:
+                        self._rotate()
+            except OSError as e:
+                LOGGER.error('Stream recording to {} failed, recording stopped: {}'.format(self.path, e))
+                self.failed = True
+                self._close()
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _open(self):
+        os.makedirs(str(self.path.parent), exist_ok=True)
+        self._file = gzip.open(str(self.path), 'ab')
+        self._flushed = time.time()
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _rotate(self):
+        self._close()
+        for index in range(self.backups - 1, 0, -1):
+            source = Path('{}.{}'.format(self.path, index))
+            if source.exists():
+                os.replace(str(source), '{}.{}'.format(self.path, index + 1))
+        if self.backups > 0:
+            os.replace(str(self.path), '{}.1'.format(self.path))
+        else:
+            self.path.unlink()
+        LOGGER.info('Rotated stream recording {}'.format(self.path))
+
+
+def session_files(path):
+    ''' The log and its rotated backups, oldest first '''
+    path = Path(path)
+    backups = []
+    index = 1
+    while Path('{}.{}'.format(path, index)).exists():
+        backups.append(Path('{}.{}'.format(path, index)))
+        index += 1
+    files = list(reversed(backups))
+    if path.exists():
+        files.append(path)
+    return files
+
+
+def read_session(path):
+    ''' Yield (timestamp, event_type, event_data, scope, account) from a recording and its backups in order '''
+    for session_file in session_files(path):
+        with gzip.open(str(session_file), 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    yield record['t'], record['event'], record['data'], record.get('scope', '/'), record.get('account')
+            except (EOFError, OSError) as e:
+                LOGGER.warning('{} is truncated, replaying what was readable: {}'.format(session_file, e))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+'''
+Play a REST Streaming recording (record_stream customParam) back through
+the controller without a network or Polyglot, on top of polystub.
+
+Events go through Account.processEvent, the same parsing, diff and
+dispatch path as the live stream, with the recorded pacing scaled by
+--speed (1, 10, ... or 0 for as fast as possible). Nodes are discovered
+from the first put like a fresh start. Events of additional accounts go
+to an account of the same name, created when its first event shows up.
+
+    ./replay.py ~/nest_stream.jsonl.gz --speed 10
+    ./replay.py ~/nest_stream.jsonl.gz --speed 0 --profile 25
+'''
+import os
+import sys
+import json
+import time
+import pstats
+import argparse
+import cProfile
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import polystub
+sys.modules['polyinterface'] = polystub
+
+import nest2
+from account import Account
+from dispatch import NodeDispatcher
+from recorder import read_session
+
+
+def replay_account(controller, name):
+    ''' The account events recorded for name are played to, set up like the primary one below '''
+    for account in controller.accounts:
+        if account.name == name:
+            return account
+    account = Account(controller, name)
+    account.auth_token = 'c.replay'
+    account.discovery_pending = True
+    controller.accounts.append(account)
+    return account
+
+
+def replay(path, speed=0, limit=None, inline=False):
+    ''' inline runs node updates on the calling thread so a profiler sees them '''
+    poly = polystub.Interface('Nest2')
+    controller = nest2.Controller(poly)
+    controller.account.auth_token = 'c.replay'
+    controller.account.discovery_pending = True
+    if inline:
+        controller.dispatcher = NodeDispatcher(controller._runUpdate, workers=0)
+    controller.dispatcher.start()
+    events = Counter()
+    first = None
+    start = time.perf_counter()
+    for recorded, event_type, event_data, scope, name in read_session(path):
+        if first is None:
+            first = recorded
+        if speed > 0:
+            delay = (recorded - first) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        replay_account(controller, name).processEvent(event_type, event_data, scope)
+        events[event_type] += 1
+        if limit is not None and sum(events.values()) >= limit:
+            break
+    controller.dispatcher.join()
+    wall = time.perf_counter() - start
+    controller.dispatcher.stop()
+    messages = Counter(next(iter(message)) for _, message in poly.messages)
+    return {
+        'recording': str(path),
+        'accounts': len(controller.accounts),
+        'speed': speed,
+        'events': dict(events),
+        'wall_s': wall,
+        'events_per_sec': sum(events.values()) / wall if wall else None,
+        'nodes': len(controller.nodes) - 1,
+        'node_updates': controller.update_stats,
+        'dispatcher': controller.dispatcher.stats,
+        'polyglot_messages': dict(messages),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('recording', help='recorded stream, rotated backups next to it are replayed first')
+    parser.add_argument('--speed', type=float, default=1, help='playback speed, 0 is as fast as possible')
+    parser.add_argument('--limit', type=int, help='stop after this many events')
+    parser.add_argument('--profile', type=int, metavar='N', help='profile the replay and print the top N functions')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--output', help='write JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+
+    polystub.LOGGER.setLevel('DEBUG' if args.verbose else 'WARNING')
+    if args.profile:
+        profiler = cProfile.Profile()
+        result = profiler.runcall(replay, args.recording, args.speed, args.limit, inline=True)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(args.profile)
+    else:
+        result = replay(args.recording, args.speed, args.limit)
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        sys.stdout.write(output + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
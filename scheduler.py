@@ -0,0 +1,98 @@
+''' Single thread timer heap for drivers that change with time rather than with Nest data '''
+import time
+import heapq
+import itertools
+from threading import Thread, Condition
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+
+class Scheduler(object):
+    '''
+    Runs callbacks at absolute times (seconds since the epoch). Every timer
+    has a key, scheduling a key again replaces its previous timer, so each
+    node keeps at most one pending timer per driver. Replaced timers stay in
+    the heap until they surface or the heap is compacted, schedule and cancel
+    are O(log n) regardless of how many nodes have timers.
+    '''
+    def __init__(self, name='NestScheduler'):
+        self.name = name
+        self.stats = {'scheduled': 0, 'fired': 0}
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._cond = Condition()
+        self._thread = None
+        self._stopping = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def schedule(self, key, when, callback):
+        with self._cond:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] == when:
+                    entry[3] = callback
+                    return
+                entry[2] = None
+            entry = [when, next(self._counter), key, callback]
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+            self.stats['scheduled'] += 1
+            self._compact()
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def cancel(self, key):
+        with self._cond:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                entry[2] = None
+
+    def due(self, key):
+        entry = self._entries.get(key)
+        return None if entry is None else entry[0]
+
+    def _compact(self):
+        if len(self._heap) > 2 * len(self._entries) + 64:
+            self._heap = [entry for entry in self._heap if entry[2] is not None]
+            heapq.heapify(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopping:
+                    while self._heap and self._heap[0][2] is None:
+                        heapq.heappop(self._heap)
+                    if self._heap and self._heap[0][0] <= time.time():
+                        break
+                    self._cond.wait(self._heap[0][0] - time.time() if self._heap else None)
+                if self._stopping:
+                    return
+                _, _, key, callback = heapq.heappop(self._heap)
+                del self._entries[key]
+            self.stats['fired'] += 1
+            try:
+                callback()
+            except Exception as e:
+                LOGGER.error('{}: timer {} failed: {}'.format(self.name, key, e))
@@ -0,0 +1,58 @@
+''' On-disk copy of the last known Nest state, used to warm start the node server '''
+import os
+import gzip
+import json
+import time
+from pathlib import Path
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+LOGGER = polyinterface.LOGGER
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_FILE = Path(str(Path.home()) + '/.nest_poly_state.json.gz')
+''' Minimum seconds between saves while the state keeps changing '''
+SNAPSHOT_INTERVAL = 300
+
+
+def save(data, nodes, path=None):
+    '''
+    nodes maps node address to {'id', 'name', 'element_id', 'set_url'}, the file
+    is replaced atomically so a crash never leaves a truncated snapshot behind
+    '''
+    path = path or SNAPSHOT_FILE
+    snapshot = {'version': SNAPSHOT_VERSION, 'saved': int(time.time()), 'data': data, 'nodes': nodes}
+    tmp_path = Path(str(path) + '.tmp')
+    try:
+        with gzip.open(str(tmp_path), 'wt', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(str(tmp_path), str(path))
+    except (OSError, TypeError, ValueError) as e:
+        LOGGER.error('Failed to save state snapshot {}: {}'.format(path, e))
+        return False
+    return True
+
+
+def load(path=None):
+    ''' Returns the snapshot dict or None '''
+    path = path or SNAPSHOT_FILE
+    if not path.is_file():
+        return None
+    try:
+        with gzip.open(str(path), 'rt', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError, EOFError) as e:
+        LOGGER.error('Failed to read state snapshot {}: {}'.format(path, e))
+        return None
+    if snapshot.get('version') != SNAPSHOT_VERSION or not snapshot.get('data'):
+        LOGGER.info('Ignoring incompatible state snapshot {}'.format(path))
+        return None
+    return snapshot
+
+
+def remove(path=None):
+    path = path or SNAPSHOT_FILE
+    if path.is_file():
+        path.unlink()
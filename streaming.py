@@ -0,0 +1,128 @@
+''' Supervised Nest REST Streaming connection '''
+import time
+import random
+from threading import Thread, Event
+import urllib3
+import sseclient
+import certifi
+try:
+    import polyinterface
+except ImportError:
+    import pgc_interface as polyinterface
+
+import metrics
+
+LOGGER = polyinterface.LOGGER
+
+''' Nest sends a keep-alive every 30 seconds, silence for longer than this is a stall '''
+STALL_TIMEOUT = 90
+CONNECT_TIMEOUT = 30
+BACKOFF_MIN = 1
+BACKOFF_MAX = 300
+''' A connection that stayed up this long resets the backoff '''
+HEALTHY_SESSION = 60
+
+
+class StreamWorker(object):
+    '''
+    Keeps one REST Streaming connection open in a background thread and
+    hands every event to on_event(event_type, data). A stalled or dropped
+    stream is torn down and reopened in process with jittered exponential
+    backoff, the first put after a reconnect carries the full state again.
+    on_event returns False to drop the connection, the worker stops for good
+    once token() returns None.
+    '''
+    def __init__(self, url, token, on_event, name='NestStream'):
+        self.url = url
+        self.token = token
+        self.on_event = on_event
+        self.name = name
+        self.connected = False
+        self.last_event = time.time()
+        self._thread = None
+        self._response = None
+        self._stop = Event()
+        self._failures = 0
+
+    def start(self):
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def stop(self):
+        self._stop.set()
+        self.reconnect()
+
+    def reconnect(self):
+        ''' Drop the current connection, the worker opens a new one '''
+        response = self._response
+        if response is None:
+            return
+        try:
+            if hasattr(response, 'shutdown'):
+                response.shutdown()
+            response.close()
+        except Exception as e:
+            LOGGER.debug('{}: error closing the stream: {}'.format(self.name, e))
+
+    def _backoff(self):
+        delay = min(BACKOFF_MAX, BACKOFF_MIN * 2 ** self._failures)
+        return random.uniform(delay / 2, delay)
+
+    def _run(self):
+        while not self._stop.is_set():
+            token = self.token()
+            if token is None:
+                LOGGER.warning('{}: no auth token, streaming stopped'.format(self.name))
+                return
+            if self._stream(token):
+                self._failures = 0
+            else:
+                self._failures += 1
+            if self._stop.is_set() or self.token() is None:
+                continue
+            delay = self._backoff()
+            LOGGER.info('{}: reconnecting in {:.1f}s'.format(self.name, delay))
+            if self._stop.wait(delay):
+                return
+            metrics.RECONNECTS.inc()
+
+    def _stream(self, token):
+        ''' Returns True if the connection was healthy for a while before it ended '''
+        headers = {
+            'Authorization': "Bearer {0}".format(token),
+            'Accept': 'text/event-stream'
+        }
+        retries = urllib3.util.retry.Retry(remove_headers_on_redirect=[])
+        timeout = urllib3.util.Timeout(connect=CONNECT_TIMEOUT, read=STALL_TIMEOUT)
+        http = urllib3.PoolManager(cert_reqs='CERT_REQUIRED', ca_certs=certifi.where())
+        opened = time.time()
+        try:
+            self._response = http.request('GET', self.url, headers=headers, preload_content=False,
+                                          retries=retries, timeout=timeout)
+            if self._response.status != 200:
+                LOGGER.error('{}: REST Streaming request returned {}'.format(self.name, self._response.status))
+                return False
+            self.connected = True
+            client = sseclient.SSEClient(self._response)
+            for event in client.events():
+                self.last_event = time.time()
+                if not self.on_event(event.event, event.data):
+                    break
+            else:
+                LOGGER.warning('{}: stream closed by the server'.format(self.name))
+        except urllib3.exceptions.ReadTimeoutError:
+            LOGGER.warning('{}: no events for {}s, stream stalled'.format(self.name, STALL_TIMEOUT))
+        except Exception as e:
+            if not self._stop.is_set():
+                LOGGER.error('{}: REST Streaming failed: {}'.format(self.name, e))
+        finally:
+            self.connected = False
+            if self._response is not None:
+                self._response.release_conn()
+                self._response = None
+            http.clear()
+        return time.time() - opened >= HEALTHY_SESSION
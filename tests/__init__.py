@@ -0,0 +1,19 @@
+'''
+Tests run the real Controller and node types on polystub against a
+nest_sim stand-in for the Nest API, nothing talks to Polyglot or Nest.
+
+    python -m unittest discover -s tests -t .
+'''
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import polystub
+sys.modules['polyinterface'] = polystub
+
+SIM_PORT = 18790
+os.environ['NEST_API_URL'] = 'http://127.0.0.1:{}'.format(SIM_PORT)
+os.environ['NEST_AUTH_URL'] = os.environ['NEST_API_URL']
+''' Snapshots and the token cache go to a scratch home, not the real one '''
+os.environ['HOME'] = tempfile.mkdtemp(prefix='nest2-tests-')
@@ -0,0 +1,41 @@
+''' A synthetic home served by nest_sim and a discovered controller for it '''
+import json
+
+import polystub
+import nest_sim
+import nest2
+from tests import SIM_PORT
+
+_sim = None
+
+
+def sim():
+    ''' One stand-in per test run, every test gets a fresh home '''
+    global _sim
+    if _sim is None:
+        polystub.LOGGER.setLevel('WARNING')
+        _sim = nest_sim.NestSim({}, keepalive=30)
+        nest_sim.serve(_sim, '127.0.0.1', SIM_PORT)
+    return _sim
+
+
+def make_controller(**home):
+    server = sim()
+    server.data = nest_sim.make_home(**home)
+    poly = polystub.Interface('Nest2')
+    controller = nest2.Controller(poly)
+    controller.polyConfig['customData'] = {'access_token': 'c.sim'}
+    controller._getToken()
+    controller.dispatcher.start()
+    return poly, controller
+
+
+def stop(controller):
+    controller.dispatcher.stop()
+    controller.scheduler.stop()
+    for account in controller.accounts:
+        account.stop()
+
+
+def put_event(data, path='/'):
+    return json.dumps({'path': path, 'data': data})
@@ -0,0 +1,73 @@
+import time
+import unittest
+from copy import deepcopy
+from threading import Thread, Event
+
+from tests import home
+
+
+class AlarmPublishTest(unittest.TestCase):
+    def setUp(self):
+        self.poly, self.controller = home.make_controller(structures=1, thermostats=0, protects=1, cameras=0)
+        self.data = deepcopy(home.sim().data)
+        self.protect_id = next(iter(self.data['devices']['smoke_co_alarms']))
+        self.controller.discover()
+        self.put(self.data)
+        self.node = self.controller.account.element_index['smoke_co_alarms'][self.protect_id]
+
+    def tearDown(self):
+        home.stop(self.controller)
+
+    def put(self, data):
+        self.controller.account.processEvent('put', home.put_event(data))
+        self.controller.dispatcher.join(5)
+
+    def smoke(self):
+        return [details['value'] for ts, call, details in self.poly.calls
+                if call == 'setDriver' and details['address'] == self.node.address and details['driver'] == 'GV1']
+
+    def test_alarm_does_not_wait_for_a_slow_update(self):
+        ''' A dispatcher worker is in update() of the Protect when the smoke alarm goes off '''
+        started = Event()
+        release = Event()
+        update = self.node._update
+
+        def slow_update():
+            update()
+            started.set()
+            release.wait(5)
+        self.node._update = slow_update
+        worker = Thread(target=self.node.update)
+        worker.start()
+        self.assertTrue(started.wait(5))
+        ok = self.smoke()[-1]
+
+        alarm = deepcopy(self.data)
+        alarm['devices']['smoke_co_alarms'][self.protect_id]['smoke_alarm_state'] = 'emergency'
+        self.controller.account.data['devices']['smoke_co_alarms'][self.protect_id] = \
+            alarm['devices']['smoke_co_alarms'][self.protect_id]
+        begin = time.perf_counter()
+        self.node.updateAlarms()
+        self.assertLess(time.perf_counter() - begin, 1)
+        emergency = self.smoke()[-1]
+        self.assertNotEqual(emergency, ok)
+
+        ''' The slow update finishes with the data it read before the alarm, it must not publish ok again '''
+        count = len(self.smoke())
+        release.set()
+        worker.join(5)
+        self.assertEqual(self.smoke()[count:], [])
+        self.assertIsNone(self.node._alarms)
+
+    def test_alarm_without_a_running_update(self):
+        alarm = deepcopy(self.data)
+        alarm['devices']['smoke_co_alarms'][self.protect_id]['co_alarm_state'] = 'warning'
+        self.put(alarm)
+        co = [details['value'] for ts, call, details in self.poly.calls
+              if call == 'setDriver' and details['address'] == self.node.address and details['driver'] == 'GV2']
+        self.assertEqual(len(co), 2)
+        self.assertIsNone(self.node._alarms)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import time
+import unittest
+
+import command_queue
+from command_queue import CommandQueue, TokenBucket
+
+
+class Recorder(object):
+    ''' sendChange stand-in, keeps every PUT '''
+    def __init__(self, result=True):
+        self.result = result
+        self.sent = []
+
+    def __call__(self, url, payload):
+        self.sent.append((url, dict(payload)))
+        return self.result
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=1 / 30, burst=5)
+        now = bucket.timestamp
+        for _ in range(5):
+            self.assertEqual(bucket.delay(now), 0)
+            bucket.consume(now)
+        self.assertAlmostEqual(bucket.delay(now), 30)
+        self.assertAlmostEqual(bucket.delay(now + 15), 15)
+        self.assertEqual(bucket.delay(now + 30), 0)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=1, burst=2)
+        now = bucket.timestamp + 3600
+        bucket.consume(now)
+        bucket.consume(now)
+        self.assertAlmostEqual(bucket.delay(now), 1)
+
+
+class CommandQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.send = Recorder()
+        self.queue = CommandQueue(self.send)
+
+    def tearDown(self):
+        self.queue.stop()
+
+    def test_same_fields_merge_into_one_put(self):
+        first = self.queue.put('/devices/thermostats/t1', {'target_temperature_f': 69})
+        second = self.queue.put('/devices/thermostats/t1', {'target_temperature_f': 70})
+        self.assertIs(first, second)
+        self.assertEqual(len(self.queue), 1)
+        self.assertEqual(self.queue.stats['merged'], 1)
+        self.queue.start()
+        ''' Both callers get the result of the one PUT '''
+        self.assertTrue(first.result(timeout=5))
+        self.assertTrue(second.result(timeout=5))
+        self.assertEqual(self.send.sent, [('/devices/thermostats/t1', {'target_temperature_f': 70})])
+
+    def test_burst_after_a_put_is_collected(self):
+        ''' The first change goes out right away, the rest of the burst within COALESCE_WINDOW as one PUT '''
+        self.queue.start()
+        started = time.monotonic()
+        self.queue.put('/devices/thermostats/t1', {'target_temperature_f': 69}).result(timeout=5)
+        self.assertLess(time.monotonic() - started, command_queue.COALESCE_WINDOW)
+        self.queue.put('/devices/thermostats/t1', {'target_temperature_f': 70})
+        last = self.queue.put('/devices/thermostats/t1', {'target_temperature_f': 71})
+        self.assertTrue(last.result(timeout=5))
+        self.assertGreaterEqual(time.monotonic() - started, command_queue.COALESCE_WINDOW)
+        self.assertEqual([payload for url, payload in self.send.sent],
+                         [{'target_temperature_f': 69}, {'target_temperature_f': 71}])
+
+    def test_different_fields_are_not_merged(self):
+        ''' A mode change and a setpoint go out as separate PUTs, in order '''
+        mode = self.queue.put('/devices/thermostats/t1', {'hvac_mode': 'cool'})
+        setpoint = self.queue.put('/devices/thermostats/t1', {'target_temperature_f': 74})
+        self.assertIsNot(mode, setpoint)
+        self.assertEqual(self.queue.stats['merged'], 0)
+        self.queue.start()
+        self.assertTrue(setpoint.result(timeout=5))
+        self.assertEqual([payload for url, payload in self.send.sent],
+                         [{'hvac_mode': 'cool'}, {'target_temperature_f': 74}])
+
+    def test_device_rate_limit(self):
+        for index in range(command_queue.DEVICE_BURST + 1):
+            self.queue.put('/devices/thermostats/t1', {'field_{}'.format(index): index})
+        for _ in range(command_queue.DEVICE_BURST):
+            command, wait = self.queue._next()
+            self.assertIsNotNone(command)
+        command, wait = self.queue._next()
+        self.assertIsNone(command)
+        self.assertGreater(wait, 1 / command_queue.DEVICE_RATE - 1)
+        ''' Another device is not held back '''
+        self.queue.put('/devices/thermostats/t2', {'hvac_mode': 'heat'})
+        command, wait = self.queue._next()
+        self.assertEqual(command.url, '/devices/thermostats/t2')
+
+    def test_global_budget(self):
+        for index in range(command_queue.GLOBAL_BURST + 1):
+            self.queue.put('/devices/thermostats/t{}'.format(index), {'hvac_mode': 'heat'})
+        sent = [self.queue._next()[0] for _ in range(command_queue.GLOBAL_BURST)]
+        self.assertNotIn(None, sent)
+        command, wait = self.queue._next()
+        self.assertIsNone(command)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1 / command_queue.GLOBAL_RATE)
+
+    def test_full_queue_drops(self):
+        queue = CommandQueue(self.send, maxsize=2)
+        queue.put('/devices/thermostats/t1', {'hvac_mode': 'heat'})
+        queue.put('/devices/thermostats/t2', {'hvac_mode': 'heat'})
+        dropped = queue.put('/devices/thermostats/t3', {'hvac_mode': 'heat'})
+        self.assertTrue(dropped.done())
+        self.assertFalse(dropped.result())
+        self.assertEqual(queue.stats['dropped'], 1)
+        self.assertEqual(len(queue), 2)
+        ''' A change merged into a waiting command is not dropped '''
+        merged = queue.put('/devices/thermostats/t1', {'hvac_mode': 'cool'})
+        self.assertFalse(merged.done())
+        queue.stop()
+
+    def test_stop_fails_waiting_commands(self):
+        future = self.queue.put('/devices/thermostats/t1', {'hvac_mode': 'heat'})
+        self.queue.stop()
+        self.assertFalse(future.result(timeout=1))
+
+
+if __name__ == '__main__':
+    unittest.main()
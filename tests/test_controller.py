@@ -0,0 +1,79 @@
+import json
+import unittest
+from pathlib import Path
+
+from tests import home
+from account import Account
+
+
+class DiscoverCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.poly, self.controller = home.make_controller(thermostats=2, protects=1, cameras=1)
+
+    def tearDown(self):
+        home.stop(self.controller)
+
+    def test_discover_from_admin_console(self):
+        ''' The Discover button arrives as a DISCOVER command for the controller '''
+        self.controller.runCmd({'cmd': 'DISCOVER', 'address': 'nestctrl'})
+        added = [details['address'] for ts, call, details in self.poly.calls if call == 'addNode']
+        ''' One structure, two thermostats, a Protect and a camera '''
+        self.assertEqual(len(added), 5)
+        self.assertEqual(set(added), {address for address, node in self.controller.nodes.items() if node is not self.controller})
+
+
+class DeleteTest(unittest.TestCase):
+    def setUp(self):
+        self.poly, self.controller = home.make_controller(thermostats=1, protects=0, cameras=0)
+        self.extra = Account(self.controller, 'lake')
+        self.extra.auth_token = 'c.lake'
+        self.controller.accounts.append(self.extra)
+        del home.sim().revoked[:]
+
+    def tearDown(self):
+        home.stop(self.controller)
+
+    def test_delete_revokes_every_account(self):
+        self.assertTrue(self.controller.delete())
+        self.assertEqual(home.sim().revoked, ['c.sim', 'c.lake'])
+        self.assertEqual([account.auth_token for account in self.controller.accounts], [None, None])
+
+
+class CachedTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.poly, self.controller = home.make_controller(thermostats=1, protects=0, cameras=0)
+        self.cache_file = Path(str(Path.home()) + '/.nest_poly')
+        with self.cache_file.open('w') as f:
+            json.dump({'access_token': 'c.cached', 'expires': '2099-01-01T00:00:00'}, f)
+
+    def tearDown(self):
+        self.cache_file.unlink()
+        home.stop(self.controller)
+
+    def test_cached_token_keeps_account_tokens(self):
+        ''' Tokens of other accounts come from single use PINs, saving the cached token must not drop them '''
+        accounts = {'lake': {'pin': '1234', 'access_token': 'c.lake'}}
+        self.controller.polyConfig['customData'] = {'accounts': accounts}
+        self.assertTrue(self.controller._getToken())
+        self.assertEqual(self.controller.account.auth_token, 'c.cached')
+        saved = [details['data'] for ts, call, details in self.poly.calls if call == 'saveCustomData'][-1]
+        self.assertEqual(saved['accounts'], accounts)
+        self.assertEqual(saved['access_token'], 'c.cached')
+        self.assertEqual(self.controller.polyConfig['customData'], saved)
+
+
+class SendChangeTest(unittest.TestCase):
+    def setUp(self):
+        self.poly, self.controller = home.make_controller(thermostats=1, protects=0, cameras=0)
+
+    def tearDown(self):
+        home.stop(self.controller)
+
+    def test_nothing_to_send_returns_false(self):
+        self.assertIs(self.controller.account.sendChange('/devices/thermostats/t1', {}), False)
+        self.controller.account.auth_token = None
+        self.assertIs(self.controller.account.sendChange('/devices/thermostats/t1', {'hvac_mode': 'heat'}), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import random
+import datetime
+import unittest
+
+from converters import zulu_2_ts
+
+
+def strptime_zulu_2_ts(zulu_ts):
+    ''' The strptime implementation zulu_2_ts replaced '''
+    assert zulu_ts[-1] == 'Z'
+    zulu_ts = zulu_ts[:-1] + '000'
+    return datetime.datetime.strptime(zulu_ts, '%Y-%m-%dT%H:%M:%S.%f')
+
+
+def random_zulu(rnd, digits):
+    ts = datetime.datetime(2015, 1, 1) + datetime.timedelta(seconds=rnd.randint(0, 10 * 365 * 86400))
+    fraction = ''.join(str(rnd.randint(0, 9)) for _ in range(digits))
+    return ts.strftime('%Y-%m-%dT%H:%M:%S') + '.' + fraction + 'Z'
+
+
+class ZuluTest(unittest.TestCase):
+    def test_matches_strptime(self):
+        ''' 0 to 3 fractional digits, as Nest sends them '''
+        rnd = random.Random(1)
+        for digits in range(4):
+            for _ in range(500):
+                zulu_ts = random_zulu(rnd, digits)
+                self.assertEqual(zulu_2_ts(zulu_ts), strptime_zulu_2_ts(zulu_ts), zulu_ts)
+
+    def test_fractional_seconds(self):
+        self.assertEqual(zulu_2_ts('2018-02-28T17:43:07.123Z'), datetime.datetime(2018, 2, 28, 17, 43, 7, 123000))
+        self.assertEqual(zulu_2_ts('2018-02-28T17:43:07.5Z'), datetime.datetime(2018, 2, 28, 17, 43, 7, 500000))
+        self.assertEqual(zulu_2_ts('2018-02-28T17:43:07.05Z'), datetime.datetime(2018, 2, 28, 17, 43, 7, 50000))
+        self.assertEqual(zulu_2_ts('2016-02-29T23:59:59.000Z'), datetime.datetime(2016, 2, 29, 23, 59, 59))
+
+    def test_no_fractional_part(self):
+        self.assertEqual(zulu_2_ts('2018-02-28T17:43:07.Z'), strptime_zulu_2_ts('2018-02-28T17:43:07.Z'))
+        self.assertEqual(zulu_2_ts('2018-02-28T17:43:07Z'), datetime.datetime(2018, 2, 28, 17, 43, 7))
+
+    def test_malformed(self):
+        for zulu_ts in ('2018/02/28T17:43:07.123Z', '2018-02-28 17:43:07.123Z', '2018-02-28T17:43:07,123Z',
+                        '2018-02-28T17:43:07.12aZ', '2018-02-28T17:43Z', '2018-13-28T17:43:07.123Z'):
+            with self.assertRaises(ValueError, msg=zulu_ts):
+                zulu_2_ts(zulu_ts)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+import unittest
+from copy import deepcopy
+from threading import Event, Lock
+
+from dispatch import diff_snapshots, NodeDispatcher
+
+
+def snapshot():
+    return {
+        'structures': {'s1': {'name': 'Home', 'away': 'home'}},
+        'devices': {
+            'thermostats': {'t1': {'name': 'Hall', 'target_temperature_f': 68},
+                            't2': {'name': 'Den', 'target_temperature_f': 70}},
+            'smoke_co_alarms': {'p1': {'name': 'Hall', 'smoke_alarm_state': 'ok'}},
+        },
+        'metadata': {'client_version': 1},
+    }
+
+
+class DiffSnapshotsTest(unittest.TestCase):
+    def test_unchanged_elements_are_skipped(self):
+        old = snapshot()
+        changed, shared = diff_snapshots(old, deepcopy(old))
+        self.assertEqual(changed, set())
+        ''' Equal elements are shared with the previous snapshot '''
+        self.assertIs(shared['devices']['thermostats']['t1'], old['devices']['thermostats']['t1'])
+        self.assertIs(shared['structures']['s1'], old['structures']['s1'])
+        self.assertEqual(shared['metadata'], old['metadata'])
+
+    def test_changed_elements_are_reported(self):
+        old = snapshot()
+        new = deepcopy(old)
+        new['structures']['s1']['away'] = 'away'
+        new['devices']['thermostats']['t2']['target_temperature_f'] = 72
+        changed, shared = diff_snapshots(old, new)
+        self.assertEqual(changed, {('structures', 's1'), ('thermostats', 't2')})
+        self.assertIs(shared['devices']['thermostats']['t2'], new['devices']['thermostats']['t2'])
+        self.assertIs(shared['devices']['thermostats']['t1'], old['devices']['thermostats']['t1'])
+
+    def test_added_and_removed_elements_are_reported(self):
+        old = snapshot()
+        new = deepcopy(old)
+        new['structures']['s2'] = {'name': 'Cabin', 'away': 'away'}
+        new['devices']['cameras'] = {'c1': {'name': 'Door', 'is_streaming': True}}
+        del new['devices']['thermostats']['t1']
+        del new['devices']['smoke_co_alarms']
+        changed, shared = diff_snapshots(old, new)
+        self.assertEqual(changed, {('structures', 's2'), ('cameras', 'c1'),
+                                   ('thermostats', 't1'), ('smoke_co_alarms', 'p1')})
+
+    def test_first_and_empty_snapshots(self):
+        new = snapshot()
+        changed, shared = diff_snapshots(None, new)
+        self.assertEqual(changed, {('structures', 's1'), ('thermostats', 't1'), ('thermostats', 't2'),
+                                   ('smoke_co_alarms', 'p1')})
+        changed, shared = diff_snapshots(new, {})
+        self.assertEqual(len(changed), 4)
+        self.assertEqual(shared, {})
+
+    def test_new_data_is_not_modified(self):
+        old = snapshot()
+        new = deepcopy(old)
+        new['devices']['thermostats']['t2']['target_temperature_f'] = 72
+        before = {element_id: id(element) for element_id, element in new['devices']['thermostats'].items()}
+        diff_snapshots(old, new)
+        self.assertEqual({element_id: id(element) for element_id, element in new['devices']['thermostats'].items()}, before)
+
+
+class Gate(object):
+    ''' Update function for the dispatcher, runs of the nodes in hold block until released '''
+    def __init__(self, hold=()):
+        self.hold = set(hold)
+        self.released = Event()
+        self.started = Event()
+        self.runs = []
+        self.active = set()
+        self.overlaps = 0
+        self.lock = Lock()
+
+    def __call__(self, node):
+        with self.lock:
+            if node in self.active:
+                self.overlaps += 1
+            self.active.add(node)
+            self.runs.append(node)
+        if node in self.hold:
+            self.started.set()
+            self.released.wait(5)
+        with self.lock:
+            self.active.discard(node)
+
+
+class NodeDispatcherTest(unittest.TestCase):
+    def dispatcher(self, gate, workers=1):
+        dispatcher = NodeDispatcher(gate, workers=workers)
+        dispatcher.start()
+        self.addCleanup(dispatcher.stop)
+        return dispatcher
+
+    def test_latest_wins(self):
+        ''' A node submitted again before its update started runs once '''
+        gate = Gate(hold=['busy'])
+        dispatcher = self.dispatcher(gate)
+        dispatcher.submit('busy')
+        self.assertTrue(gate.started.wait(5))
+        for _ in range(3):
+            dispatcher.submit('a')
+        self.assertEqual(len(dispatcher), 1)
+        gate.released.set()
+        self.assertTrue(dispatcher.join(5))
+        self.assertEqual(gate.runs, ['busy', 'a'])
+        self.assertEqual(dispatcher.stats, {'submitted': 4, 'dropped': 2, 'done': 2})
+
+    def test_submit_while_running_reruns_once(self):
+        gate = Gate(hold=['a'])
+        dispatcher = self.dispatcher(gate, workers=2)
+        dispatcher.submit('a')
+        self.assertTrue(gate.started.wait(5))
+        for _ in range(3):
+            dispatcher.submit('a')
+        gate.released.set()
+        self.assertTrue(dispatcher.join(5))
+        self.assertEqual(gate.runs, ['a', 'a'])
+        self.assertEqual(gate.overlaps, 0)
+        self.assertEqual(dispatcher.stats['dropped'], 2)
+
+    def test_priority_goes_first(self):
+        gate = Gate(hold=['busy'])
+        dispatcher = self.dispatcher(gate)
+        dispatcher.submit('busy')
+        self.assertTrue(gate.started.wait(5))
+        dispatcher.submit('a')
+        dispatcher.submit('b')
+        dispatcher.submit('alarm', priority=True)
+        ''' A waiting node submitted with priority moves to the front '''
+        dispatcher.submit('b', priority=True)
+        gate.released.set()
+        self.assertTrue(dispatcher.join(5))
+        self.assertEqual(gate.runs, ['busy', 'b', 'alarm', 'a'])
+
+    def test_join_and_stop(self):
+        gate = Gate(hold=['busy'])
+        dispatcher = self.dispatcher(gate, workers=2)
+        dispatcher.submit('busy')
+        self.assertTrue(gate.started.wait(5))
+        self.assertFalse(dispatcher.join(0.05))
+        gate.released.set()
+        self.assertTrue(dispatcher.join(5))
+        threads = list(dispatcher._threads)
+        dispatcher.stop()
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertEqual(dispatcher._threads, [])
+
+    def test_failed_update_does_not_stop_the_worker(self):
+        runs = []
+
+        def run(node):
+            runs.append(node)
+            if node == 'bad':
+                raise ValueError(node)
+        dispatcher = self.dispatcher(run)
+        dispatcher.submit('bad')
+        dispatcher.submit('good')
+        self.assertTrue(dispatcher.join(5))
+        self.assertEqual(runs, ['bad', 'good'])
+
+    def test_inline_without_workers(self):
+        gate = Gate()
+        dispatcher = NodeDispatcher(gate, workers=0)
+        dispatcher.submit('a')
+        dispatcher.submit('a')
+        self.assertEqual(gate.runs, ['a', 'a'])
+        self.assertEqual(dispatcher.stats['done'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
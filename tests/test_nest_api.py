@@ -0,0 +1,75 @@
+import socket
+import unittest
+from threading import Thread
+
+import nest_api
+
+OK = b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\n{}'
+
+
+class ScriptedServer(object):
+    ''' Answers one request per accepted connection with the next action: 'ok', 'reset' or 'hang' '''
+    def __init__(self, actions):
+        self.actions = list(actions)
+        self.requests = 0
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.url = 'http://127.0.0.1:{}'.format(self.sock.getsockname()[1])
+        self.conns = []
+        Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while self.actions:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.conns.append(conn)
+            conn.recv(65536)
+            self.requests += 1
+            action = self.actions.pop(0)
+            if action == 'ok':
+                conn.sendall(OK)
+            elif action == 'reset':
+                conn.close()
+
+    def close(self):
+        self.sock.close()
+        for conn in self.conns:
+            conn.close()
+
+
+class RetryTest(unittest.TestCase):
+    def setUp(self):
+        self.timeout = nest_api.TIMEOUT
+        nest_api.TIMEOUT = 0.3
+
+    def tearDown(self):
+        nest_api.TIMEOUT = self.timeout
+        self.server.close()
+
+    def request(self, actions, method):
+        self.server = ScriptedServer(actions)
+        api = nest_api.ApiConnection(self.server.url)
+        try:
+            return api.request(method, '/devices', b'{}' if method == 'PUT' else None)
+        finally:
+            api.close()
+
+    def test_reset_is_retried(self):
+        self.assertEqual(self.request(['reset', 'ok'], 'PUT'), (200, b'{}'))
+        self.assertEqual(self.server.requests, 2)
+
+    def test_put_timeout_is_not_retried(self):
+        with self.assertRaises(socket.timeout):
+            self.request(['hang', 'ok'], 'PUT')
+        self.assertEqual(self.server.requests, 1)
+
+    def test_get_timeout_is_retried(self):
+        self.assertEqual(self.request(['hang', 'ok'], 'GET'), (200, b'{}'))
+        self.assertEqual(self.server.requests, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
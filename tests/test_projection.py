@@ -0,0 +1,109 @@
+import unittest
+
+from projection import merge, resolve, parse_scopes, restrict, ROOT_SCOPE
+
+PROJECTION = {'structures': {'name': None, 'away': None},
+              'thermostats': {'name': None, 'target_temperature_f': None},
+              'cameras': {'name': None, 'last_event': {'start_time'}}}
+
+
+def snapshot():
+    return {
+        'structures': {'s1': {'name': 'Home', 'away': 'home', 'wheres': {}},
+                       's2': {'name': 'Cabin', 'away': 'away', 'wheres': {}}},
+        'devices': {
+            'thermostats': {'t1': {'name': 'Hall', 'target_temperature_f': 68, 'humidity': 40},
+                            't2': {'name': 'Den', 'target_temperature_f': 70, 'humidity': 45}},
+            'cameras': {'c1': {'name': 'Door', 'last_event': {'start_time': 'x', 'urls_expire_time': 'y'}}},
+        },
+        'metadata': {'access_token': 'c.sim'},
+    }
+
+
+class ResolveTest(unittest.TestCase):
+    def test_root_scope_keeps_path(self):
+        self.assertEqual(resolve(ROOT_SCOPE, '/'), '/')
+        self.assertEqual(resolve(ROOT_SCOPE, '/structures/s1/away'), '/structures/s1/away')
+
+    def test_absolute_paths(self):
+        self.assertEqual(resolve('/devices/thermostats', '/devices/thermostats'), '/devices/thermostats')
+        self.assertEqual(resolve('/devices/thermostats', '/devices/thermostats/t1'), '/devices/thermostats/t1')
+
+    def test_relative_paths(self):
+        self.assertEqual(resolve('/devices/thermostats', '/'), '/devices/thermostats')
+        self.assertEqual(resolve('/devices/thermostats', '/t1'), '/devices/thermostats/t1')
+        self.assertEqual(resolve('/structures', '/s1/away'), '/structures/s1/away')
+
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        self.data = restrict(snapshot(), (ROOT_SCOPE,), PROJECTION)
+
+    def test_root_put_is_projected(self):
+        self.assertEqual(self.data['devices']['thermostats']['t1'], {'name': 'Hall', 'target_temperature_f': 68})
+        self.assertEqual(self.data['devices']['cameras']['c1']['last_event'], {'start_time': 'x'})
+        self.assertNotIn('metadata', self.data)
+
+    def test_put_below_one_element(self):
+        merged = merge(self.data, '/structures/s1/away', 'away', PROJECTION)
+        self.assertEqual(merged['structures']['s1'], {'name': 'Home', 'away': 'away'})
+        ''' The previous snapshot is not modified, everything outside the path is shared '''
+        self.assertEqual(self.data['structures']['s1']['away'], 'home')
+        self.assertIs(merged['structures']['s2'], self.data['structures']['s2'])
+        self.assertIs(merged['devices'], self.data['devices'])
+
+    def test_put_of_one_element_is_projected(self):
+        merged = merge(self.data, '/devices/thermostats/t2', {'name': 'Den', 'target_temperature_f': 72, 'humidity': 50},
+                       PROJECTION)
+        self.assertEqual(merged['devices']['thermostats']['t2'], {'name': 'Den', 'target_temperature_f': 72})
+        self.assertIs(merged['devices']['thermostats']['t1'], self.data['devices']['thermostats']['t1'])
+        self.assertIs(merged['devices']['cameras'], self.data['devices']['cameras'])
+        self.assertIs(merged['structures'], self.data['structures'])
+
+    def test_put_of_a_kind(self):
+        merged = merge(self.data, '/devices/thermostats', {'t3': {'name': 'Attic', 'target_temperature_f': 60}},
+                       PROJECTION)
+        self.assertEqual(set(merged['devices']['thermostats']), {'t3'})
+        self.assertIs(merged['devices']['cameras'], self.data['devices']['cameras'])
+
+    def test_deletion(self):
+        merged = merge(self.data, '/devices/thermostats/t1', None, PROJECTION)
+        self.assertEqual(set(merged['devices']['thermostats']), {'t2'})
+        self.assertIn('t1', self.data['devices']['thermostats'])
+        ''' A removed container stays as an empty one '''
+        merged = merge(self.data, '/devices/cameras', None, PROJECTION)
+        self.assertEqual(merged['devices']['cameras'], {})
+        merged = merge(self.data, '/structures/s1/away', None, PROJECTION)
+        self.assertEqual(merged['structures']['s1'], {'name': 'Home'})
+
+    def test_path_outside_structures_and_devices(self):
+        self.assertIs(merge(self.data, '/metadata', {'access_token': 'c.new'}, PROJECTION), self.data)
+
+    def test_first_put_of_a_scope(self):
+        merged = merge(None, '/devices/thermostats', snapshot()['devices']['thermostats'], PROJECTION)
+        self.assertEqual(merged['structures'], {})
+        self.assertEqual(set(merged['devices']['thermostats']), {'t1', 't2'})
+
+
+class ScopesTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(parse_scopes(' /structures, devices/thermostats/ ,, /structures'),
+                         ('/structures', '/devices/thermostats'))
+        self.assertEqual(parse_scopes('/devices/thermostats/t1'), ('/devices/thermostats/t1',))
+        self.assertEqual(parse_scopes(''), (ROOT_SCOPE,))
+        self.assertEqual(parse_scopes(None), (ROOT_SCOPE,))
+        self.assertEqual(parse_scopes('/structures, /'), (ROOT_SCOPE,))
+
+    def test_rejected(self):
+        for value in ('/metadata', '/devices/thermostats/t1/name', '/structures/s1/away', '/cameras'):
+            with self.assertRaises(ValueError, msg=value):
+                parse_scopes(value)
+
+    def test_restrict(self):
+        restricted = restrict(snapshot(), ('/structures', '/devices/thermostats/t1'), PROJECTION)
+        self.assertEqual(set(restricted['structures']), {'s1', 's2'})
+        self.assertEqual(restricted['devices'], {'thermostats': {'t1': {'name': 'Hall', 'target_temperature_f': 68}}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import nest_sim
+import recorder
+import replay
+from recorder import SessionRecorder, read_session, session_files
+from tests.home import put_event
+
+
+class RecorderTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='nest2-recorder-')
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = Path(self.dir) / 'stream.jsonl.gz'
+        ''' Flush, and so check the size, on every event '''
+        patcher = mock.patch.object(recorder, 'FLUSH_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_round_trip(self):
+        session = SessionRecorder(self.path)
+        session.record('put', '{"path": "/", "data": {}}')
+        session.record('keep-alive', 'null')
+        session.record('put', '{"path": "/", "data": {"away": "away"}}', '/structures')
+        session.record('put', '{"path": "/", "data": {}}', account='cabin')
+        session.close()
+        events = [(event_type, data, scope, account) for ts, event_type, data, scope, account in read_session(self.path)]
+        self.assertEqual(events, [('put', '{"path": "/", "data": {}}', '/', None), ('keep-alive', 'null', '/', None),
+                                  ('put', '{"path": "/", "data": {"away": "away"}}', '/structures', None),
+                                  ('put', '{"path": "/", "data": {}}', '/', 'cabin')])
+
+    def test_rotation_keeps_order_and_drops_oldest(self):
+        ''' Every event fills a file, so each one ends up in its own backup '''
+        session = SessionRecorder(self.path, max_bytes=1, backups=3)
+        for index in range(6):
+            session.record('put', str(index))
+        session.close()
+        self.assertEqual([path.name for path in session_files(self.path)],
+                         ['stream.jsonl.gz.3', 'stream.jsonl.gz.2', 'stream.jsonl.gz.1'])
+        self.assertFalse(os.path.exists('{}.4'.format(self.path)))
+        ''' Events 0 to 2 were rotated out, the rest replays oldest first '''
+        self.assertEqual([data for ts, event_type, data, scope, account in read_session(self.path)], ['3', '4', '5'])
+
+    def test_rotated_and_current_file(self):
+        session = SessionRecorder(self.path, max_bytes=1, backups=2)
+        session.record('put', 'a')
+        session.record('put', 'b')
+        session.max_bytes = 1024 * 1024
+        session.record('put', 'c')
+        session.record('put', 'd')
+        session.close()
+        self.assertEqual([path.name for path in session_files(self.path)],
+                         ['stream.jsonl.gz.2', 'stream.jsonl.gz.1', 'stream.jsonl.gz'])
+        self.assertEqual([data for ts, event_type, data, scope, account in read_session(self.path)], ['a', 'b', 'c', 'd'])
+
+    def test_truncated_tail_is_skipped(self):
+        ''' A crash leaves the file cut off after the last flush '''
+        session = SessionRecorder(self.path)
+        for index in range(20):
+            session.record('put', '{}'.format(index) * 50)
+        session.close()
+        size = self.path.stat().st_size
+        with open(str(self.path), 'r+b') as f:
+            f.truncate(size - 40)
+        with self.assertLogs(recorder.LOGGER, 'WARNING'):
+            events = [data for ts, event_type, data, scope, account in read_session(self.path)]
+        self.assertGreater(len(events), 0)
+        self.assertEqual(events, ['{}'.format(index) * 50 for index in range(len(events))])
+
+    def test_replay_routes_accounts(self):
+        session = SessionRecorder(self.path)
+        session.record('put', put_event(nest_sim.make_home(thermostats=1, protects=1, cameras=0, seed=1)))
+        session.record('put', put_event(nest_sim.make_home(thermostats=2, protects=0, cameras=0, seed=2)), account='cabin')
+        session.close()
+        result = replay.replay(self.path)
+        self.assertEqual(result['accounts'], 2)
+        ''' 2 structures, 3 thermostats and a Protect '''
+        self.assertEqual(result['nodes'], 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import time
+import unittest
+from threading import Event
+
+from scheduler import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = Scheduler()
+        self.fired = []
+        self.done = Event()
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def callback(self, name, last=False):
+        def fire():
+            self.fired.append(name)
+            if last:
+                self.done.set()
+        return fire
+
+    def test_fires_in_time_order(self):
+        now = time.time()
+        self.scheduler.schedule('c', now + 0.15, self.callback('c', last=True))
+        self.scheduler.schedule('a', now + 0.05, self.callback('a'))
+        self.scheduler.schedule('b', now + 0.1, self.callback('b'))
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['a', 'b', 'c'])
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertEqual(self.scheduler.stats['fired'], 3)
+
+    def test_replace_by_key(self):
+        ''' Scheduling a key again replaces its timer, time and callback '''
+        now = time.time()
+        self.scheduler.start()
+        self.scheduler.schedule(('n1', 'GV1'), now + 60, self.callback('old'))
+        self.scheduler.schedule(('n1', 'GV1'), now + 0.05, self.callback('new', last=True))
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.due(('n1', 'GV1')), now + 0.05)
+        self.assertTrue(self.done.wait(5))
+        time.sleep(0.05)
+        self.assertEqual(self.fired, ['new'])
+        ''' Same time, new callback '''
+        self.done.clear()
+        later = time.time() + 0.05
+        self.scheduler.schedule('k', later, self.callback('first'))
+        self.scheduler.schedule('k', later, self.callback('second', last=True))
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['new', 'second'])
+
+    def test_cancel_by_key(self):
+        now = time.time()
+        self.scheduler.schedule('gone', now + 0.05, self.callback('gone'))
+        self.scheduler.schedule('kept', now + 0.1, self.callback('kept', last=True))
+        self.scheduler.cancel('gone')
+        self.scheduler.cancel('unknown')
+        self.assertIsNone(self.scheduler.due('gone'))
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['kept'])
+
+    def test_compaction_after_cancellations(self):
+        now = time.time()
+        for index in range(500):
+            self.scheduler.schedule(index, now + 3600 + index, self.callback(index))
+        for index in range(500):
+            self.scheduler.cancel(index)
+        ''' Cancelled timers stay in the heap until the next schedule compacts it '''
+        self.assertEqual(len(self.scheduler._heap), 500)
+        self.scheduler.schedule('last', now + 0.05, self.callback('last', last=True))
+        self.assertEqual(len(self.scheduler._heap), 1)
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['last'])
+
+    def test_failing_callback_keeps_running(self):
+        def fail():
+            raise ValueError('timer')
+        now = time.time()
+        self.scheduler.schedule('bad', now + 0.02, fail)
+        self.scheduler.schedule('good', now + 0.05, self.callback('good', last=True))
+        self.scheduler.start()
+        self.assertTrue(self.done.wait(5))
+        self.assertEqual(self.fired, ['good'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import time
+import unittest
+from copy import deepcopy
+
+from tests import home
+
+
+class PendingSetpointTest(unittest.TestCase):
+    def setUp(self):
+        self.poly, self.controller = home.make_controller(structures=1, thermostats=1, protects=0, cameras=0)
+        self.data = deepcopy(home.sim().data)
+        self.tstat_id, tstat = next(iter(self.data['devices']['thermostats'].items()))
+        tstat['hvac_mode'] = 'heat'
+        tstat['target_temperature_f'] = 68
+        home.sim().data = deepcopy(self.data)
+        self.controller.discover()
+        self.controller.account.start()
+        self.put(self.data)
+        self.node = self.controller.account.element_index['thermostats'][self.tstat_id]
+
+    def tearDown(self):
+        home.stop(self.controller)
+
+    def put(self, data):
+        self.controller.account.processEvent('put', home.put_event(data))
+        self.controller.dispatcher.join()
+
+    def brt(self):
+        self.controller.nodes[self.node.address].runCmd({'cmd': 'BRT', 'address': self.node.address})
+
+    def reported(self):
+        return home.sim().data['devices']['thermostats'][self.tstat_id]['target_temperature_f']
+
+    def setpoints(self):
+        return [details['value'] for ts, call, details in self.poly.calls
+                if call == 'setDriver' and details['address'] == self.node.address and details['driver'] == 'CLISPH']
+
+    def test_brt_accumulates_over_stale_put(self):
+        ''' A put still carrying the old setpoint must not undo the first BRT '''
+        self.brt()
+        stale = deepcopy(self.data)
+        stale['devices']['thermostats'][self.tstat_id]['ambient_temperature_f'] += 1
+        self.put(stale)
+        self.assertEqual(self.node.sp, 69)
+        self.brt()
+        self.assertEqual(self.node.sp, 70)
+        self.assertEqual(self.setpoints()[-1], 70)
+        self.assertNotIn(68, self.setpoints()[-2:])
+        self.assertEqual(self.controller.command_tracker.requested(self.node), {'target_temperature_f': 70})
+        ''' Both steps reach Nest, merged into one PUT or as two '''
+        deadline = time.time() + 5
+        while time.time() < deadline and self.reported() != 70:
+            time.sleep(0.05)
+        self.assertEqual(self.reported(), 70)
+
+    def test_confirmed_setpoint_follows_nest(self):
+        ''' Once Nest reports the change the setpoint comes from the stream again '''
+        self.brt()
+        confirmed = deepcopy(self.data)
+        confirmed['devices']['thermostats'][self.tstat_id]['target_temperature_f'] = 69
+        self.put(confirmed)
+        self.assertEqual(self.controller.command_tracker.requested(self.node), {})
+        later = deepcopy(confirmed)
+        later['devices']['thermostats'][self.tstat_id]['target_temperature_f'] = 72
+        self.put(later)
+        self.assertEqual(self.node.sp, 72)
+
+
+if __name__ == '__main__':
+    unittest.main()